@@ -0,0 +1,4776 @@
+from machine import Pin, UART, I2C, ADC
+import machine
+import time
+
+# First statement after time is available: main.py records when it started
+# importing this module, so the difference is the compile/load cost of this
+# file (source vs precompiled .mpy).
+_boot_module_start_ms = time.ticks_ms()
+
+import utime
+import ujson
+import os
+import io
+import sys
+import gc
+import math
+import ubinascii
+import micropython
+from micropython import const
+import BME280
+
+try:
+    import uhashlib
+except ImportError:
+    uhashlib = None
+
+# Streaming decompression: "deflate" on MicroPython 1.21+, "uzlib" before.
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+try:
+    import uzlib
+except ImportError:
+    uzlib = None
+
+# Cooperative scheduler; without it the firmware runs the superloop.
+try:
+    import uasyncio as asyncio
+except ImportError:
+    asyncio = None
+
+# Second core for the LIDAR sampler; without it the LIDAR is read inline.
+try:
+    import _thread
+except ImportError:
+    _thread = None
+import adafruit_simplemath
+
+# Started after hardware initialization. Calls made before then are harmless.
+wdt = None
+
+
+def feed_watchdog():
+    try:
+        if wdt is not None:
+            wdt.feed()
+    except Exception:
+        pass
+
+# ----------------------------
+# Firmware version / UART updater
+# ----------------------------
+FW_VERSION = "1.0.14-qualified-inputs-stop-disabled"
+UPDATE_MODE = False
+
+# Diagnostics build. The stats replies (uart_stats, msg_stats, tx_stats,
+# telemetry_stats, sched_stats, sample_stats) and the bench commands
+# (telemetry_bench, lidar_bench, lidar_alloc_bench, lidar_profile_bench)
+# are only compiled in when this is 1; the counters behind them stay.
+DEBUG_STATS = const(0)
+
+# main.py is only a loader; the controller is garage.py, or garage.mpy when a
+# precompiled build is installed. Drivers may be shipped as source or .mpy.
+# A file is staged as <name>.new and the file it replaces is kept as
+# <name>.bak. MicroPython imports X.py in preference to X.mpy, so installing
+# one form of a module moves the other form aside to its own .bak.
+UPDATE_TARGET_FILE = "garage.py"
+UPDATE_LOADER_FILE = "main.py"
+UPDATE_MODULES = ("garage", "BME280", "PiicoDev_Unified", "PiicoDev_VL53L1X")
+UPDATE_DATA_FILES = ("version.json",)
+UPDATE_NEW_SUFFIX = ".new"
+UPDATE_BAK_SUFFIX = ".bak"
+
+# Bundles: {"cmd":"update_start","bundle":[{"filename","size","checksum"},..]}
+# streams several files back to back in one session. Each file is staged and
+# checked against its own digest as soon as its last byte is written; nothing
+# is installed until every file has passed, then all are swapped in together
+# (rolled back if any rename fails) before a single soft reset.
+UPDATE_BUNDLE_MAX_FILES = 8
+
+# Resume sidecar for plain (uncompressed, non-delta) transfers. It records
+# the target, the bytes of its staging file known to be on flash and the
+# digest state at that offset, so {"cmd":"update_resume"} can continue after
+# a UART failure, a Pi reboot or a Pico reset instead of starting from seq 0.
+UPDATE_STATE_FILE = "update.upd"
+UPDATE_CHECKPOINT_BYTES = 8192
+
+# Binary update mode, negotiated with {"cmd":"update_start","mode":"bin"}.
+# Each frame is: magic, type, seq (u16 LE), length (u16 LE), payload,
+# CRC32 (u32 LE) over everything before the CRC. Replies remain JSON lines.
+UPDATE_FRAME_MAGIC = 0xA5
+UPDATE_FRAME_DATA = 0x01
+UPDATE_FRAME_END = 0x02
+UPDATE_FRAME_CANCEL = 0x03
+UPDATE_FRAME_HEADER_LEN = 6
+UPDATE_FRAME_CRC_LEN = 4
+UPDATE_FRAME_MAX_PAYLOAD = 1024
+UPDATE_MAX_LINE_IN_BINARY = 256
+
+# Sliding window, negotiated with "window": n in update_start. With n > 1 the
+# sender may have n chunks in flight; out-of-order chunks inside the window
+# are held in RAM and every chunk is answered with a cumulative ack carrying
+# the next expected seq plus the seqs already held (selective ack).
+# n == 1 keeps the original stop-and-wait chunk_ok/bad_seq behaviour.
+UPDATE_MAX_WINDOW = 8
+
+# littlefs block size on the RP2040 flash. The staging file is written in
+# whole blocks so littlefs never has to rewrite a partially filled block.
+UPDATE_FLASH_BLOCK_SIZE = 4096
+
+# Update digest, chosen with "digest" in update_start: "crc32" (default,
+# 8 hex digits) or "sha256" (64 hex digits, needs uhashlib). update_end
+# re-reads the staged file in UPDATE_VERIFY_BLOCK_SIZE blocks and checks the
+# digest again before it is installed.
+UPDATE_DIGESTS = ("crc32", "sha256")
+UPDATE_VERIFY_BLOCK_SIZE = 1024
+
+# Compressed payloads, chosen with "compression": "zlib" or "deflate" (raw)
+# in update_start. "size" and "checksum" describe the uncompressed file and
+# "csize" the compressed stream. The window is bounded by "wbits" so RAM use
+# is fixed: 2**wbits bytes of history plus the two buffers below.
+UPDATE_COMPRESSIONS = ("zlib", "deflate")
+UPDATE_INFLATE_WBITS = 10
+UPDATE_INFLATE_MAX_WBITS = 12
+UPDATE_INFLATE_OUT_SIZE = 256
+# Compressed bytes kept buffered before inflating, so the decompressor never
+# reaches the end of its input in the middle of a block until update_end.
+UPDATE_INFLATE_MARGIN = 1024
+
+# Delta payloads, chosen with "delta_base" (the target itself or its .bak)
+# plus "base_checksum" (digest of that file) in update_start. The payload,
+# after any decompression, is a stream of ops applied against the base file:
+#   0x01 offset:u32 length:u32   copy bytes from the base file
+#   0x02 length:u32 data         insert literal bytes
+UPDATE_DELTA_COPY = 0x01
+UPDATE_DELTA_INSERT = 0x02
+
+# Faster link for the transfer, asked for with "baud" in update_start or
+# update_resume. "ready" is sent at UART_BAUD and names the rate; both ends
+# then switch and the Pi confirms with {"cmd":"update_baud"} at the new rate.
+# Without that handshake in time, after UPDATE_BAUD_LINE_ERRORS corrupt frames
+# in a row (UPDATE_LINE_ERROR_REASONS; a bad_seq or a flash error says nothing
+# about the line), or when no chunk has arrived for UPDATE_BAUD_IDLE_MS, the
+# Pico sends "baud_fallback" at both rates and continues the session at
+# UART_BAUD. It returns to UART_BAUD once
+# the session ends, whatever the outcome.
+UPDATE_BAUDS = (460800, 921600)
+UPDATE_BAUD_HANDSHAKE_MS = 1000
+UPDATE_BAUD_IDLE_MS = 1500
+UPDATE_BAUD_LINE_ERRORS = 3
+UPDATE_LINE_ERROR_REASONS = ("bad_crc",)
+
+# Raised rate while it is in use, otherwise None.
+_update_baud = None
+_update_baud_deadline_ms = None
+_update_baud_seen_ms = 0
+_update_line_errors = 0   # corrupt frames since the last good chunk
+
+# Active UpdateSession while UPDATE_MODE is True, otherwise None.
+_update_session = None
+
+_crc32_table = None
+
+
+def _crc32_table_driven(data, crc):
+    """Fallback for builds without ubinascii.crc32."""
+    global _crc32_table
+    if _crc32_table is None:
+        table = []
+        for i in range(256):
+            c = i
+            for _ in range(8):
+                c = (c >> 1) ^ 0xEDB88320 if c & 1 else c >> 1
+            table.append(c)
+        _crc32_table = table
+
+    table = _crc32_table
+    crc ^= 0xFFFFFFFF
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def update_crc32(data, crc=0):
+    """Standard (zlib) CRC32 of data, continuing from crc."""
+    try:
+        return ubinascii.crc32(data, crc) & 0xFFFFFFFF
+    except AttributeError:
+        return _crc32_table_driven(data, crc)
+
+
+class UpdateDigest:
+    """Incremental update digest that also times its own work."""
+    def __init__(self, algo="crc32"):
+        self.algo = algo
+        self.crc = 0
+        self._h = uhashlib.sha256() if algo == "sha256" else None
+        self.bytes = 0
+        self.us = 0
+
+    def update(self, data):
+        t0 = time.ticks_us()
+        if self._h is not None:
+            self._h.update(data)
+        else:
+            self.crc = update_crc32(data, self.crc)
+        self.us += time.ticks_diff(time.ticks_us(), t0)
+        self.bytes += len(data)
+
+    def hexdigest(self):
+        # uhashlib objects can only produce their digest once.
+        if self._h is not None:
+            return ubinascii.hexlify(self._h.digest()).decode()
+        return "%08x" % self.crc
+
+    def kbytes_per_s(self):
+        return (self.bytes * 1000) // (self.us or 1)
+
+
+def update_target_allowed(name):
+    if name == UPDATE_LOADER_FILE or name in UPDATE_DATA_FILES:
+        return True
+    for ext in (".py", ".mpy"):
+        if name.endswith(ext) and name[:-len(ext)] in UPDATE_MODULES:
+            return True
+    return False
+
+
+def update_twin_file(name):
+    """The other form of a module target (X.py <-> X.mpy), or None."""
+    if name == UPDATE_LOADER_FILE or name in UPDATE_DATA_FILES:
+        return None
+    if name.endswith(".mpy"):
+        return name[:-4] + ".py"
+    if name.endswith(".py"):
+        return name[:-3] + ".mpy"
+    return None
+
+
+def update_check_mpy(path):
+    """Reject .mpy files this firmware cannot import. Returns a reason or None."""
+    with open(path, "rb") as f:
+        header = f.read(4)
+    if len(header) < 4 or header[0] != 0x4D:  # 'M'
+        return "bad_mpy_header"
+    try:
+        sys_mpy = sys.implementation._mpy
+    except AttributeError:
+        return None
+    # Byte 1 is the bytecode version and the low two bits of byte 2 its
+    # sub-version; the importer rejects a mismatch in either.
+    if header[1] != (sys_mpy & 0xFF) or (header[2] & 0x03) != ((sys_mpy >> 8) & 0x03):
+        return "bad_mpy_version"
+    arch = header[2] >> 2
+    if arch and arch != ((sys_mpy >> 10) & 0x0F):
+        return "bad_mpy_arch"
+    return None
+
+
+def update_supported_digests():
+    if uhashlib is None or not hasattr(uhashlib, "sha256"):
+        return ("crc32",)
+    return UPDATE_DIGESTS
+
+
+def update_file_digest(path, algo, block_size=UPDATE_VERIFY_BLOCK_SIZE, limit=-1, digest=None):
+    """Stream a file (or its first `limit` bytes) back from flash and digest it."""
+    if digest is None:
+        digest = UpdateDigest(algo)
+    buf = bytearray(block_size)
+    mv = memoryview(buf)
+    with open(path, "rb") as f:
+        while limit:
+            want = block_size if limit < 0 or limit > block_size else limit
+            n = f.readinto(mv[:want])
+            if not n:
+                break
+            digest.update(mv[:n])
+            if limit > 0:
+                limit -= n
+    return digest
+
+
+class UpdateWriter:
+    """
+    Block-buffered writer for the update staging file.
+
+    The file stays open for the whole transfer. Incoming bytes are collected
+    in a preallocated block-sized buffer and only whole blocks are written;
+    the final partial block is written and synced once by close().
+    flash_writes counts file write calls so the saving can be checked on the
+    unix port as well as on the Pico.
+
+    on_flush(mv) is called with every span handed to the file, in order;
+    `flushed` is the file length those spans add up to. A non-zero offset
+    reopens an existing file and continues writing from there.
+    """
+    def __init__(self, path, block_size=UPDATE_FLASH_BLOCK_SIZE, offset=0, on_flush=None):
+        self.path = path
+        self.block_size = block_size
+        self._buf = bytearray(block_size)
+        self._mv = memoryview(self._buf)
+        self._fill = 0
+        self.flash_writes = 0
+        self.size = offset
+        self.flushed = offset
+        self._on_flush = on_flush
+        if offset:
+            self._f = open(path, "r+b")
+            self._f.seek(offset)
+        else:
+            self._f = open(path, "wb")
+
+    def _write_out(self, mv):
+        self._f.write(mv)
+        self.flash_writes += 1
+        self.flushed += len(mv)
+        if self._on_flush is not None:
+            self._on_flush(mv)
+
+    def write(self, data):
+        src = memoryview(data)
+        n = len(src)
+        off = 0
+        while off < n:
+            if self._fill == 0 and n - off >= self.block_size:
+                # Whole block available in the source; write it directly.
+                self._write_out(src[off:off + self.block_size])
+                off += self.block_size
+                continue
+
+            take = self.block_size - self._fill
+            if take > n - off:
+                take = n - off
+            self._mv[self._fill:self._fill + take] = src[off:off + take]
+            self._fill += take
+            off += take
+            if self._fill == self.block_size:
+                self._flush_block()
+        self.size += n
+
+    def _flush_block(self):
+        if self._fill:
+            # Reset first: on_flush may checkpoint, which must not recurse here.
+            n = self._fill
+            self._fill = 0
+            self._write_out(self._mv[:n])
+
+    def sync(self):
+        """Commit blocks written so far; buffered bytes are not written."""
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        """Write the final partial block and sync once."""
+        if self._f is None:
+            return
+        self._flush_block()
+        self._f.flush()
+        self._f.close()
+        self._f = None
+        try:
+            os.sync()
+        except Exception:
+            pass
+
+    def abort(self):
+        """Close without writing buffered bytes."""
+        if self._f is None:
+            return
+        try:
+            self._f.close()
+        except Exception:
+            pass
+        self._f = None
+
+
+def update_supported_compressions():
+    if deflate is None and uzlib is None:
+        return ()
+    return UPDATE_COMPRESSIONS
+
+
+class _InflateSource(io.IOBase):
+    """Fixed-size stream the decompressor reads compressed bytes from."""
+    def __init__(self, size):
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+        self._r = 0
+        self._w = 0
+
+    def available(self):
+        return self._w - self._r
+
+    def space(self):
+        return len(self._buf) - self.available()
+
+    def push(self, data):
+        n = len(data)
+        if self._w + n > len(self._buf):
+            # Move the unread tail to the front; it is at most the margin.
+            left = self._w - self._r
+            self._mv[0:left] = self._mv[self._r:self._w]
+            self._r = 0
+            self._w = left
+        self._mv[self._w:self._w + n] = data
+        self._w += n
+
+    def readinto(self, buf):
+        n = len(buf)
+        if n > self._w - self._r:
+            n = self._w - self._r
+        buf[:n] = self._mv[self._r:self._r + n]
+        self._r += n
+        return n
+
+
+class UpdateInflater:
+    """Incremental zlib/raw-deflate decoder with a bounded window."""
+    def __init__(self, compression, wbits):
+        self.compression = compression
+        self.wbits = wbits
+        self._src = _InflateSource(UPDATE_INFLATE_MARGIN + UPDATE_FRAME_MAX_PAYLOAD)
+        self._out = bytearray(UPDATE_INFLATE_OUT_SIZE)
+        self._out_mv = memoryview(self._out)
+        self._d = None
+
+    def _decoder(self):
+        # Created lazily: uzlib parses the zlib header in its constructor.
+        if self._d is None:
+            if deflate is not None:
+                fmt = deflate.ZLIB if self.compression == "zlib" else deflate.RAW
+                self._d = deflate.DeflateIO(self._src, fmt, self.wbits)
+            else:
+                wbits = self.wbits if self.compression == "zlib" else -self.wbits
+                self._d = uzlib.DecompIO(self._src, wbits)
+        return self._d
+
+    def _drain(self, sink, final):
+        while final or self._src.available() > UPDATE_INFLATE_MARGIN:
+            n = self._decoder().readinto(self._out)
+            if not n:
+                break
+            sink(self._out_mv[:n])
+
+    def feed(self, data, sink):
+        mv = memoryview(data)
+        off = 0
+        while off < len(mv):
+            take = self._src.space()
+            if take > len(mv) - off:
+                take = len(mv) - off
+            self._src.push(mv[off:off + take])
+            off += take
+            self._drain(sink, False)
+
+    def finish(self, sink):
+        self._drain(sink, True)
+
+
+class UpdateDelta:
+    """
+    Applies a copy/insert op stream against a base file. Ops may be split
+    across chunks; the base file is read in UPDATE_VERIFY_BLOCK_SIZE blocks
+    and is never loaded whole.
+    """
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self._base = open(base_path, "rb")
+        self._hdr = bytearray(9)
+        self._hdr_fill = 0
+        self._hdr_need = 0
+        self._insert_left = 0
+        self._buf = bytearray(UPDATE_VERIFY_BLOCK_SIZE)
+        self._mv = memoryview(self._buf)
+        self.ops = 0
+
+    def _copy(self, offset, length, sink):
+        self._base.seek(offset)
+        block = len(self._buf)
+        while length:
+            n = self._base.readinto(self._mv[:length if length < block else block])
+            if not n:
+                raise ValueError("delta copy past end of base")
+            sink(self._mv[:n])
+            length -= n
+
+    def feed(self, data, sink):
+        mv = memoryview(data)
+        n = len(mv)
+        off = 0
+        while off < n:
+            if self._insert_left:
+                take = self._insert_left
+                if take > n - off:
+                    take = n - off
+                sink(mv[off:off + take])
+                self._insert_left -= take
+                off += take
+                continue
+
+            if self._hdr_fill == 0:
+                op = mv[off]
+                if op == UPDATE_DELTA_COPY:
+                    self._hdr_need = 9
+                elif op == UPDATE_DELTA_INSERT:
+                    self._hdr_need = 5
+                else:
+                    raise ValueError("bad delta op " + str(op))
+
+            take = self._hdr_need - self._hdr_fill
+            if take > n - off:
+                take = n - off
+            self._hdr[self._hdr_fill:self._hdr_fill + take] = mv[off:off + take]
+            self._hdr_fill += take
+            off += take
+            if self._hdr_fill < self._hdr_need:
+                continue
+
+            self._hdr_fill = 0
+            self.ops += 1
+            hdr = self._hdr
+            first = hdr[1] | (hdr[2] << 8) | (hdr[3] << 16) | (hdr[4] << 24)
+            if hdr[0] == UPDATE_DELTA_COPY:
+                self._copy(first, hdr[5] | (hdr[6] << 8) | (hdr[7] << 16) | (hdr[8] << 24), sink)
+            else:
+                self._insert_left = first
+
+    def finish(self):
+        self.close()
+        if self._insert_left or self._hdr_fill:
+            raise ValueError("truncated delta")
+
+    def close(self):
+        if self._base is not None:
+            try:
+                self._base.close()
+            except Exception:
+                pass
+            self._base = None
+
+
+class UpdateSession:
+    """
+    State for one firmware transfer, from update_start to end/cancel.
+    The digest covers bytes as they are handed to flash, so at every
+    checkpoint it matches the durable prefix of the staging file.
+
+    For a bundle, target/new_file/digest/writer describe the file being
+    received; when its last byte is written it is closed and verified, and
+    the session moves on to the next entry. `staged` lists the files that
+    have passed, as (new_file, target, checksum).
+    """
+    def __init__(self, size, checksum, binary=False, window=1, digest="crc32",
+                 compression=None, csize=0, wbits=UPDATE_INFLATE_WBITS, delta_base=None,
+                 resume=None, target=UPDATE_TARGET_FILE, bundle=None):
+        self.bundle = bundle
+        self.staged = []
+        self.flash_writes = 0
+        if bundle is not None:
+            target = bundle[0]["filename"]
+            size = 0
+            for entry in bundle:
+                size += entry["size"]
+            checksum = bundle[0]["checksum"]
+            self._file_index = 0
+            self._file_end = bundle[0]["size"]
+        self.target = target
+        self.new_file = target + UPDATE_NEW_SUFFIX
+        self.expected_size = size
+        self.expected_checksum = checksum
+        self.expected_csize = csize
+        self.binary = binary
+        self.window = window
+        self.received = 0  # payload bytes as sent (compressed if compression)
+        self.plain = 0     # bytes written to the staging file
+        self.digest = UpdateDigest(digest)
+        self.seq_expected = 0
+        self.chunks = 0
+        self.pending = {}
+        self.checkpoints = 0
+        self._since_checkpoint = 0
+        self.inflater = UpdateInflater(compression, wbits) if compression else None
+        self.delta = UpdateDelta(delta_base) if delta_base else None
+
+        offset = 0
+        if resume is not None:
+            offset = int(resume["durable"])
+            self.seq_expected = int(resume["seq"])
+            self.received = offset
+            self.plain = offset
+            if digest == "crc32":
+                self.digest.crc = int(resume["crc"])
+            else:
+                # Hash state cannot be saved; rebuild it from flash.
+                update_file_digest(self.new_file, digest, limit=offset, digest=self.digest)
+        self.writer = UpdateWriter(self.new_file, offset=offset, on_flush=self._on_flush)
+
+    def is_streaming(self):
+        """True when decoder state makes a failed chunk unrecoverable."""
+        return self.inflater is not None or self.delta is not None or self.bundle is not None
+
+    def new_files(self):
+        if self.bundle is None:
+            return [self.new_file]
+        return [entry["filename"] + UPDATE_NEW_SUFFIX for entry in self.bundle]
+
+    def _on_flush(self, mv):
+        self.digest.update(mv)
+        if self.is_streaming():
+            return
+        self._since_checkpoint += len(mv)
+        if self._since_checkpoint >= UPDATE_CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Make written blocks durable and record how far the file is valid."""
+        self._since_checkpoint = 0
+        self.writer.sync()
+        state = {
+            "filename": self.target,
+            "size": self.expected_size,
+            "checksum": self.expected_checksum,
+            "digest": self.digest.algo,
+            "durable": self.writer.flushed,
+            "seq": self.seq_expected,
+            "last_acked": self.seq_expected - 1,
+            "crc": self.digest.crc,
+        }
+        with open(UPDATE_STATE_FILE, "w") as f:
+            f.write(ujson.dumps(state))
+        self.checkpoints += 1
+
+    def write_plain(self, data):
+        if self.bundle is None:
+            self.writer.write(data)
+            self.plain += len(data)
+            return
+
+        mv = memoryview(data)
+        n = len(mv)
+        off = 0
+        while off < n:
+            take = self._file_end - self.plain
+            if take <= 0:
+                raise ValueError("bundle overrun")
+            if take > n - off:
+                take = n - off
+            self.writer.write(mv[off:off + take])
+            self.plain += take
+            off += take
+            if self.plain == self._file_end:
+                self._next_file()
+
+    def _next_file(self):
+        """Close and verify the current bundle file, then open the next."""
+        self.writer.close()
+        self.flash_writes += self.writer.flash_writes
+        got = self.digest.hexdigest()
+        if got != self.expected_checksum:
+            raise ValueError("checksum_mismatch %s %s" % (self.target, got))
+        self.staged.append((self.new_file, self.target, got))
+
+        self._file_index += 1
+        if self._file_index >= len(self.bundle):
+            return
+        entry = self.bundle[self._file_index]
+        self.target = entry["filename"]
+        self.new_file = self.target + UPDATE_NEW_SUFFIX
+        self.expected_checksum = entry["checksum"]
+        self._file_end += entry["size"]
+        self.digest = UpdateDigest(self.digest.algo)
+        self.writer = UpdateWriter(self.new_file, on_flush=self._on_flush)
+
+    def _write_decoded(self, data):
+        if self.delta is None:
+            self.write_plain(data)
+        else:
+            self.delta.feed(data, self.write_plain)
+
+    def write_chunk(self, chunk):
+        mv = memoryview(chunk)
+        if self.inflater is None:
+            self._write_decoded(mv)
+        else:
+            self.inflater.feed(mv, self._write_decoded)
+        self.received += len(mv)
+        self.seq_expected += 1
+        self.chunks += 1
+
+    def finish(self):
+        if self.inflater is not None:
+            self.inflater.finish(self._write_decoded)
+        if self.delta is not None:
+            self.delta.finish()
+
+    def abort(self):
+        self.writer.abort()
+        if self.delta is not None:
+            self.delta.close()
+
+
+def send_update_status(status, **extra):
+    try:
+        payload = {"update": status}
+        for k, v in extra.items():
+            payload[k] = v
+        uart_send(ujson.dumps(payload), TX_PRIO_CONTROL)
+    except Exception:
+        pass
+
+
+def send_fw_version():
+    try:
+        uart_send(ujson.dumps({"fw_version": FW_VERSION, "caps": list(LINK_CAPS)}), TX_PRIO_CONTROL)
+    except Exception:
+        pass
+
+
+def _update_abort_session():
+    global UPDATE_MODE, _update_session
+    UPDATE_MODE = False
+    if _update_session is not None:
+        _update_session.abort()
+        _update_session = None
+    lidar_sampler_start()
+
+
+def _update_remove(path):
+    try:
+        if path in os.listdir():
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def _update_enter_safe_state():
+    """Put the controller in a safe state before receiving code."""
+    global UPDATE_MODE, _update_session
+    global abort_motion, pending_command, stop_command
+
+    UPDATE_MODE = True
+    abort_motion = True
+    pending_command = None
+    cmd_ack_drop("update_mode")
+    stop_command = False
+    MOTOR_MOVE.value(0)
+    LIGHT_ON_OFF.value(0)
+    # Keep core 1 off the bus (and out of flash timing) while code is written.
+    lidar_sampler_stop()
+
+    if _update_session is not None:
+        _update_session.abort()
+        _update_session = None
+
+
+def _update_parse_bundle(raw):
+    """Validated list of bundle entries, or None if the manifest is bad."""
+    if not isinstance(raw, list) or not 0 < len(raw) <= UPDATE_BUNDLE_MAX_FILES:
+        return None
+    bundle = []
+    names = []
+    for item in raw:
+        entry = {
+            "filename": str(item.get("filename", "")).strip(),
+            "size": int(item.get("size", 0)),
+            "checksum": str(item.get("checksum", "")).strip().lower(),
+        }
+        name = entry["filename"]
+        if (not update_target_allowed(name) or name in names or entry["size"] <= 0
+                or not entry["checksum"]):
+            return None
+        names.append(name)
+        bundle.append(entry)
+    return bundle
+
+
+def _update_requested_baud(msg):
+    try:
+        baud = int(msg.get("baud", 0))
+    except Exception:
+        return None
+    if baud in UPDATE_BAUDS:
+        return baud
+    return None
+
+
+def _update_set_baud(baud):
+    """Switch the UART once pending output is sent; unread input is dropped."""
+    global _update_baud, _update_line_errors
+    uart_tx_flush()
+    uart.init(baudrate=baud)
+    _update_baud = baud if baud != UART_BAUD else None
+    _update_line_errors = 0
+    _uart_rx_clear()
+    try:
+        while uart.any():
+            uart.read()
+    except Exception:
+        pass
+
+
+def update_baud_begin(baud):
+    """Called right after "ready": move to the raised rate and await the Pi."""
+    global _update_baud_deadline_ms
+    _update_set_baud(baud)
+    _update_baud_deadline_ms = time.ticks_add(time.ticks_ms(), UPDATE_BAUD_HANDSHAKE_MS)
+
+
+def update_baud_confirm(msg=None):
+    """{"cmd":"update_baud"} arrived at the raised rate."""
+    global _update_baud_deadline_ms, _update_baud_seen_ms
+    if not UPDATE_MODE or _update_baud is None:
+        send_update_status("baud_fallback", baud=UART_BAUD, reason="not_raised")
+        return
+    _update_baud_deadline_ms = None
+    _update_baud_seen_ms = time.ticks_ms()
+    send_update_status("baud_ok", baud=_update_baud)
+
+
+def update_baud_fallback(reason):
+    """Drop back to UART_BAUD, telling the Pi at both rates."""
+    global _update_baud_deadline_ms
+    if _update_baud is None:
+        return
+    send_update_status("baud_fallback", baud=UART_BAUD, reason=reason)
+    _update_set_baud(UART_BAUD)
+    _update_baud_deadline_ms = None
+    send_update_status("baud_fallback", baud=UART_BAUD, reason=reason)
+
+
+def service_update():
+    """Main-loop upkeep for a raised update rate."""
+    if _update_baud is None:
+        return
+    if not UPDATE_MODE:
+        # The session ended and its final status has been sent.
+        _update_set_baud(UART_BAUD)
+        return
+    now = time.ticks_ms()
+    if _update_baud_deadline_ms is not None:
+        if time.ticks_diff(now, _update_baud_deadline_ms) >= 0:
+            update_baud_fallback("handshake_timeout")
+    elif time.ticks_diff(now, _update_baud_seen_ms) > UPDATE_BAUD_IDLE_MS:
+        update_baud_fallback("idle")
+
+
+def _update_chunk_failed(reason, **extra):
+    global _update_line_errors
+    send_update_status("failed", reason=reason, **extra)
+    if reason not in UPDATE_LINE_ERROR_REASONS:
+        return
+    _update_line_errors += 1
+    if _update_line_errors >= UPDATE_BAUD_LINE_ERRORS:
+        update_baud_fallback(reason)
+
+
+def _update_restart():
+    """Soft reset after a successful install, back at UART_BAUD."""
+    uart_tx_flush()
+    time.sleep_ms(500)
+    if _update_baud is not None:
+        _update_set_baud(UART_BAUD)
+    machine.soft_reset()
+
+
+def update_start(msg):
+    global _update_session
+
+    try:
+        bundle = None
+        if "bundle" in msg:
+            bundle = _update_parse_bundle(msg["bundle"])
+            if bundle is None or "delta_base" in msg:
+                send_update_status("failed", reason="bad_bundle", max_files=UPDATE_BUNDLE_MAX_FILES)
+                return
+            msg["filename"] = bundle[0]["filename"]
+            msg["size"] = bundle[0]["size"]
+            msg["checksum"] = bundle[0]["checksum"]
+
+        size = int(msg.get("size", 0))
+        checksum = str(msg.get("checksum", "")).strip().lower()
+        filename = str(msg.get("filename", UPDATE_TARGET_FILE)).strip()
+        mode = str(msg.get("mode", "json")).strip().lower()
+        window = int(msg.get("window", 1))
+        digest = str(msg.get("digest", "crc32")).strip().lower()
+        compression = str(msg.get("compression", "")).strip().lower() or None
+        csize = int(msg.get("csize", 0))
+        wbits = int(msg.get("wbits", UPDATE_INFLATE_WBITS))
+        delta_base = str(msg.get("delta_base", "")).strip() or None
+
+        if not update_target_allowed(filename) or size <= 0 or not checksum:
+            send_update_status("failed", reason="bad_start")
+            return
+
+        if digest not in update_supported_digests():
+            send_update_status("failed", reason="bad_digest", digest=digest,
+                               supported=list(update_supported_digests()))
+            return
+
+        if compression is not None and (compression not in update_supported_compressions() or
+                                        csize <= 0 or not 8 <= wbits <= UPDATE_INFLATE_MAX_WBITS):
+            send_update_status("failed", reason="bad_compression", compression=compression,
+                               supported=list(update_supported_compressions()),
+                               max_wbits=UPDATE_INFLATE_MAX_WBITS)
+            return
+
+        if delta_base is not None:
+            if delta_base not in (filename, filename + UPDATE_BAK_SUFFIX):
+                send_update_status("failed", reason="bad_delta_base", delta_base=delta_base)
+                return
+            base_checksum = str(msg.get("base_checksum", "")).strip().lower()
+            try:
+                base_actual = update_file_digest(delta_base, digest).hexdigest()
+            except OSError:
+                base_actual = ""
+            if not base_checksum or base_actual != base_checksum:
+                send_update_status("failed", reason="base_mismatch", delta_base=delta_base,
+                                   expected=base_checksum, got=base_actual)
+                return
+
+        if mode not in ("json", "bin"):
+            send_update_status("failed", reason="bad_mode", mode=mode)
+            return
+
+        if window < 1:
+            window = 1
+        elif window > UPDATE_MAX_WINDOW:
+            window = UPDATE_MAX_WINDOW
+
+        _update_enter_safe_state()
+        _update_remove(UPDATE_STATE_FILE)
+        for entry in bundle or ({"filename": filename},):
+            _update_remove(entry["filename"] + UPDATE_NEW_SUFFIX)
+
+        _update_session = UpdateSession(size, checksum, binary=(mode == "bin"),
+                                        window=window, digest=digest,
+                                        compression=compression, csize=csize, wbits=wbits,
+                                        delta_base=delta_base, target=filename, bundle=bundle)
+
+        extra = {}
+        if bundle is not None:
+            size = _update_session.expected_size
+            extra["bundle"] = [entry["filename"] for entry in bundle]
+        if compression is not None:
+            extra["compression"] = compression
+            extra["csize"] = csize
+            extra["wbits"] = wbits
+        if delta_base is not None:
+            extra["delta_base"] = delta_base
+        if _update_session.binary:
+            extra["mode"] = "bin"
+            extra["max_payload"] = UPDATE_FRAME_MAX_PAYLOAD
+        baud = _update_requested_baud(msg)
+        if baud is not None:
+            extra["baud"] = baud
+        send_update_status("ready", filename=filename, size=size, version=FW_VERSION,
+                           window=window, digest=digest, **extra)
+        if baud is not None:
+            update_baud_begin(baud)
+    except Exception as e:
+        _update_abort_session()
+        send_update_status("failed", reason="start_exception", detail=str(e))
+
+
+def update_chunk(msg):
+    """JSON chunk: {"cmd":"update_chunk","seq":n,"data":"<base64>"}."""
+    if not UPDATE_MODE:
+        send_update_status("failed", reason="not_in_update_mode")
+        return
+
+    try:
+        seq = int(msg.get("seq", -1))
+        chunk = ubinascii.a2b_base64(msg.get("data", ""))
+    except Exception as e:
+        _update_chunk_failed("chunk_exception", detail=str(e))
+        return
+
+    update_accept_chunk(seq, chunk)
+
+
+def update_accept_chunk(seq, chunk):
+    """Accept one chunk. Shared by the JSON and binary update paths."""
+    global _update_baud_seen_ms, _update_line_errors
+    session = _update_session
+    if not UPDATE_MODE or session is None:
+        send_update_status("failed", reason="not_in_update_mode")
+        return
+
+    try:
+        if not chunk:
+            _update_chunk_failed("empty_chunk", seq=seq)
+            return
+
+        _update_baud_seen_ms = time.ticks_ms()
+        _update_line_errors = 0
+        if session.window <= 1:
+            if seq != session.seq_expected:
+                _update_chunk_failed("bad_seq", expected=session.seq_expected, got=seq)
+                return
+            session.write_chunk(chunk)
+            send_update_status("chunk_ok", seq=seq, received=session.received)
+            return
+
+        # Windowed: duplicates and chunks beyond the window are only re-acked.
+        if seq == session.seq_expected:
+            session.write_chunk(chunk)
+            while session.seq_expected in session.pending:
+                session.write_chunk(session.pending.pop(session.seq_expected))
+        elif session.seq_expected < seq < session.seq_expected + session.window:
+            if seq not in session.pending:
+                session.pending[seq] = bytes(chunk)
+
+        send_update_status("ack", seq=seq, next=session.seq_expected,
+                           received=session.received, sack=sorted(session.pending))
+    except Exception as e:
+        if session.is_streaming():
+            # Decoder state cannot be rewound; the session is lost.
+            _update_abort_session()
+        _update_chunk_failed("chunk_exception", detail=str(e))
+
+
+def update_end(msg=None):
+    session = _update_session
+    if not UPDATE_MODE or session is None:
+        send_update_status("failed", reason="not_in_update_mode")
+        return
+
+    try:
+        if session.inflater is not None and session.received != session.expected_csize:
+            _update_abort_session()
+            send_update_status("failed", reason="csize_mismatch", expected=session.expected_csize, got=session.received)
+            return
+
+        session.finish()
+
+        if session.plain != session.expected_size:
+            # The durable prefix is still good; update_resume can continue.
+            _update_abort_session()
+            send_update_status("failed", reason="size_mismatch", expected=session.expected_size, got=session.plain)
+            return
+
+        if session.bundle is not None:
+            _update_end_bundle(session)
+            return
+
+        # Closing writes the final partial block, which completes the digest.
+        session.writer.close()
+        actual_checksum = session.digest.hexdigest()
+
+        if actual_checksum.lower() != session.expected_checksum.lower():
+            _update_abort_session()
+            _update_remove(UPDATE_STATE_FILE)
+            send_update_status("failed", reason="checksum_mismatch", expected=session.expected_checksum, got=actual_checksum)
+            return
+
+        # Re-verify what actually landed in flash before replacing the target.
+        t0 = time.ticks_ms()
+        readback = update_file_digest(session.new_file, session.digest.algo).hexdigest()
+        readback_ms = time.ticks_diff(time.ticks_ms(), t0)
+        if readback != actual_checksum:
+            _update_abort_session()
+            _update_remove(UPDATE_STATE_FILE)
+            send_update_status("failed", reason="readback_mismatch", expected=actual_checksum, got=readback)
+            return
+
+        if session.target.endswith(".mpy"):
+            reason = update_check_mpy(session.new_file)
+            if reason is not None:
+                _update_abort_session()
+                _update_remove(UPDATE_STATE_FILE)
+                send_update_status("failed", reason=reason)
+                return
+
+        update_install([(session.new_file, session.target)])
+        _update_remove(UPDATE_STATE_FILE)
+        extra = {}
+        if session.inflater is not None:
+            extra["compression"] = session.inflater.compression
+            extra["csize"] = session.received
+        if session.delta is not None:
+            extra["delta_base"] = session.delta.base_path
+            extra["delta_ops"] = session.delta.ops
+        send_update_status("success", filename=session.target, size=session.plain, checksum=actual_checksum,
+                           digest=session.digest.algo, digest_kBps=session.digest.kbytes_per_s(),
+                           readback_ms=readback_ms,
+                           chunks=session.chunks, flash_writes=session.writer.flash_writes,
+                           checkpoints=session.checkpoints, **extra)
+        _update_restart()
+    except Exception as e:
+        _update_abort_session()
+        send_update_status("failed", reason="end_exception", detail=str(e))
+
+
+def _update_end_bundle(session):
+    """Readback-verify every staged bundle file, then install them together."""
+    t0 = time.ticks_ms()
+    for new_file, target, checksum in session.staged:
+        readback = update_file_digest(new_file, session.digest.algo).hexdigest()
+        if readback != checksum:
+            _update_abort_session()
+            send_update_status("failed", reason="readback_mismatch", filename=target,
+                               expected=checksum, got=readback)
+            return
+        if target.endswith(".mpy"):
+            reason = update_check_mpy(new_file)
+            if reason is not None:
+                _update_abort_session()
+                send_update_status("failed", reason=reason, filename=target)
+                return
+    readback_ms = time.ticks_diff(time.ticks_ms(), t0)
+
+    update_install([(new_file, target) for new_file, target, checksum in session.staged])
+    extra = {}
+    if session.inflater is not None:
+        extra["compression"] = session.inflater.compression
+        extra["csize"] = session.received
+    send_update_status("success", bundle=[target for new_file, target, checksum in session.staged],
+                       size=session.plain, digest=session.digest.algo,
+                       checksums=[checksum for new_file, target, checksum in session.staged],
+                       readback_ms=readback_ms, chunks=session.chunks,
+                       flash_writes=session.flash_writes, **extra)
+    _update_restart()
+
+
+def _update_move_aside(name, done):
+    """Rename name to name.bak, replacing an older .bak."""
+    files = os.listdir()
+    if name not in files:
+        return
+    bak = name + UPDATE_BAK_SUFFIX
+    if bak in files:
+        os.remove(bak)
+    os.rename(name, bak)
+    done.append((name, bak))
+
+
+def update_install(staged):
+    """
+    Swap verified staging files in as one step, keeping each replaced file
+    (and the other form of a module) as .bak. If any rename fails, the ones
+    already made are undone in reverse order and the error is re-raised.
+    """
+    done = []
+    try:
+        for new_file, target in staged:
+            _update_move_aside(target, done)
+            twin = update_twin_file(target)
+            if twin is not None:
+                _update_move_aside(twin, done)
+            os.rename(new_file, target)
+            done.append((new_file, target))
+    except Exception:
+        for src, dst in reversed(done):
+            try:
+                os.rename(dst, src)
+            except Exception:
+                pass
+        raise
+
+
+def update_cancel(reason="cancelled", keep=False):
+    """keep=True leaves the partial file and resume sidecar for update_resume."""
+    session = _update_session
+    if session is not None:
+        new_files = session.new_files()
+    else:
+        new_files = [UPDATE_TARGET_FILE + UPDATE_NEW_SUFFIX]
+    _update_abort_session()
+    if not keep:
+        _update_remove(UPDATE_STATE_FILE)
+        for new_file in new_files:
+            _update_remove(new_file)
+    send_update_status("cancelled", reason=reason, kept=bool(keep))
+
+
+def update_rx_overflow():
+    """
+    Input was lost mid-transfer, so the session cannot continue. End it,
+    keeping the staged file and a fresh checkpoint for update_resume.
+    """
+    session = _update_session
+    resumable = False
+    if session is not None and not session.is_streaming():
+        try:
+            session.checkpoint()
+            resumable = True
+        except Exception:
+            pass
+    _update_abort_session()
+    send_update_status("failed", reason="rx_buffer_overflow", resumable=resumable)
+
+
+def update_resume(msg):
+    """
+    {"cmd":"update_resume"} continues a plain transfer from its last
+    checkpoint. The reply is "ready" with the byte offset the sender must
+    continue from and the seq to number that chunk with. size/checksum may
+    be given to make sure the sender is resuming the same file.
+    """
+    global _update_session
+
+    try:
+        try:
+            with open(UPDATE_STATE_FILE) as f:
+                state = ujson.loads(f.read())
+            target = state["filename"]
+            staged = os.stat(target + UPDATE_NEW_SUFFIX)[6]
+        except Exception:
+            send_update_status("failed", reason="no_resume_state")
+            return
+
+        size = int(msg.get("size", state["size"]))
+        checksum = str(msg.get("checksum", state["checksum"])).strip().lower()
+        if size != state["size"] or checksum != state["checksum"] or staged < state["durable"]:
+            send_update_status("failed", reason="resume_mismatch", size=state["size"],
+                               checksum=state["checksum"], durable=state["durable"], staged=staged)
+            return
+
+        mode = str(msg.get("mode", "json")).strip().lower()
+        window = int(msg.get("window", 1))
+        if window < 1:
+            window = 1
+        elif window > UPDATE_MAX_WINDOW:
+            window = UPDATE_MAX_WINDOW
+
+        _update_enter_safe_state()
+        _update_session = UpdateSession(size, checksum, binary=(mode == "bin"), window=window,
+                                        digest=state["digest"], resume=state, target=target)
+
+        extra = {}
+        if _update_session.binary:
+            extra["mode"] = "bin"
+            extra["max_payload"] = UPDATE_FRAME_MAX_PAYLOAD
+        baud = _update_requested_baud(msg)
+        if baud is not None:
+            extra["baud"] = baud
+        send_update_status("ready", filename=target, size=size, version=FW_VERSION, window=window,
+                           digest=state["digest"], offset=_update_session.plain,
+                           seq=_update_session.seq_expected, **extra)
+        if baud is not None:
+            update_baud_begin(baud)
+    except Exception as e:
+        _update_abort_session()
+        send_update_status("failed", reason="resume_exception", detail=str(e))
+
+
+def update_binary_active():
+    return UPDATE_MODE and _update_session is not None and _update_session.binary
+
+
+def update_process_frame(frame):
+    """
+    Handle one complete, CRC-checked binary frame.
+    frame is the whole frame including header and CRC.
+    """
+    ftype = frame[1]
+    seq = frame[2] | (frame[3] << 8)
+    length = frame[4] | (frame[5] << 8)
+
+    if ftype == UPDATE_FRAME_DATA:
+        start = UPDATE_FRAME_HEADER_LEN
+        update_accept_chunk(seq, frame[start:start + length])
+    elif ftype == UPDATE_FRAME_END:
+        update_end()
+    elif ftype == UPDATE_FRAME_CANCEL:
+        update_cancel("zero_cancel")
+    else:
+        send_update_status("failed", reason="bad_frame_type", seq=seq, type=ftype)
+
+
+def update_take_frame(buf):
+    """
+    Parse the front of buf in binary update mode.
+    Returns (consumed, frame) where frame is None when the bytes consumed were
+    noise or a corrupt frame. consumed == 0 means more data is needed.
+    JSON lines starting with '{' are left for the line parser.
+    """
+    if not buf:
+        return 0, None
+
+    if buf[0] != UPDATE_FRAME_MAGIC:
+        # Also reached for a '{' that never became a JSON line.
+        # Resynchronise on the next frame magic or JSON line.
+        i = 1
+        n = len(buf)
+        while i < n and buf[i] != UPDATE_FRAME_MAGIC and buf[i] != 0x7B:
+            i += 1
+        return i, None
+
+    if len(buf) < UPDATE_FRAME_HEADER_LEN:
+        return 0, None
+
+    length = buf[4] | (buf[5] << 8)
+    if length > UPDATE_FRAME_MAX_PAYLOAD:
+        # No real frame is that long: a stray magic byte in noise or in a
+        # corrupt frame's payload. Skip it and keep scanning.
+        return 1, None
+
+    total = UPDATE_FRAME_HEADER_LEN + length + UPDATE_FRAME_CRC_LEN
+    if len(buf) < total:
+        return 0, None
+
+    body_len = total - UPDATE_FRAME_CRC_LEN
+    crc = (buf[body_len] | (buf[body_len + 1] << 8) | (buf[body_len + 2] << 16) |
+           (buf[body_len + 3] << 24))
+    if update_crc32(buf[:body_len]) != crc:
+        _update_chunk_failed("bad_crc", seq=buf[2] | (buf[3] << 8))
+        return total, None
+
+    return total, buf[:total]
+
+# ----------------------------
+# Garmin LIDAR-Lite v4 driver
+# ----------------------------
+# main_nonblocking_motor.py
+# ----------------------------
+# Driver counters wrap here to stay small ints, which do not allocate.
+LIDAR_COUNTER_MASK = 0x3FFFFFFF
+
+# Distance byte order: agreeing one-order-only readings before it is kept,
+# and out-of-range readings in a row before it is learnt again.
+LIDAR_ORDER_VOTES = 5
+LIDAR_ORDER_MISSES = 5
+
+# Acquisition profiles: (reg 0x04 acquisition count, reg 0x1C sensitivity,
+# expected conversion ms). Fewer acquisitions convert sooner but read
+# noisier. 0x1C 0x00 is the sensor's own detection threshold; a higher value
+# such as 0x60 ignores weak returns, which ends a quick acquisition on the
+# door rather than on clutter, and 0x20 is more sensitive, for the parked
+# readings. {"cmd":"lidar_profile_bench"} measures the conversion time,
+# misses and noise of each on the unit.
+LIDAR_PROFILES = {
+    "fast": (0x02, 0x60, 4),
+    "balanced": (0x08, 0x00, 8),
+    "precise": (0x20, 0x20, 20),
+}
+
+
+class LidarLiteV4:
+    """
+    Garmin LIDAR-Lite v4 I2C driver for MicroPython.
+    Address: 0x62
+
+    Sequence:
+      1) Write 0x04 to reg 0x00 (acquire)
+      2) Poll reg 0x01 bit0 until 0 (not busy)
+      3) Read 2 bytes at 0x10
+
+    trigger() and poll() run the sequence a step at a time, so a caller can
+    do other work during the 10-30 ms conversion; read_cm() blocks.
+
+    Continuous mode: the v4 has no repetition count register (the v3's
+    0x11), so the driver keeps it measuring itself. Once start_continuous()
+    is called, latest() collects each result and re-triggers at once, or when
+    the measurement interval is up, and returns the newest distance without
+    waiting: it makes at most one transaction per call, and none until
+    conversion_ms after the trigger. bus_us/bus_ops count I2C time and
+    transactions, for comparing the modes (both wrap at LIDAR_COUNTER_MASK).
+
+    Register access goes through preallocated buffers, so a sample does not
+    allocate. The distance byte order is kept once LIDAR_ORDER_VOTES
+    readings in a row are valid in that order only, and dropped again after
+    LIDAR_ORDER_MISSES out-of-range readings in a row or a reconfigure.
+
+    Acquisition profile: set_profile() only records the choice; the next
+    trigger() writes the registers that differ from the ones last written,
+    so switching costs at most two writes, once. conv_us is the last
+    trigger-to-ready time, as seen by the poll that found busy clear.
+    """
+    NOT_READY = -1
+
+    def __init__(self, i2c, addr=0x62):
+        self.i2c = i2c
+        self.addr = addr
+        self.i2c_error_count = 0
+        self._configured = False
+        self.busy_timeout_ms = 200
+        self.settle_ms = 0
+        self._busy_since = None
+        self._ready_since = None
+        self.bus_us = 0
+        self.bus_ops = 0
+        self.continuous_ms = 0
+        self.conversion_ms = 8
+        self._next_ms = 0
+        self.latest_cm = None
+        self.latest_us = 0
+        self.latest_seq = 0
+        self.big_endian = None   # distance byte order, once detected
+        self._order_vote = None
+        self._order_votes = 0
+        self._order_misses = 0
+        self._wbuf = bytearray(1)
+        self._rbuf1 = bytearray(1)
+        self._rbuf2 = bytearray(2)
+        self.profile = "balanced"
+        self.profile_switches = 0
+        self._profile_due = False
+        self._regs = [None, None]   # 0x04, 0x1C as last written
+        self._trig_us = 0
+        self.conv_us = 0
+
+    def _count(self, t0):
+        self.bus_us = (self.bus_us + time.ticks_diff(time.ticks_us(), t0)) & LIDAR_COUNTER_MASK
+        self.bus_ops = (self.bus_ops + 1) & LIDAR_COUNTER_MASK
+
+    def _write_reg(self, reg, val):
+        t0 = time.ticks_us()
+        self._wbuf[0] = val
+        try:
+            self.i2c.writeto_mem(self.addr, reg, self._wbuf)
+        finally:
+            self._count(t0)
+
+    def _read_u8(self, reg):
+        t0 = time.ticks_us()
+        try:
+            self.i2c.readfrom_mem_into(self.addr, reg, self._rbuf1)
+        finally:
+            self._count(t0)
+        return self._rbuf1[0]
+
+    def _read_into(self, reg, buf):
+        t0 = time.ticks_us()
+        try:
+            self.i2c.readfrom_mem_into(self.addr, reg, buf)
+        finally:
+            self._count(t0)
+        return buf
+
+    def _forget_order(self):
+        self.big_endian = None
+        self._order_vote = None
+        self._order_votes = 0
+        self._order_misses = 0
+
+    def _decode(self, b0, b1):
+        """Distance in cm from the two bytes at 0x10, or None if out of range."""
+        if self.big_endian is not None:
+            cm = (b0 << 8) | b1 if self.big_endian else (b1 << 8) | b0
+            if 5 <= cm <= 1000:
+                self._order_misses = 0
+                return cm
+            self._order_misses += 1
+            if self._order_misses < LIDAR_ORDER_MISSES:
+                return None
+            # Possibly locked onto the wrong order; learn it again.
+            self._forget_order()
+
+        # Try both byte orders. One that is the only valid reading several
+        # times in a row is kept, so a single glitch cannot pick it.
+        cm_a = (b0 << 8) | b1
+        cm_b = (b1 << 8) | b0
+        ok_a = 5 <= cm_a <= 1000
+        ok_b = 5 <= cm_b <= 1000
+        if ok_a != ok_b:
+            if self._order_vote == ok_a:
+                self._order_votes += 1
+            else:
+                self._order_vote = ok_a
+                self._order_votes = 1
+            if self._order_votes >= LIDAR_ORDER_VOTES:
+                self.big_endian = ok_a
+                self._order_misses = 0
+        if ok_a:
+            return cm_a
+        if ok_b:
+            return cm_b
+        return None
+
+    def configure_long_range(self):
+        """
+        Boost range by increasing acquisition effort/sensitivity.
+        0x04 and 0x1C come from the current profile.
+        """
+        try:
+            self._forget_order()
+            self._write_reg(0x02, 0x80)  # baseline
+            self._regs[0] = None
+            self._regs[1] = None
+            self._apply_profile()
+            self._configured = True
+        except Exception:
+            self.i2c_error_count += 1
+            self._configured = False
+        # Any acquisition in flight is lost; continuous mode re-arms on the
+        # next latest().
+        self._busy_since = None
+        self._next_ms = time.ticks_ms()
+
+    def set_profile(self, name):
+        """Use LIDAR_PROFILES[name] from the next trigger. False if unknown."""
+        if name not in LIDAR_PROFILES:
+            return False
+        if name != self.profile:
+            self.profile = name
+            self._profile_due = True
+            self.profile_switches += 1
+        return True
+
+    def _apply_profile(self):
+        # Cleared first, so a set_profile() racing from the other core is
+        # applied next time rather than lost.
+        self._profile_due = False
+        count, sens, conv = LIDAR_PROFILES[self.profile]
+        try:
+            if self._regs[0] != count:
+                self._regs[0] = None
+                self._write_reg(0x04, count)  # acquisition count
+                self._regs[0] = count
+            if self._regs[1] != sens:
+                self._regs[1] = None
+                self._write_reg(0x1C, sens)   # sensitivity
+                self._regs[1] = sens
+        except Exception:
+            self._profile_due = True
+            raise
+        self.conversion_ms = conv
+
+    def trigger(self, settle_ms=0):
+        """Start one acquisition and return at once. False if the write failed."""
+        if not self._configured:
+            self.configure_long_range()
+        self.settle_ms = settle_ms
+        self._ready_since = None
+        try:
+            if self._profile_due:
+                self._apply_profile()
+            self._write_reg(0x00, 0x04)
+        except Exception:
+            self.i2c_error_count += 1
+            self._busy_since = None
+            return False
+        self._trig_us = time.ticks_us()
+        self._busy_since = time.ticks_ms()
+        return True
+
+    def poll(self):
+        """
+        One cheap step of the triggered acquisition: the distance in cm when
+        it is ready, NOT_READY while converting (or settling for settle_ms
+        after busy clears), or None if it failed or stayed busy longer than
+        busy_timeout_ms. After a reading or None, trigger() again.
+        """
+        if self._busy_since is None:
+            return None
+        now = time.ticks_ms()
+        try:
+            if self._ready_since is None:
+                # Status reg 0x01 bit0 is set while converting.
+                if self._read_u8(0x01) & 0x01:
+                    if time.ticks_diff(now, self._busy_since) > self.busy_timeout_ms:
+                        self._busy_since = None
+                        return None
+                    return self.NOT_READY
+                self._ready_since = now
+                self.conv_us = time.ticks_diff(time.ticks_us(), self._trig_us)
+            if time.ticks_diff(now, self._ready_since) < self.settle_ms:
+                return self.NOT_READY
+            # Read two bytes at 0x10
+            b = self._read_into(0x10, self._rbuf2)
+        except Exception:
+            self.i2c_error_count += 1
+            self._busy_since = None
+            return None
+        self._busy_since = None
+        return self._decode(b[0], b[1])
+
+    def start_continuous(self, interval_ms):
+        """Measure every interval_ms (0: back to back) until stop_continuous()."""
+        self.continuous_ms = max(1, int(interval_ms))
+        self._next_ms = time.ticks_ms()
+
+    def stop_continuous(self):
+        self.continuous_ms = 0
+
+    def latest(self):
+        """
+        Continuous mode: the newest distance in cm (None before the first),
+        captured at latest_us; latest_seq counts readings. Never waits.
+        """
+        if not self.continuous_ms:
+            return self.latest_cm
+        now = time.ticks_ms()
+        if self._busy_since is None:
+            if time.ticks_diff(now, self._next_ms) >= 0:
+                self._next_ms = time.ticks_add(now, self.continuous_ms)
+                self.trigger()
+        elif time.ticks_diff(now, self._busy_since) >= self.conversion_ms:
+            cm = self.poll()
+            if cm != self.NOT_READY:
+                if cm is not None:
+                    self.latest_cm = cm
+                    self.latest_us = time.ticks_us()
+                    self.latest_seq += 1
+                if time.ticks_diff(now, self._next_ms) >= 0:
+                    self._next_ms = time.ticks_add(now, self.continuous_ms)
+                    self.trigger()
+        return self.latest_cm
+
+    def read_cm(self, budget_ms=250, settle_ms=8, debug=False, feed=True):
+        """
+        Returns distance in centimeters, or None on failure. Blocking:
+        trigger() and poll() every settle_ms, re-triggering after a failed
+        acquisition until budget_ms has passed.
+        feed=False on core 1, so only the control core keeps the watchdog fed.
+        """
+        if not self._configured:
+            self.configure_long_range()
+            time.sleep_ms(50)
+
+        t0 = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), t0) < budget_ms:
+            if feed:
+                feed_watchdog()
+            if self.trigger(settle_ms):
+                while True:
+                    if feed:
+                        feed_watchdog()
+                    cm = self.poll()
+                    if cm != self.NOT_READY:
+                        break
+                    time.sleep_ms(settle_ms if settle_ms > 0 else 1)
+                if debug:
+                    print("LIDAR cm:", cm)
+                if cm is not None:
+                    return cm
+            time.sleep_ms(10)
+
+        return None
+
+
+# ----------------------------
+# Pins
+# ----------------------------
+LIGHT_PIN = 10
+OPEN_PIN = 11
+CLOSE_PIN = 12
+VENT_PIN = 13
+STOP_PIN = 14
+
+LIGHT_ON_OFF = Pin(22, Pin.OUT)
+LIGHT_ON_OFF.value(0)
+
+MOTOR_MOVE = Pin(18, Pin.OUT)
+MOTOR_MOVE.value(0)
+
+# Relay pulse timing.
+# This is now non-blocking, so the Pico can keep reading UART/LIDAR while the button is held.
+button_hold_time = 1.0
+button_hold_ms = int(button_hold_time * 1000)
+
+DEBOUNCE_MS = 200
+
+_motor_pulse_active = False
+_motor_pulse_until_ms = 0
+
+_light_pulse_active = False
+_light_pulse_until_ms = 0
+
+
+# ----------------------------
+# Watchdog tuning (single source of truth)
+# ----------------------------
+# Heartbeat-only reset: Pi must miss HB long enough N times in a row.
+HB_TIMEOUT_MS = 15000           # count a "miss" if hb age > 15s
+HB_MISSES_TO_RESET = 8          # ~2 minutes of continuous misses triggers reset
+
+# Net is status-only (DO NOT reset from net)
+NET_TIMEOUT_MS = 180000         # used only for diagnostics/logging
+
+hb_miss_count = 0
+
+
+# ----------------------------
+# PI POWER CONTROL (AO3407A + 2N2222)
+# ----------------------------
+PI_PWR_PIN = 2
+pi_pwr = Pin(PI_PWR_PIN, Pin.OUT)
+pi_pwr.value(1)  # Pi ON by default
+
+PI_BOOT_GRACE_MS = 180000       # ignore watchdog checks for 3 minutes after power on
+PI_RESET_COOLDOWN_MS = 300000   # don't reset again within 5 minutes
+PI_POWER_OFF_MS = 2500          # cut power for 2.5s
+
+_last_hb_ms = utime.ticks_ms()
+_last_net_ms = utime.ticks_ms()
+_last_pi_power_on_ms = utime.ticks_ms()
+_last_pi_reset_ms = 0
+
+
+# ----------------------------
+# Control flags
+# ----------------------------
+stop_command = False
+abort_motion = False
+pending_command = None
+active_motion_command = None
+vent_status = 0
+
+# Command acknowledgements. A command sent with an "id" is acked at each
+# stage; the entries are [id, cmd, rx_us] for the queued (pending_command)
+# and the running (motion) command. _cmd_rx_id is set only while the
+# message carrying it is dispatched.
+_cmd_rx_id = None
+_cmd_rx_us = 0
+_cmd_ack_pending = None
+_cmd_ack_active = None
+_cmd_ack_relayed = False
+
+
+# ----------------------------
+# UART and I2C (shared bus)
+# ----------------------------
+UART_BAUD = 115200
+UART_TXBUF = 1024
+uart = UART(0, baudrate=UART_BAUD, tx=Pin(0), rx=Pin(1), rxbuf=8192, txbuf=UART_TXBUF)
+
+# Outbound queue. Senders call uart_send() and return at once; check_uart()
+# drains the queue, highest priority first, only while the bytes already
+# handed to the UART (estimated from the baud rate and time elapsed) leave
+# room in its TX buffer, so uart.write never waits for the wire. A line sent
+# with a key replaces a queued line with the same key in place (only the
+# latest position or environment reading goes out). When a priority level is
+# full its oldest line is dropped.
+TX_PRIO_CONTROL = 0    # update status/acks, command replies
+TX_PRIO_EVENT = 1      # events, vent status, UART health
+TX_PRIO_TELEMETRY = 2  # position, environment, debug
+TX_QUEUE_MAX = 24
+_tx_queues = ([], [], [])
+_tx_keyed = {}
+_tx_slots = {}
+_tx_inflight = 0
+_tx_last_us = time.ticks_us()
+_tx_sent = 0
+_tx_dropped = 0
+_tx_coalesced = 0
+_tx_max_depth = 0
+
+
+def uart_send(data, prio=TX_PRIO_EVENT, key=None):
+    """Queue one line (without its newline) for the Pi."""
+    uart_send_line(data + "\n", prio, key)
+
+
+def uart_send_line(line, prio=TX_PRIO_EVENT, key=None):
+    """
+    Queue a complete line, newline included. line may be a memoryview of a
+    reusable buffer when it is sent with a key: the buffer is only rewritten
+    by the next line with that key, which replaces the queued one anyway.
+    Keyed entries are reused, so a keyed line queues without allocating.
+    """
+    global _tx_dropped, _tx_coalesced, _tx_max_depth
+    if key is not None:
+        entry = _tx_keyed.get(key)
+        if entry is not None:
+            entry[1] = line
+            _tx_coalesced += 1
+            return
+
+    q = _tx_queues[prio]
+    if len(q) >= TX_QUEUE_MAX:
+        old = q.pop(0)
+        if old[0] is not None:
+            del _tx_keyed[old[0]]
+        _tx_dropped += 1
+    if key is None:
+        entry = [None, line]
+    else:
+        entry = _tx_slots.get(key)
+        if entry is None:
+            entry = [key, line]
+            _tx_slots[key] = entry
+        entry[1] = line
+        _tx_keyed[key] = entry
+    q.append(entry)
+
+    depth = len(_tx_queues[0]) + len(_tx_queues[1]) + len(_tx_queues[2])
+    if depth > _tx_max_depth:
+        _tx_max_depth = depth
+
+
+def uart_tx_service():
+    """Write queued lines while they fit in the UART TX buffer."""
+    global _tx_inflight, _tx_last_us, _tx_sent
+
+    now = time.ticks_us()
+    drained = time.ticks_diff(now, _tx_last_us) * ((_update_baud or UART_BAUD) // 10) // 1000000
+    _tx_last_us = now
+    if drained < 0 or drained >= _tx_inflight:
+        _tx_inflight = 0
+    else:
+        _tx_inflight -= drained
+
+    for q in _tx_queues:
+        while q:
+            entry = q[0]
+            n = len(entry[1])
+            # A line longer than the buffer still goes out once it is empty.
+            if _tx_inflight and _tx_inflight + n > UART_TXBUF:
+                return
+            q.pop(0)
+            if entry[0] is not None:
+                del _tx_keyed[entry[0]]
+            try:
+                uart.write(entry[1])
+            except Exception:
+                pass
+            _tx_inflight += n
+            _tx_sent += 1
+
+
+def uart_tx_flush():
+    """Send everything queued and wait for it to leave (reset, baud change)."""
+    while _tx_queues[0] or _tx_queues[1] or _tx_queues[2]:
+        uart_tx_service()
+        time.sleep_ms(1)
+    try:
+        uart.flush()
+    except Exception:
+        pass
+
+
+if DEBUG_STATS:
+    def send_tx_stats(reset=False):
+        """Reply to {"cmd":"tx_stats"}; "reset":1 clears the counters."""
+        global _tx_sent, _tx_dropped, _tx_coalesced, _tx_max_depth
+        uart_send(ujson.dumps({
+            "tx_stats": 1,
+            "depth": [len(q) for q in _tx_queues],
+            "max_depth": _tx_max_depth,
+            "sent": _tx_sent,
+            "dropped": _tx_dropped,
+            "coalesced": _tx_coalesced,
+            "inflight": _tx_inflight,
+        }), TX_PRIO_CONTROL)
+        if reset:
+            _tx_sent = 0
+            _tx_dropped = 0
+            _tx_coalesced = 0
+            _tx_max_depth = 0
+
+
+# Binary link records, used instead of JSON for telemetry once the Pi asks
+# for them with {"cmd":"caps","use":"bin1"} (fw_version lists the caps).
+# Each record is: 0xB5, type, payload length, payload, CRC-16/CCITT-FALSE
+# (init 0xFFFF) over type, length and payload, little-endian. All other
+# messages stay JSON lines, and the Pi may send command records at any time.
+#   0x01 position  u16 percent*10, u16 inches*10, u8 light on, u16 light value
+#   0x02 vent      u8 vent status
+#   0x03 env       i16 temperature F*10, u8 humidity
+#   0x04 event     u32 ms, UTF-8 text
+#   0x10 command   u8 LINK_COMMANDS index
+#   0x11 hb / 0x12 net, empty
+# A Pi power cycle falls back to JSON; a restarted reader negotiates again.
+LINK_MAGIC = 0xB5
+LINK_CAPS = ("json", "bin1")
+LINK_POSITION = 0x01
+LINK_VENT = 0x02
+LINK_ENV = 0x03
+LINK_EVENT = 0x04
+LINK_COMMAND = 0x10
+LINK_HB = 0x11
+LINK_NET = 0x12
+LINK_COMMANDS = ("open", "close", "vent", "light", "stop")
+LINK_HEADER_LEN = 3
+LINK_CRC_LEN = 2
+LINK_MAX_PAYLOAD = 64
+_link_binary = False
+_link_rx_records = 0
+_link_rx_errors = 0
+_link_pos_frame = bytearray(LINK_HEADER_LEN + 7 + LINK_CRC_LEN)
+
+
+@micropython.viper
+def _link_crc16(buf, start: int, end: int) -> int:
+    p = ptr8(buf)
+    crc = 0xFFFF
+    i = start
+    while i < end:
+        crc ^= p[i] << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        i += 1
+    return crc
+
+
+def _link_seal(frame, rtype, n):
+    """Fill in the header and CRC of a frame with an n-byte payload."""
+    frame[0] = LINK_MAGIC
+    frame[1] = rtype
+    frame[2] = n
+    crc = _link_crc16(frame, 1, LINK_HEADER_LEN + n)
+    frame[LINK_HEADER_LEN + n] = crc & 0xFF
+    frame[LINK_HEADER_LEN + n + 1] = crc >> 8
+    return frame
+
+
+def _link_u16(frame, off, v):
+    v = int(v)
+    if v < 0:
+        v = 0
+    elif v > 0xFFFF:
+        v = 0xFFFF
+    frame[off] = v & 0xFF
+    frame[off + 1] = v >> 8
+
+
+def format_position_frame(mapped_pos, actual_distance, light_on, light_value):
+    """Binary position record in a reusable buffer (sent keyed, see uart_send_line)."""
+    frame = _link_pos_frame
+    _link_u16(frame, 3, round(mapped_pos * 10))
+    _link_u16(frame, 5, round(actual_distance * 10))
+    frame[7] = 1 if light_on else 0
+    _link_u16(frame, 8, light_value)
+    return _link_seal(frame, LINK_POSITION, 7)
+
+
+_LINK_VENT_FRAMES = (
+    bytes(_link_seal(bytearray(b"\0\0\0\0\0\0"), LINK_VENT, 1)),
+    bytes(_link_seal(bytearray(b"\0\0\0\1\0\0"), LINK_VENT, 1)),
+)
+
+
+def format_env_frame(temp_f, humidity):
+    frame = bytearray(LINK_HEADER_LEN + 3 + LINK_CRC_LEN)
+    t = round(temp_f * 10)
+    if t < -32768:
+        t = -32768
+    elif t > 32767:
+        t = 32767
+    _link_u16(frame, 3, t & 0xFFFF)
+    frame[5] = max(0, min(255, int(humidity)))
+    return _link_seal(frame, LINK_ENV, 3)
+
+
+def format_event_frame(event, ms):
+    text = str(event).encode()[:LINK_MAX_PAYLOAD - 4]
+    n = 4 + len(text)
+    frame = bytearray(LINK_HEADER_LEN + n + LINK_CRC_LEN)
+    frame[3] = ms & 0xFF
+    frame[4] = (ms >> 8) & 0xFF
+    frame[5] = (ms >> 16) & 0xFF
+    frame[6] = (ms >> 24) & 0xFF
+    frame[7:7 + len(text)] = text
+    return _link_seal(frame, LINK_EVENT, n)
+
+
+def link_take_frame(buf):
+    """
+    Parse a binary link record at the front of buf (which starts with
+    LINK_MAGIC). Returns (consumed, frame) like update_take_frame: 0 means
+    wait for more bytes, frame None means a corrupt record was skipped.
+    """
+    global _link_rx_errors
+    if len(buf) < LINK_HEADER_LEN:
+        return 0, None
+    n = buf[2]
+    if n > LINK_MAX_PAYLOAD:
+        _link_rx_errors += 1
+        return 1, None
+    total = LINK_HEADER_LEN + n + LINK_CRC_LEN
+    if len(buf) < total:
+        return 0, None
+    crc = buf[total - 2] | (buf[total - 1] << 8)
+    if _link_crc16(buf, 1, LINK_HEADER_LEN + n) != crc:
+        _link_rx_errors += 1
+        return 1, None
+    return total, buf[:total]
+
+
+def link_process_frame(frame):
+    """Handle one CRC-checked record from the Pi."""
+    global _link_rx_records
+    _link_rx_records += 1
+    rtype = frame[1]
+    if rtype == LINK_HB:
+        _on_hb(1)
+    elif rtype == LINK_NET:
+        _on_net(1)
+    elif rtype == LINK_COMMAND and frame[2] == 1 and frame[3] < len(LINK_COMMANDS):
+        handle_command(LINK_COMMANDS[frame[3]])
+
+
+def send_link_caps(msg=None):
+    """
+    {"cmd":"caps"} reports the link formats; "use":"bin1" switches telemetry
+    to binary records and "use":"json" switches it back. Replies are JSON.
+    """
+    global _link_binary
+    if msg is not None and 'use' in msg:
+        use = str(msg['use']).strip().lower()
+        if use in LINK_CAPS:
+            _link_binary = use != "json"
+    try:
+        uart_send(ujson.dumps({
+            "caps": list(LINK_CAPS),
+            "use": "bin1" if _link_binary else "json",
+            "rx_records": _link_rx_records,
+            "rx_errors": _link_rx_errors,
+        }), TX_PRIO_CONTROL)
+    except Exception:
+        pass
+
+
+# Buffered UART receive prevents partial JSON lines during firmware updates.
+# Bytes are read straight into one preallocated buffer; [_uart_rx_start,
+# _uart_rx_end) is unread. Lines and frames are handed on as memoryviews of
+# it, and the unread tail (at most one partial message) is moved back to the
+# front only when the free space runs out, so nothing is copied per chunk.
+MAX_UART_BUFFER = 16384
+_uart_rx = bytearray(MAX_UART_BUFFER)
+_uart_rx_mv = memoryview(_uart_rx)
+_uart_rx_start = 0
+_uart_rx_end = 0
+
+# Receive-path counters for {"cmd":"uart_stats"}. rx_alloc is the heap
+# growth seen across check_uart calls that read data (calls in which a GC
+# ran are skipped), so rx_alloc per KB received shows the cost of the path.
+_uart_rx_bytes = 0
+_uart_rx_lines = 0
+_uart_rx_frames = 0
+_uart_rx_compactions = 0
+_uart_rx_alloc = 0
+_uart_rx_alloc_bytes = 0
+
+# Receive latency for {"cmd":"sched_stats"}. A message can arrive just after
+# one poll and wait for the next, so the gap between check_uart calls, and
+# the time from the previous poll to the end of a message's dispatch, bound
+# the UART-to-dispatch latency. Both are kept apart for while a command runs.
+_uart_poll_us = None
+_uart_poll_prev_us = None
+_uart_gap_max_us = 0
+_uart_gap_moving_max_us = 0
+_uart_dispatch_max_us = 0
+_uart_dispatch_moving_max_us = 0
+# Poll interval totals for lidar_bench (count, sum, max since last reset).
+_uart_poll_n = 0
+_uart_poll_sum_us = 0
+_uart_poll_window_max_us = 0
+
+# Conservative UART self-recovery. Recovery never runs merely because the Pi
+# is quiet, and partial-line cleanup is disabled during firmware updates.
+UART_PARTIAL_LINE_TIMEOUT_MS = 5000
+UART_RECOVERY_COOLDOWN_MS = 5000
+_uart_partial_since_ms = None
+_uart_last_recovery_ms = 0
+_uart_error_count = 0
+_uart_recovery_count = 0
+
+# I2C pins (RP2040)
+I2C_ID = 0
+SCL_PIN_NUM = 9
+SDA_PIN_NUM = 8
+I2C_FREQ = 100000
+
+i2c = I2C(I2C_ID, scl=Pin(SCL_PIN_NUM), sda=Pin(SDA_PIN_NUM), freq=I2C_FREQ)
+
+
+class _NoLock:
+    """Stands in for the I2C lock on builds without _thread."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# The LIDAR and BME280 share the bus. Once the core 1 sampler runs, every
+# transaction on either core is made holding this lock.
+_i2c_lock = _thread.allocate_lock() if _thread is not None else _NoLock()
+
+
+# ----------------------------
+# Debug helper (USB console + UART)
+# ----------------------------
+def dbg(msg):
+    try:
+        print("[DBG]", msg)
+    except:
+        pass
+    try:
+        uart_send(ujson.dumps({"dbg": msg}), TX_PRIO_TELEMETRY)
+    except:
+        pass
+
+
+def send_event(event):
+    """Send event messages to the Pi Zero for logging in serial_reader.py."""
+    try:
+        if _link_binary:
+            uart_send_line(format_event_frame(event, utime.ticks_ms()))
+            return
+        uart_send(ujson.dumps({
+            "event": event,
+            "ms": utime.ticks_ms()
+        }))
+    except:
+        pass
+
+
+# Let the Pi side serial reader start, then announce Pico boot.
+time.sleep_ms(500)
+send_event("pico_boot")
+
+
+# ----------------------------
+# Ignore boot glitches
+# ----------------------------
+BOOT_IGNORE_MS = 4000
+_boot_ms = utime.ticks_ms()
+
+
+def stable_low(pin, ms=40):
+    t0 = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), t0) < ms:
+        if pin.value() != 0:
+            return False
+        time.sleep_ms(2)
+    return True
+
+
+# ----------------------------
+# LIDAR Health / Recovery Settings
+# ----------------------------
+LIDAR_STALE_MS = 1500
+LIDAR_RECOVER_COOLDOWN_MS = 800
+LIDAR_MAX_RECOVERS = 4
+
+_last_lidar_good_ms = utime.ticks_ms()
+_last_lidar_value_in = None
+_lidar_recover_attempts = 0
+_last_recover_ms = 0
+
+
+# ----------------------------
+# I2C bus clear helper (for stuck SDA/SCL)
+# ----------------------------
+def i2c_bus_clear(scl_pin_num=SCL_PIN_NUM, sda_pin_num=SDA_PIN_NUM, pulses=9):
+    try:
+        scl = Pin(scl_pin_num, Pin.OUT)
+        sda = Pin(sda_pin_num, Pin.IN, Pin.PULL_UP)
+
+        scl.value(1)
+        time.sleep_us(5)
+
+        for _ in range(pulses):
+            scl.value(0)
+            time.sleep_us(5)
+            scl.value(1)
+            time.sleep_us(5)
+
+        # STOP: SDA low then high while SCL high
+        sda = Pin(sda_pin_num, Pin.OUT)
+        sda.value(0)
+        time.sleep_us(5)
+        scl.value(1)
+        time.sleep_us(5)
+        sda = Pin(sda_pin_num, Pin.IN, Pin.PULL_UP)
+        time.sleep_us(5)
+
+        return True
+    except Exception as e:
+        dbg("i2c_bus_clear err: " + str(e))
+        return False
+
+
+def rebuild_i2c_and_lidar():
+    with _i2c_lock:
+        return _rebuild_i2c_and_lidar()
+
+
+def _rebuild_i2c_and_lidar():
+    global i2c, lidar
+    continuous_ms = lidar.continuous_ms
+    profile = lidar.profile
+    try:
+        try:
+            i2c.deinit()
+        except:
+            pass
+
+        time.sleep_ms(50)
+        i2c_bus_clear()
+
+        time.sleep_ms(50)
+        i2c = I2C(I2C_ID, scl=Pin(SCL_PIN_NUM), sda=Pin(SDA_PIN_NUM), freq=I2C_FREQ)
+        lidar = LidarLiteV4(i2c=i2c, addr=0x62)
+        lidar.profile = profile
+        lidar.configure_long_range()
+        if continuous_ms:
+            lidar.start_continuous(continuous_ms)
+        time.sleep_ms(100)
+        return True
+    except Exception as e:
+        dbg("rebuild_i2c_and_lidar err: " + str(e))
+        return False
+
+
+def lidar_health_check():
+    """
+    Recovery-only watchdog (NO Pico self-reset).
+    Also skips recovery during PI boot grace to avoid chasing noise during Pi power cycling.
+    """
+    global _lidar_recover_attempts, _last_recover_ms
+
+    now = utime.ticks_ms()
+
+    # Skip any LIDAR recovery while the Pi is in its boot grace period
+    if utime.ticks_diff(now, _last_pi_power_on_ms) < PI_BOOT_GRACE_MS:
+        return
+
+    stale = utime.ticks_diff(now, _last_lidar_good_ms)
+
+    if stale < LIDAR_STALE_MS:
+        _lidar_recover_attempts = 0
+        return
+
+    if utime.ticks_diff(now, _last_recover_ms) < LIDAR_RECOVER_COOLDOWN_MS:
+        return
+
+    _last_recover_ms = now
+    _lidar_recover_attempts += 1
+    dbg("LIDAR stale " + str(stale) + "ms -> recover attempt " + str(_lidar_recover_attempts))
+
+    # 1) light touch
+    try:
+        with _i2c_lock:
+            lidar.configure_long_range()
+    except:
+        pass
+
+    # 2) heavier touch
+    if _lidar_recover_attempts >= 2:
+        rebuild_i2c_and_lidar()
+
+    # 3) keep trying rebuilds, but NEVER reset the Pico
+    if _lidar_recover_attempts >= LIDAR_MAX_RECOVERS:
+        dbg("LIDAR still stale; continuing rebuild attempts (no Pico reset)")
+        _lidar_recover_attempts = 0
+
+
+# ----------------------------
+# Garmin LIDAR-Lite v4 init
+# ----------------------------
+lidar = LidarLiteV4(i2c=i2c, addr=0x62)
+lidar.configure_long_range()
+
+# Give the LIDAR time to settle after configuration.
+time.sleep_ms(1000)
+
+# Test LIDAR 5 times on startup.
+for i in range(5):
+    cm = lidar.read_cm(budget_ms=1000, settle_ms=8)
+    print("LIDAR cm:", cm)
+    time.sleep_ms(500)
+
+
+# ----------------------------
+# BME280 + light sensor
+# ----------------------------
+scan = i2c.scan()
+bme_addr = 0x77 if 0x77 in scan else (0x76 if 0x76 in scan else None)
+
+if bme_addr is None:
+    bme = None
+    print("BME280 not found on I2C scan:", [hex(x) for x in scan])
+else:
+    bme = BME280.BME280(i2c=i2c, addr=bme_addr)
+    print("BME280 found at", hex(bme_addr))
+
+light_sensor = ADC(0)  # GP26
+
+
+# ----------------------------
+# LIDAR sampler (core 1)
+# ----------------------------
+# read_cm busy-polls the LIDAR with sleeps and retries, which can hold the
+# control loop for hundreds of ms. With _thread, a sampler on core 1 owns the
+# LIDAR reads instead: each good reading goes into a ring of
+# (ticks_us, cm) slots under _lidar_ring_lock, and get_position takes the
+# readings published since its last call without touching the bus. The ring
+# is preallocated and the sampler does not feed the watchdog, so a stalled
+# control core still resets the Pico.
+LIDAR_SAMPLER_ENABLED = True
+LIDAR_SAMPLER_PERIOD_MS = 10
+LIDAR_READ_BUDGET_MS = 250
+# Timed readings use trigger()/poll(): the control core polls once per
+# position tick and core 1 once per ms, and the bus lock is held only for
+# each transaction, not for the conversion. False takes each reading with a
+# blocking read_cm (the lidar_bench "blocking" phase).
+LIDAR_SPLIT_PHASE = True
+_lidar_split = LIDAR_SPLIT_PHASE
+_lidar_busy_us = 0        # control-core time spent in LIDAR calls
+# Continuous mode (LidarLiteV4.latest): the sensor measures on its own at the
+# sampling rate and each new result is published, stamped when collected;
+# the sample timer is not used. Set from the Pi with "lidar_continuous".
+LIDAR_CONTINUOUS = False
+_lidar_continuous = LIDAR_CONTINUOUS
+_lidar_rate_hz = 20       # the rate service_sampling last chose
+_lidar_seen_seq = 0
+LIDAR_SAMPLE_MAX_AGE_US = 250000
+LIDAR_RING_LEN = 16
+_lidar_ring_us = [0] * LIDAR_RING_LEN
+_lidar_ring_cm = [0] * LIDAR_RING_LEN
+_lidar_ring_seq = 0       # readings published
+_lidar_ring_taken = 0     # seq already consumed by get_position
+_lidar_ring_lock = _thread.allocate_lock() if _thread is not None else _NoLock()
+_lidar_sampler_run = False
+_lidar_sampler_alive = False
+_lidar_sampler_errors = 0
+_lidar_inline_reads = 0   # readings taken on the control core
+
+# Timer-paced sampling. A machine.Timer interrupt only records its tick and
+# raises _sample_due; the sampler (or, on one core, the position task) takes
+# the reading and stamps it with that tick, so the stream has a fixed
+# cadence: SAMPLE_IDLE_HZ parked, SAMPLE_MOVING_HZ while a command runs.
+# Without the timer the sampler free-runs every LIDAR_SAMPLER_PERIOD_MS.
+SAMPLE_TIMER_ENABLED = True
+SAMPLE_IDLE_HZ = 20
+SAMPLE_MOVING_HZ = 50
+# The acquisition profile follows the same motion state: quick readings for
+# the vent stop while moving, accurate ones parked. "lidar_profile" from the
+# Pi pins one ("auto" to follow motion again).
+LIDAR_PROFILE_MOVING = "fast"
+LIDAR_PROFILE_PARKED = "precise"
+_lidar_profile_fixed = None
+_sample_timer = None
+_sample_hz = 0
+_sample_due = False
+_sample_tick_us = 0
+_sample_overruns = 0      # ticks that found the previous one still unread
+# Per timed reading: the tick's deviation from the period, and the delay
+# from the tick to the start of the read. For {"cmd":"sample_stats"}.
+_sample_last_tick_us = None
+_sample_n = 0
+_sample_dev_sum_us = 0
+_sample_dev_max_us = 0
+_sample_lat_sum_us = 0
+_sample_lat_max_us = 0
+
+
+def _sample_isr(t):
+    global _sample_due, _sample_tick_us, _sample_overruns
+    if _sample_due:
+        _sample_overruns += 1
+    _sample_tick_us = utime.ticks_us()
+    _sample_due = True
+
+
+def sample_timer_active():
+    return _sample_timer is not None
+
+
+def sample_timer_set(hz):
+    """Run the sampling timer at hz (0 stops it). Returns False if unavailable."""
+    global _sample_timer, _sample_hz, _sample_due, _sample_last_tick_us
+    if hz == _sample_hz:
+        return True
+    try:
+        if _sample_timer is not None:
+            _sample_timer.deinit()
+        if hz <= 0:
+            _sample_timer = None
+        else:
+            if _sample_timer is None:
+                _sample_timer = machine.Timer()
+            _sample_timer.init(mode=machine.Timer.PERIODIC, freq=hz, callback=_sample_isr)
+        _sample_hz = hz
+    except Exception as e:
+        _sample_timer = None
+        _sample_hz = 0
+        dbg("sample timer unavailable: " + str(e))
+        return False
+    finally:
+        _sample_due = False
+        _sample_last_tick_us = None
+    return True
+
+
+def sample_take_due():
+    """The tick of a pending timer sample (clearing it), or None."""
+    global _sample_due
+    if not _sample_due:
+        return None
+    _sample_due = False
+    return _sample_tick_us
+
+
+def _sample_note(tick_us, start_us):
+    # Either core takes timed readings, and sample_stats reads and resets
+    # these from core 0, so they change under the ring lock.
+    global _sample_last_tick_us, _sample_n, _sample_dev_sum_us, _sample_dev_max_us
+    global _sample_lat_sum_us, _sample_lat_max_us
+    lat = utime.ticks_diff(start_us, tick_us)
+    with _lidar_ring_lock:
+        _sample_lat_sum_us += lat
+        if lat > _sample_lat_max_us:
+            _sample_lat_max_us = lat
+        if _sample_last_tick_us is not None and _sample_hz:
+            dev = abs(utime.ticks_diff(tick_us, _sample_last_tick_us) - 1000000 // _sample_hz)
+            _sample_dev_sum_us += dev
+            if dev > _sample_dev_max_us:
+                _sample_dev_max_us = dev
+        _sample_last_tick_us = tick_us
+        _sample_n += 1
+
+
+def _lidar_publish(stamp_us, cm):
+    global _lidar_ring_seq, _lidar_sampler_errors
+    if cm is None:
+        with _lidar_ring_lock:
+            _lidar_sampler_errors += 1
+        return False
+    with _lidar_ring_lock:
+        i = _lidar_ring_seq % LIDAR_RING_LEN
+        _lidar_ring_us[i] = stamp_us
+        _lidar_ring_cm[i] = cm
+        _lidar_ring_seq += 1
+    return True
+
+
+def _lidar_trigger():
+    try:
+        with _i2c_lock:
+            return lidar.trigger()
+    except Exception:
+        return False
+
+
+def _lidar_poll():
+    try:
+        with _i2c_lock:
+            return lidar.poll()
+    except Exception:
+        return None
+
+
+def _lidar_collect():
+    """Continuous mode: match the interval to the rate, publish a new result."""
+    global _lidar_seen_seq
+    l = lidar
+    interval = 1000 // _lidar_rate_hz
+    if l.continuous_ms != interval:
+        l.start_continuous(interval)
+    try:
+        with _i2c_lock:
+            cm = l.latest()
+    except Exception:
+        return
+    if l.latest_seq != _lidar_seen_seq:
+        _lidar_seen_seq = l.latest_seq
+        if cm is not None:
+            _lidar_publish(l.latest_us, cm)
+
+
+def lidar_acquire(tick_us=None, feed=True):
+    """
+    Take one reading into the ring, blocking, stamped with the timer tick
+    that asked for it (or the time of the read). Returns False on failure.
+    """
+    start = utime.ticks_us()
+    if tick_us is not None:
+        _sample_note(tick_us, start)
+    try:
+        with _i2c_lock:
+            cm = lidar.read_cm(budget_ms=LIDAR_READ_BUDGET_MS, settle_ms=2, feed=feed)
+    except Exception:
+        cm = None
+    return _lidar_publish(start if tick_us is None else tick_us, cm)
+
+
+def _lidar_sampler():
+    global _lidar_sampler_alive
+    _lidar_sampler_alive = True
+    try:
+        while _lidar_sampler_run:
+            if _lidar_continuous:
+                _lidar_collect()
+                time.sleep_ms(1)
+                continue
+            tick = None
+            if _sample_timer is not None:
+                tick = sample_take_due()
+                if tick is None:
+                    time.sleep_ms(1)
+                    continue
+            if not _lidar_split:
+                lidar_acquire(tick, feed=False)
+            else:
+                start = utime.ticks_us()
+                if tick is not None:
+                    _sample_note(tick, start)
+                cm = None
+                if _lidar_trigger():
+                    while True:
+                        time.sleep_ms(1)
+                        cm = _lidar_poll()
+                        if cm != lidar.NOT_READY:
+                            break
+                _lidar_publish(start if tick is None else tick, cm)
+            if _sample_timer is None:
+                time.sleep_ms(LIDAR_SAMPLER_PERIOD_MS)
+    finally:
+        _lidar_sampler_alive = False
+
+
+def lidar_sampler_active():
+    return _lidar_sampler_alive
+
+
+def lidar_ring_active():
+    """True when get_position reads the ring rather than the LIDAR."""
+    return _lidar_sampler_alive or _sample_timer is not None or _lidar_continuous
+
+
+def lidar_sampler_start():
+    """Start the core 1 sampler. Returns False if it cannot run here."""
+    global _lidar_sampler_run, _lidar_ring_taken
+    if _thread is None or not LIDAR_SAMPLER_ENABLED:
+        return False
+    if _lidar_sampler_alive:
+        _lidar_sampler_run = True
+        return True
+    _lidar_sampler_run = True
+    _lidar_ring_taken = _lidar_ring_seq
+    try:
+        _thread.start_new_thread(_lidar_sampler, ())
+    except Exception as e:
+        _lidar_sampler_run = False
+        dbg("lidar sampler start failed: " + str(e))
+        return False
+    t0 = time.ticks_ms()
+    while not _lidar_sampler_alive and time.ticks_diff(time.ticks_ms(), t0) < 100:
+        time.sleep_ms(1)
+    return _lidar_sampler_alive
+
+
+def lidar_sampler_stop():
+    """Ask the sampler to exit and wait for its current reading to finish."""
+    global _lidar_sampler_run
+    _lidar_sampler_run = False
+    t0 = time.ticks_ms()
+    while _lidar_sampler_alive and time.ticks_diff(time.ticks_ms(), t0) < 500:
+        feed_watchdog()
+        time.sleep_ms(5)
+
+
+def lidar_take_samples(limit, out):
+    """
+    Append to out up to `limit` of the newest readings (cm) published since
+    the last call and no older than LIDAR_SAMPLE_MAX_AGE_US.
+    """
+    global _lidar_ring_taken
+    now = utime.ticks_us()
+    with _lidar_ring_lock:
+        seq = _lidar_ring_seq
+        first = max(_lidar_ring_taken, seq - LIDAR_RING_LEN, seq - limit)
+        _lidar_ring_taken = seq
+        for n in range(first, seq):
+            i = n % LIDAR_RING_LEN
+            if utime.ticks_diff(now, _lidar_ring_us[i]) <= LIDAR_SAMPLE_MAX_AGE_US:
+                out.append(_lidar_ring_cm[i])
+    return out
+
+
+# Split-phase reading in progress on the control core: its timer tick.
+_acq_tick_us = None
+
+
+def service_sampling(moving):
+    """
+    Control-core upkeep for timed sampling: pick the rate and acquisition
+    profile for the motion state and, when core 1 is not sampling, take due readings here, a
+    trigger or a single poll per call.
+    """
+    global _acq_tick_us, _lidar_busy_us, _lidar_rate_hz
+    _lidar_rate_hz = SAMPLE_MOVING_HZ if moving else SAMPLE_IDLE_HZ
+    profile = _lidar_profile_fixed or (LIDAR_PROFILE_MOVING if moving else LIDAR_PROFILE_PARKED)
+    if lidar.profile != profile:
+        lidar.set_profile(profile)
+    if not _lidar_continuous and lidar.continuous_ms:
+        lidar.stop_continuous()
+    if UPDATE_MODE or not (SAMPLE_TIMER_ENABLED or _lidar_continuous):
+        if _sample_timer is not None:
+            sample_timer_set(0)
+        _acq_tick_us = None
+        return
+    sample_timer_set(0 if _lidar_continuous else _lidar_rate_hz)
+    if _lidar_sampler_alive:
+        _acq_tick_us = None
+        return
+
+    t0 = utime.ticks_us()
+    if _lidar_continuous:
+        _acq_tick_us = None
+        _lidar_collect()
+    elif _acq_tick_us is not None:
+        cm = _lidar_poll()
+        if cm != lidar.NOT_READY:
+            _lidar_publish(_acq_tick_us, cm)
+            _acq_tick_us = None
+    else:
+        tick = sample_take_due()
+        if tick is not None:
+            if not _lidar_split:
+                lidar_acquire(tick)
+            else:
+                _sample_note(tick, t0)
+                if _lidar_trigger():
+                    _acq_tick_us = tick
+                else:
+                    _lidar_publish(tick, None)
+    _lidar_busy_us += utime.ticks_diff(utime.ticks_us(), t0)
+
+
+if DEBUG_STATS:
+    def send_sample_stats(reset=False):
+        """
+        Reply to {"cmd":"sample_stats"}: the sampling rate and, per timed
+        reading, the mean and max deviation of its tick from the period and the
+        delay from the tick to the read.
+        """
+        global _sample_n, _sample_dev_sum_us, _sample_dev_max_us
+        global _sample_lat_sum_us, _sample_lat_max_us, _sample_overruns
+        # One consistent snapshot (and reset) against the sampling core.
+        with _lidar_ring_lock:
+            n = _sample_n or 1
+            stats = {
+                "sample_stats": _sample_hz,
+                "core1": _lidar_sampler_alive,
+                "profile": lidar.profile,
+                "profile_switches": lidar.profile_switches,
+                "conv_us": lidar.conv_us,
+                "n": _sample_n,
+                "dev_mean_us": _sample_dev_sum_us // n,
+                "dev_max_us": _sample_dev_max_us,
+                "lat_mean_us": _sample_lat_sum_us // n,
+                "lat_max_us": _sample_lat_max_us,
+                "overruns": _sample_overruns,
+                "errors": _lidar_sampler_errors,
+            }
+            if reset:
+                _sample_n = 0
+                _sample_dev_sum_us = 0
+                _sample_dev_max_us = 0
+                _sample_lat_sum_us = 0
+                _sample_lat_max_us = 0
+                _sample_overruns = 0
+        try:
+            uart_send(ujson.dumps(stats), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+
+
+lidar_sampler_start()
+
+
+# ----------------------------
+# Distance thresholds (inches)
+# ----------------------------
+DOOR_CLOSED_IN = 108
+DOOR_OPEN_IN = 11
+DOOR_VENT_IN = 75
+
+# Clear a remembered vent state once the measured door position moves away
+# from the configured vent location. This also handles movement from a vehicle
+# remote, where the Pico never receives an OPEN or CLOSE command.
+VENT_STATUS_ENTER_DEADBAND_IN = 2.0
+VENT_STATUS_EXIT_DEADBAND_IN = 4.0
+
+LIGHT_LEVEL_ON = 30000
+MAX_TIMEOUT = 30
+
+
+# ----------------------------
+# Globals
+# ----------------------------
+_last_good_distance_in = None
+mapped = 0.0
+
+# LIDAR sanity filter. The physical door target should remain close to the
+# configured open/closed range. Readings outside this envelope are discarded.
+LIDAR_MIN_VALID_IN = 5.0
+LIDAR_MAX_VALID_IN = 140.0
+
+# A single reading cannot legitimately jump this far between samples. Large
+# changes must repeat closely before they are accepted, allowing genuine door
+# movement/reacquisition while rejecting isolated values such as 202 inches.
+LIDAR_MAX_SINGLE_JUMP_IN = 18.0
+LIDAR_JUMP_CONFIRM_TOLERANCE_IN = 4.0
+LIDAR_JUMP_CONFIRM_COUNT = 3
+_lidar_jump_candidate_in = None
+_lidar_jump_candidate_count = 0
+
+LOOP_SLEEP_S = 0.05
+
+# Environmental period: 60 seconds
+ENV_PERIOD_S = 60.0
+_last_env_ts_ms = 0
+
+# Position telemetry is change driven. While parked, a line is sent when the
+# position moves TELEMETRY_DELTA_IN from the last one sent, the light state
+# flips or its reading moves TELEMETRY_LIGHT_DELTA, the vent state changes,
+# or TELEMETRY_KEEPALIVE_MS has passed. While the door moves (a command is
+# running, or the position changed within TELEMETRY_MOVING_HOLD_MS) a line
+# goes out every TELEMETRY_MOVING_MS, and once more when it stops. The
+# thresholds can be set from the Pi with the telemetry_* config keys.
+TELEMETRY_DELTA_IN = 0.5
+TELEMETRY_LIGHT_DELTA = 2000
+TELEMETRY_KEEPALIVE_MS = 5000
+TELEMETRY_MOVING_MS = 100
+TELEMETRY_MOVING_HOLD_MS = 2000
+_telemetry_last_ms = 0
+_telemetry_last_in = None
+_telemetry_last_light = None
+_telemetry_last_light_value = 0
+_telemetry_last_vent = None
+_telemetry_moving_until_ms = 0
+_telemetry_was_moving = False
+_telemetry_sent = 0
+_telemetry_suppressed = 0
+_telemetry_since_ms = utime.ticks_ms()
+
+
+# ----------------------------
+# Debounce / actions
+# ----------------------------
+def service_pulses():
+    """
+    Turns relay outputs off when their non-blocking hold time has expired.
+    Call this often from loops and the main loop.
+    """
+    global _motor_pulse_active, _light_pulse_active
+
+    now = utime.ticks_ms()
+
+    if _motor_pulse_active and utime.ticks_diff(now, _motor_pulse_until_ms) >= 0:
+        MOTOR_MOVE.value(0)
+        _motor_pulse_active = False
+
+    if _light_pulse_active and utime.ticks_diff(now, _light_pulse_until_ms) >= 0:
+        LIGHT_ON_OFF.value(0)
+        _light_pulse_active = False
+
+
+def motor_pulse(force=False):
+    """
+    Starts a garage button pulse without blocking.
+    force=True allows STOP to pulse even when abort_motion is set.
+    """
+    global _motor_pulse_active, _motor_pulse_until_ms
+
+    if abort_motion and not force:
+        return False
+
+    MOTOR_MOVE.value(1)
+    _motor_pulse_active = True
+    _motor_pulse_until_ms = utime.ticks_add(utime.ticks_ms(), button_hold_ms)
+    cmd_ack_relay()
+    return True
+
+
+def light_pulse():
+    """
+    Starts a light button pulse without blocking.
+    """
+    global _light_pulse_active, _light_pulse_until_ms
+
+    LIGHT_ON_OFF.value(1)
+    _light_pulse_active = True
+    _light_pulse_until_ms = utime.ticks_add(utime.ticks_ms(), button_hold_ms)
+    return True
+
+
+def pulse_motor_for_stop():
+    """
+    STOP uses the same wall-button/motor trigger line.
+    Non-blocking pulse is forced even if abort_motion is already true.
+    """
+    motor_pulse(force=True)
+
+
+def stop_start_trigger():
+    # Deliberately retained as a harmless compatibility stub.
+    send_event("wall_stop_ignored")
+
+
+def enqueue_command(cmd):
+    global pending_command, abort_motion
+
+    if utime.ticks_diff(utime.ticks_ms(), _boot_ms) < BOOT_IGNORE_MS:
+        return
+
+    send_event("wall_" + cmd)
+    abort_motion = False
+    pending_command = cmd
+    _cmd_ack_queue(None)
+
+
+def light_turn_on_off():
+    send_event("wall_light")
+    light_pulse()
+
+
+# ----------------------------
+# UART send helpers
+# ----------------------------
+# Preformatted telemetry. The position line is written field by field into a
+# reusable buffer, in the same bytes ujson.dumps produces for the dict in
+# send_position (", " and ": " separators, one decimal for the rounded
+# floats), and queued as a memoryview of that buffer. Views are cached per
+# line length, so after warm-up the only heap use is the float product in
+# _tl_put_tenths. Vent lines are constants.
+_TL_POS_PERCENT = b'{"position_percent": '
+_TL_POS_IN = b', "position_in": '
+_TL_LIGHT = b', "light": "'
+_TL_LIGHT_VALUE = b'", "light_value": '
+_TL_END = b'}\n'
+_TL_ON = b'on'
+_TL_OFF = b'off'
+_TL_VENT_LINES = (b'{"vent_status": 0}\n', b'{"vent_status": 1}\n')
+_tl_pos_buf = bytearray(128)
+# Largest magnitude _tl_put_tenths writes itself: six integer digits and the
+# decimal fit the 7 significant digits of the device's float repr.
+_TL_TENTHS_MAX = 100000
+_tl_pos_views = {}
+
+
+@micropython.viper
+def _tl_put(buf, off: int, src) -> int:
+    """Copy src into buf at off; returns the new offset."""
+    d = ptr8(buf)
+    s = ptr8(src)
+    n = int(len(src))
+    i = 0
+    while i < n:
+        d[off + i] = s[i]
+        i += 1
+    return off + n
+
+
+@micropython.viper
+def _tl_put_uint(buf, off: int, v: int) -> int:
+    """Write v (>= 0) in decimal at off; returns the new offset."""
+    d = ptr8(buf)
+    width = 1
+    t = v
+    while t >= 10:
+        t //= 10
+        width += 1
+    i = off + width
+    while True:
+        i -= 1
+        d[i] = 48 + v % 10
+        v //= 10
+        if i == off:
+            break
+    return off + width
+
+
+def _tl_put_tenths(buf, off, x):
+    """
+    Write round(x, 1) as ujson does on the device, where round(x, 1) is
+    nearbyint(x*10)/10: one decimal, "-" kept for -0.0 and for negatives
+    that round to it. Values ujson would print in exponent form, inf and nan
+    are left to ujson.
+    """
+    if not -_TL_TENTHS_MAX < x < _TL_TENTHS_MAX:
+        return _tl_put(buf, off, ujson.dumps(round(x, 1)).encode())
+    t = round(x * 10)
+    if x < 0 or (x == 0 and math.copysign(1, x) < 0):
+        buf[off] = 45
+        off += 1
+        t = -t
+    off = _tl_put_uint(buf, off, t // 10)
+    buf[off] = 46
+    return _tl_put_uint(buf, off + 1, t % 10)
+
+
+def format_position_line(mapped_pos, actual_distance, light_on, light_value):
+    """The position telemetry line, newline included, as a memoryview."""
+    buf = _tl_pos_buf
+    off = _tl_put(buf, 0, _TL_POS_PERCENT)
+    off = _tl_put_tenths(buf, off, mapped_pos)
+    off = _tl_put(buf, off, _TL_POS_IN)
+    off = _tl_put_tenths(buf, off, actual_distance)
+    off = _tl_put(buf, off, _TL_LIGHT)
+    off = _tl_put(buf, off, _TL_ON if light_on else _TL_OFF)
+    off = _tl_put(buf, off, _TL_LIGHT_VALUE)
+    off = _tl_put_uint(buf, off, int(light_value))
+    off = _tl_put(buf, off, _TL_END)
+    view = _tl_pos_views.get(off)
+    if view is None:
+        view = memoryview(buf)[:off]
+        _tl_pos_views[off] = view
+    return view
+
+
+def send_position(mapped_pos, actual_distance):
+    """
+    FAST: offered every position update, includes light info for HTML bulb.
+    Only sent when the telemetry policy above says it is due.
+    """
+    global _telemetry_last_ms, _telemetry_last_in, _telemetry_last_light
+    global _telemetry_last_light_value, _telemetry_last_vent, _telemetry_moving_until_ms
+    global _telemetry_was_moving, _telemetry_sent, _telemetry_suppressed
+    try:
+        now = utime.ticks_ms()
+        light_value = light_sensor.read_u16()
+        light_detected = 'on' if light_value >= LIGHT_LEVEL_ON else 'off'
+
+        moved = (_telemetry_last_in is None or
+                 abs(actual_distance - _telemetry_last_in) >= TELEMETRY_DELTA_IN)
+        if moved:
+            _telemetry_moving_until_ms = utime.ticks_add(now, TELEMETRY_MOVING_HOLD_MS)
+        moving = (active_motion_command is not None or
+                  utime.ticks_diff(_telemetry_moving_until_ms, now) > 0)
+        since = utime.ticks_diff(now, _telemetry_last_ms)
+
+        if moving:
+            due = since >= TELEMETRY_MOVING_MS
+        else:
+            due = (moved or _telemetry_was_moving or
+                   light_detected != _telemetry_last_light or
+                   abs(light_value - _telemetry_last_light_value) >= TELEMETRY_LIGHT_DELTA or
+                   vent_status != _telemetry_last_vent or
+                   since >= TELEMETRY_KEEPALIVE_MS)
+        if not due:
+            _telemetry_suppressed += 1
+            return
+
+        _telemetry_last_ms = now
+        _telemetry_last_in = actual_distance
+        _telemetry_last_light = light_detected
+        _telemetry_last_light_value = light_value
+        _telemetry_last_vent = vent_status
+        _telemetry_was_moving = moving
+        _telemetry_sent += 1
+
+        if _link_binary:
+            line = format_position_frame(mapped_pos, actual_distance, light_detected == 'on', light_value)
+        else:
+            line = format_position_line(mapped_pos, actual_distance, light_detected == 'on', light_value)
+        uart_send_line(line, TX_PRIO_TELEMETRY, "position")
+    except:
+        pass
+
+
+if DEBUG_STATS:
+    def send_telemetry_stats(reset=False):
+        """
+        Reply to {"cmd":"telemetry_stats"}: position lines sent and suppressed,
+        and the suppressed lines extrapolated to an hour.
+        """
+        global _telemetry_sent, _telemetry_suppressed, _telemetry_since_ms
+        elapsed_ms = utime.ticks_diff(utime.ticks_ms(), _telemetry_since_ms)
+        try:
+            uart_send(ujson.dumps({
+                "telemetry_stats": 1,
+                "sent": _telemetry_sent,
+                "suppressed": _telemetry_suppressed,
+                "saved_per_hour": (_telemetry_suppressed * 3600000) // (elapsed_ms or 1),
+                "elapsed_s": elapsed_ms // 1000,
+                "moving": _telemetry_was_moving,
+            }), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+        if reset:
+            _telemetry_sent = 0
+            _telemetry_suppressed = 0
+            _telemetry_since_ms = utime.ticks_ms()
+
+
+    def telemetry_bench(n=200):
+        """
+        {"cmd":"telemetry_bench","n":200}: time and heap use per position line,
+        ujson.dumps against format_position_line, on the same inputs. Heap use
+        is gc.mem_alloc growth with the collector off. "same" compares the
+        bytes; "equal" compares the parsed objects (key order aside).
+        """
+        n = max(1, min(int(n), 2000))
+        # The bench reuses the position buffer; send any queued line first.
+        uart_tx_flush()
+        mapped_pos = 42.37
+        distance = 57.84
+        light_value = 31234
+        result = {"telemetry_bench": n}
+        gc.collect()
+        gc.disable()
+        try:
+            a0 = gc.mem_alloc()
+            t0 = utime.ticks_us()
+            for _ in range(n):
+                line = ujson.dumps({
+                    'position_percent': round(mapped_pos, 1),
+                    'position_in': round(distance, 1),
+                    'light': 'on',
+                    'light_value': int(light_value),
+                }) + '\n'
+            t1 = utime.ticks_us()
+            a1 = gc.mem_alloc()
+            for _ in range(n):
+                view = format_position_line(mapped_pos, distance, True, light_value)
+            t2 = utime.ticks_us()
+            a2 = gc.mem_alloc()
+        finally:
+            gc.enable()
+        result["ujson_us"] = utime.ticks_diff(t1, t0) // n
+        result["ujson_bytes"] = (a1 - a0) // n
+        result["preformat_us"] = utime.ticks_diff(t2, t1) // n
+        result["preformat_bytes"] = (a2 - a1) // n
+        result["same"] = bytes(view) == line.encode()
+        result["equal"] = ujson.loads(bytes(view)) == ujson.loads(line)
+        uart_send(ujson.dumps(result), TX_PRIO_CONTROL)
+
+
+def send_vent_status(vent):
+    try:
+        if vent == 0 or vent == 1:
+            if _link_binary:
+                uart_send_line(_LINK_VENT_FRAMES[vent], TX_PRIO_EVENT, "vent_status")
+            else:
+                uart_send_line(_TL_VENT_LINES[vent], TX_PRIO_EVENT, "vent_status")
+            return
+        data = ujson.dumps({'vent_status': vent})
+        uart_send(data, TX_PRIO_EVENT, "vent_status")
+    except:
+        pass
+
+
+def _as_float_strip_units(x):
+    # Accepts numbers or strings like "24.3C" or "51.2%"
+    s = str(x).strip()
+    s = s.replace("C", "").replace("c", "").replace("%", "")
+    return float(s)
+
+
+def send_environmental_data():
+    """
+    SLOW: sent once per minute, temp/humidity only (no light here).
+    """
+    if bme is None:
+        return
+    try:
+        with _i2c_lock:
+            temp_c = _as_float_strip_units(bme.temperature)
+            humidity = _as_float_strip_units(bme.humidity)
+        temp_f = (temp_c * 9 / 5) + 32
+
+        humidity_int = int(humidity)
+
+        if _link_binary:
+            uart_send_line(format_env_frame(temp_f, humidity_int), TX_PRIO_TELEMETRY, "environment")
+            return
+
+        data = ujson.dumps({
+            'temperature_f': round(temp_f, 1),
+            'humidity': humidity_int
+        })
+        uart_send(data, TX_PRIO_TELEMETRY, "environment")
+    except:
+        pass
+
+
+# ----------------------------
+# Position read (returns last good instead of None)
+# ----------------------------
+def get_position(sample_count=3, delay=0.001, settle_ms=8):
+    global mapped, _last_good_distance_in, vent_status
+    global _last_lidar_good_ms, _last_lidar_value_in
+    global _lidar_jump_candidate_in, _lidar_jump_candidate_count
+
+    global _lidar_inline_reads, _lidar_busy_us
+
+    valid_readings = []
+    if lidar_ring_active():
+        # Readings are taken on a schedule (timer and/or core 1); use what
+        # has been published, without waiting.
+        samples = lidar_take_samples(sample_count, [])
+    else:
+        samples = None
+
+    if samples is not None and not samples:
+        # Nothing published since the last call; an old value is not news.
+        return None
+
+    for k in range(sample_count if samples is None else len(samples)):
+        if samples is not None:
+            distance_cm = samples[k]
+        else:
+            t0 = utime.ticks_us()
+            distance_cm = lidar.read_cm(budget_ms=LIDAR_READ_BUDGET_MS, settle_ms=settle_ms)
+            _lidar_busy_us += utime.ticks_diff(utime.ticks_us(), t0)
+            if distance_cm is None:
+                time.sleep(delay)
+                continue
+            _lidar_inline_reads += 1
+
+        distance_in = distance_cm / 2.54
+
+        # Reject impossible garage-door measurements before averaging. This
+        # blocks the repeatable bogus ~202-inch reading from reaching motion,
+        # vent, UART, or HTML position logic.
+        if LIDAR_MIN_VALID_IN <= distance_in <= LIDAR_MAX_VALID_IN:
+            valid_readings.append(distance_in)
+
+        if samples is None:
+            time.sleep(delay)
+
+    if valid_readings:
+        # Median is more resistant than an average to one bad sample.
+        valid_readings.sort()
+        count = len(valid_readings)
+        if count & 1:
+            measured_in = valid_readings[count // 2]
+        else:
+            measured_in = (valid_readings[(count // 2) - 1] + valid_readings[count // 2]) / 2.0
+
+        accepted_in = measured_in
+
+        if _last_good_distance_in is not None:
+            jump = abs(measured_in - _last_good_distance_in)
+
+            if jump > LIDAR_MAX_SINGLE_JUMP_IN:
+                # Do not accept a large discontinuity until several successive
+                # calls report approximately the same new distance.
+                if (_lidar_jump_candidate_in is not None and
+                        abs(measured_in - _lidar_jump_candidate_in) <= LIDAR_JUMP_CONFIRM_TOLERANCE_IN):
+                    _lidar_jump_candidate_count += 1
+                    _lidar_jump_candidate_in = (
+                        (_lidar_jump_candidate_in * (_lidar_jump_candidate_count - 1)) + measured_in
+                    ) / _lidar_jump_candidate_count
+                else:
+                    _lidar_jump_candidate_in = measured_in
+                    _lidar_jump_candidate_count = 1
+
+                if _lidar_jump_candidate_count < LIDAR_JUMP_CONFIRM_COUNT:
+                    return _last_good_distance_in
+
+                accepted_in = _lidar_jump_candidate_in
+                _lidar_jump_candidate_in = None
+                _lidar_jump_candidate_count = 0
+            else:
+                _lidar_jump_candidate_in = None
+                _lidar_jump_candidate_count = 0
+
+        m = adafruit_simplemath.map_range(accepted_in, DOOR_OPEN_IN, DOOR_CLOSED_IN, 0, 100)
+        if m < 0:
+            m = 0.0
+        elif m > 100:
+            m = 100.0
+
+        mapped = float(m)
+        _last_good_distance_in = float(accepted_in)
+
+        _last_lidar_good_ms = utime.ticks_ms()
+        _last_lidar_value_in = float(accepted_in)
+
+        send_position(mapped, accepted_in)
+
+        # Determine VENTED from the confirmed LIDAR distance, regardless of
+        # whether the door was moved by the app, wall control, or vehicle remote.
+        # A tighter enter window and wider exit window provide hysteresis so
+        # normal 1-inch LIDAR variation does not make the status flicker.
+        vent_error = abs(accepted_in - DOOR_VENT_IN)
+
+        if vent_status == 0 and vent_error <= VENT_STATUS_ENTER_DEADBAND_IN:
+            vent_status = 1
+            send_vent_status(vent_status)
+        elif vent_status == 1 and vent_error > VENT_STATUS_EXIT_DEADBAND_IN:
+            vent_status = 0
+            send_vent_status(vent_status)
+
+        return accepted_in
+
+    if _last_good_distance_in is not None:
+        return _last_good_distance_in
+
+    return None
+
+
+# ----------------------------
+# UART command handling
+# ----------------------------
+def send_cmd_ack(entry, stage, **extra):
+    """
+    {"ack": id, "cmd": cmd, "stage": stage, "us": n}, where n is the time in
+    microseconds since the Pico parsed the command. Stages, in order:
+      rx        accepted (light: the relay follows at once)
+      dispatch  taken off the queue by the main loop, the motion starts
+      relay     motor relay asserted in motor_pulse (first pulse only)
+    or, ending the command: rejected (with reason), superseded by a newer
+    command, or noop when the motion needed no pulse.
+    """
+    try:
+        payload = {
+            "ack": entry[0],
+            "cmd": entry[1],
+            "stage": stage,
+            "us": utime.ticks_diff(utime.ticks_us(), entry[2]),
+        }
+        for k, v in extra.items():
+            payload[k] = v
+        uart_send(ujson.dumps(payload), TX_PRIO_CONTROL)
+    except Exception:
+        pass
+
+
+def _cmd_ack_queue(entry):
+    """Queue the ack entry with pending_command, superseding any older one."""
+    global _cmd_ack_pending
+    if _cmd_ack_pending is not None:
+        send_cmd_ack(_cmd_ack_pending, "superseded")
+    _cmd_ack_pending = entry
+
+
+def cmd_ack_drop(reason):
+    """pending_command was discarded (update mode, reset)."""
+    global _cmd_ack_pending
+    if _cmd_ack_pending is not None:
+        send_cmd_ack(_cmd_ack_pending, "rejected", reason=reason)
+        _cmd_ack_pending = None
+
+
+def cmd_ack_dispatch(cmd):
+    """The main loop took cmd off the queue and is starting its motion."""
+    global _cmd_ack_pending, _cmd_ack_active, _cmd_ack_relayed
+    entry = _cmd_ack_pending
+    _cmd_ack_pending = None
+    _cmd_ack_relayed = False
+    if entry is not None and entry[1] == cmd:
+        _cmd_ack_active = entry
+        send_cmd_ack(entry, "dispatch")
+    else:
+        _cmd_ack_active = None
+
+
+def cmd_ack_relay():
+    """Called by motor_pulse once the relay is asserted."""
+    global _cmd_ack_relayed
+    if _cmd_ack_active is not None and not _cmd_ack_relayed:
+        _cmd_ack_relayed = True
+        send_cmd_ack(_cmd_ack_active, "relay")
+
+
+def cmd_ack_done():
+    global _cmd_ack_active
+    if _cmd_ack_active is not None and not _cmd_ack_relayed:
+        if abort_motion:
+            send_cmd_ack(_cmd_ack_active, "rejected", reason="aborted")
+        else:
+            send_cmd_ack(_cmd_ack_active, "noop")
+    _cmd_ack_active = None
+
+
+def handle_command(cmd):
+    """
+    Handles commands from the Pi Zero/web app.
+    Accepts: open, close, vent, light.
+    STOP is intentionally ignored because the opener uses the same toggle
+    line for START and STOP. A false STOP while stationary can open the door.
+    A command message with an "id" is acked (see send_cmd_ack).
+    """
+    global stop_command, abort_motion, pending_command
+
+    if cmd is None:
+        return
+
+    try:
+        cmd = str(cmd).strip().lower()
+    except:
+        return
+
+    if cmd == "":
+        return
+
+    entry = None
+    if _cmd_rx_id is not None:
+        entry = [_cmd_rx_id, cmd, _cmd_rx_us]
+
+    if UPDATE_MODE:
+        send_update_status("busy", reason="update_mode")
+        if entry is not None:
+            send_cmd_ack(entry, "rejected", reason="update_mode")
+        return
+
+    if cmd == "stop":
+        send_event("app_stop_ignored")
+        if entry is not None:
+            send_cmd_ack(entry, "rejected", reason="stop_ignored")
+        return
+
+    elif cmd in ("open", "close", "vent"):
+        if entry is not None:
+            send_cmd_ack(entry, "rx")
+        send_event("app_" + cmd)
+        abort_motion = False
+        pending_command = cmd
+        _cmd_ack_queue(entry)
+
+    elif cmd == "light":
+        if entry is not None:
+            send_cmd_ack(entry, "rx")
+        send_event("app_light")
+        light_turn_on_off()
+        if entry is not None:
+            send_cmd_ack(entry, "relay")
+
+    elif entry is not None:
+        send_cmd_ack(entry, "rejected", reason="unknown")
+
+
+# ----------------------------
+# UART config + heartbeat updates from Pi Zero
+# ----------------------------
+# Heartbeat and network-OK lines are recognised byte for byte, without a JSON
+# parse, in the compact and the json.dumps spacing.
+_UART_FAST_LINES = (
+    (b'{"hb":1}', "hb"),
+    (b'{"hb": 1}', "hb"),
+    (b'{"net":1}', "net"),
+    (b'{"net": 1}', "net"),
+)
+_UART_FAST_MAX_LEN = 12
+
+# Per message type: [count, parse_us, dispatch_us, max_us]. Types are
+# command names and keys sent by the Pi, so the table is capped.
+_uart_msg_stats = {}
+UART_MSG_STATS_MAX = 24
+
+
+@micropython.viper
+def _uart_line_equals(line, pat) -> bool:
+    """True if line, ignoring trailing CR/space, is exactly pat."""
+    n = int(len(line))
+    m = int(len(pat))
+    a = ptr8(line)
+    b = ptr8(pat)
+    while n > m and (a[n - 1] == 13 or a[n - 1] == 32):
+        n -= 1
+    if n != m:
+        return False
+    i = 0
+    while i < m:
+        if a[i] != b[i]:
+            return False
+        i += 1
+    return True
+
+
+def _on_hb(value):
+    global _last_hb_ms
+    _last_hb_ms = utime.ticks_ms()
+
+
+def _on_net(value):
+    global _last_net_ms
+    _last_net_ms = utime.ticks_ms()
+
+
+def _on_vent_distance(value):
+    global DOOR_VENT_IN
+    DOOR_VENT_IN = int(value)
+
+
+def _on_min_distance(value):
+    global DOOR_OPEN_IN
+    DOOR_OPEN_IN = int(value)
+
+
+def _on_max_distance(value):
+    global DOOR_CLOSED_IN
+    DOOR_CLOSED_IN = int(value)
+
+
+def _on_light_level_on(value):
+    global LIGHT_LEVEL_ON
+    LIGHT_LEVEL_ON = int(value)
+
+
+def _on_telemetry_delta_in(value):
+    global TELEMETRY_DELTA_IN
+    TELEMETRY_DELTA_IN = float(value)
+
+
+def _on_telemetry_light_delta(value):
+    global TELEMETRY_LIGHT_DELTA
+    TELEMETRY_LIGHT_DELTA = int(value)
+
+
+def _on_telemetry_keepalive_s(value):
+    global TELEMETRY_KEEPALIVE_MS
+    TELEMETRY_KEEPALIVE_MS = int(float(value) * 1000)
+
+
+def _on_lidar_continuous(value):
+    global _lidar_continuous
+    _lidar_continuous = bool(int(value))
+
+
+def _on_lidar_profile(value):
+    global _lidar_profile_fixed
+    if value == "auto":
+        _lidar_profile_fixed = None
+    elif value in LIDAR_PROFILES:
+        _lidar_profile_fixed = value
+
+
+def _cmd_fw_version(msg):
+    send_fw_version()
+
+
+def _cmd_update_cancel(msg):
+    update_cancel("zero_cancel", keep=bool(msg.get('keep', False)))
+
+
+def _cmd_caps(msg):
+    send_link_caps(msg)
+
+
+if DEBUG_STATS:
+    def _cmd_uart_stats(msg):
+        send_uart_stats(bool(msg.get('reset', False)))
+
+    def _cmd_msg_stats(msg):
+        send_msg_stats(bool(msg.get('reset', False)))
+
+    def _cmd_tx_stats(msg):
+        send_tx_stats(bool(msg.get('reset', False)))
+
+    def _cmd_telemetry_stats(msg):
+        send_telemetry_stats(bool(msg.get('reset', False)))
+
+    def _cmd_sched_stats(msg):
+        send_sched_stats(bool(msg.get('reset', False)))
+
+    def _cmd_sample_stats(msg):
+        send_sample_stats(bool(msg.get('reset', False)))
+
+    def _cmd_lidar_bench(msg):
+        start_lidar_bench(msg)
+
+    def _cmd_lidar_alloc_bench(msg):
+        try:
+            lidar_alloc_bench(msg.get('n', 20))
+        except Exception:
+            pass
+
+    def _cmd_lidar_profile_bench(msg):
+        start_lidar_profile_bench(msg)
+
+    def _cmd_telemetry_bench(msg):
+        telemetry_bench(msg.get('n', 200))
+
+
+# {"cmd": name} messages served in any mode, including UPDATE_MODE; firmware
+# update commands must not be rejected as "busy". Handlers take the message.
+_UART_SYSTEM_COMMANDS = {
+    "fw_version": _cmd_fw_version,
+    "update_start": update_start,
+    "update_chunk": update_chunk,
+    "update_end": update_end,
+    "update_resume": update_resume,
+    "update_baud": update_baud_confirm,
+    "update_cancel": _cmd_update_cancel,
+    "caps": _cmd_caps,
+}
+if DEBUG_STATS:
+    _UART_SYSTEM_COMMANDS.update({
+        "uart_stats": _cmd_uart_stats,
+        "msg_stats": _cmd_msg_stats,
+        "tx_stats": _cmd_tx_stats,
+        "telemetry_stats": _cmd_telemetry_stats,
+        "telemetry_bench": _cmd_telemetry_bench,
+        "sched_stats": _cmd_sched_stats,
+        "lidar_bench": _cmd_lidar_bench,
+        "lidar_alloc_bench": _cmd_lidar_alloc_bench,
+        "lidar_profile_bench": _cmd_lidar_profile_bench,
+        "sample_stats": _cmd_sample_stats,
+    })
+
+# Other messages: every known key is passed its value. Only the keys in
+# _UART_UPDATE_MODE_KEYS are acted on during a firmware update.
+_UART_KEY_HANDLERS = {
+    "hb": _on_hb,
+    "net": _on_net,
+    "cmd": handle_command,
+    "command": handle_command,
+    "action": handle_command,
+    "vent_distance": _on_vent_distance,
+    "min_distance": _on_min_distance,
+    "max_distance": _on_max_distance,
+    "light_level_on": _on_light_level_on,
+    "telemetry_delta_in": _on_telemetry_delta_in,
+    "telemetry_light_delta": _on_telemetry_light_delta,
+    "telemetry_keepalive_s": _on_telemetry_keepalive_s,
+    "lidar_continuous": _on_lidar_continuous,
+    "lidar_profile": _on_lidar_profile,
+}
+_UART_UPDATE_MODE_KEYS = ("hb", "net")
+
+
+def _uart_msg_record(kind, t0, t1):
+    global _uart_dispatch_max_us, _uart_dispatch_moving_max_us
+    t2 = utime.ticks_us()
+    if _uart_poll_prev_us is not None:
+        bound = utime.ticks_diff(t2, _uart_poll_prev_us)
+        if active_motion_command is not None:
+            if bound > _uart_dispatch_moving_max_us:
+                _uart_dispatch_moving_max_us = bound
+        elif bound > _uart_dispatch_max_us:
+            _uart_dispatch_max_us = bound
+    entry = _uart_msg_stats.get(kind)
+    if entry is None:
+        if len(_uart_msg_stats) >= UART_MSG_STATS_MAX:
+            kind = "other"
+            entry = _uart_msg_stats.get(kind)
+        if entry is None:
+            entry = [0, 0, 0, 0]
+            _uart_msg_stats[kind] = entry
+    entry[0] += 1
+    entry[1] += utime.ticks_diff(t1, t0)
+    entry[2] += utime.ticks_diff(t2, t1)
+    total = utime.ticks_diff(t2, t0)
+    if total > entry[3]:
+        entry[3] = total
+
+
+if DEBUG_STATS:
+    def send_msg_stats(reset=False):
+        """
+        Reply to {"cmd":"msg_stats"}: per message type, the count and the mean
+        parse and dispatch time in microseconds, plus the slowest message.
+        """
+        stats = {}
+        for kind, entry in _uart_msg_stats.items():
+            n = entry[0] or 1
+            stats[kind] = {"n": entry[0], "parse_us": entry[1] // n,
+                           "dispatch_us": entry[2] // n, "max_us": entry[3]}
+        try:
+            uart_send(ujson.dumps({"msg_stats": stats}), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+        if reset:
+            _uart_msg_stats.clear()
+
+
+def _process_uart_line(line):
+    """line: one received line without its newline, as str or memoryview."""
+    global _cmd_rx_id, _cmd_rx_us
+    if not line:
+        return
+
+    t0 = utime.ticks_us()
+    if len(line) <= _UART_FAST_MAX_LEN and not isinstance(line, str):
+        for pat, key in _UART_FAST_LINES:
+            if _uart_line_equals(line, pat):
+                t1 = utime.ticks_us()
+                _UART_KEY_HANDLERS[key](1)
+                _uart_msg_record(key + "_fast", t0, t1)
+                return
+
+    # Otherwise JSON; ujson parses the receive buffer in place.
+    kind = "text"
+    try:
+        msg = ujson.loads(line)
+        t1 = utime.ticks_us()
+        if not isinstance(msg, dict):
+            raise ValueError("not an object")
+
+        if 'cmd' in msg:
+            kind = str(msg['cmd']).strip().lower()
+            handler = _UART_SYSTEM_COMMANDS.get(kind)
+            if handler is not None:
+                handler(msg)
+                _uart_msg_record(kind, t0, t1)
+                return
+
+        _cmd_rx_id = msg.get('id')
+        _cmd_rx_us = t0
+        try:
+            for key in msg:
+                handler = _UART_KEY_HANDLERS.get(key)
+                if handler is None:
+                    continue
+                if kind == "text":
+                    kind = key
+                if UPDATE_MODE and key not in _UART_UPDATE_MODE_KEYS:
+                    if _cmd_rx_id is not None and handler is handle_command:
+                        send_cmd_ack([_cmd_rx_id, str(msg[key]), t0], "rejected", reason="update_mode")
+                    continue
+                handler(msg[key])
+        finally:
+            _cmd_rx_id = None
+        _uart_msg_record(kind, t0, t1)
+
+    except Exception:
+        # With buffered UART, parse errors should be rare. During update mode,
+        # ignore bad lines instead of replying bad_json, because that can cause
+        # the Zero to wait on the wrong response while the Pico is still alive.
+        if UPDATE_MODE:
+            return
+
+        # Also support plain text commands like STOP, OPEN, CLOSE, VENT, LIGHT.
+        if not isinstance(line, str):
+            try:
+                line = bytes(line).decode()
+            except Exception:
+                return
+        t1 = utime.ticks_us()
+        handle_command(line)
+        _uart_msg_record("text", t0, t1)
+
+
+def send_uart_health(reason):
+    """Send a compact UART diagnostic message to the Pi."""
+    try:
+        uart_send(ujson.dumps({
+            "uart_health": reason,
+            "rx_errors": _uart_error_count,
+            "recoveries": _uart_recovery_count,
+            "rx_buffer_len": _uart_rx_end - _uart_rx_start,
+            "ms": utime.ticks_ms(),
+        }))
+    except Exception:
+        pass
+
+
+def rebuild_uart(reason="unknown"):
+    """
+    Reinitialize UART only after an actual receive exception or buffer overflow.
+    Normal silence, delayed heartbeats, and ordinary partial chunks do not
+    trigger a UART rebuild. This avoids making HTML commands temporarily dead.
+    """
+    global uart, _tx_inflight
+    global _uart_last_recovery_ms, _uart_error_count, _uart_recovery_count
+
+    if UPDATE_MODE:
+        return False
+
+    now = utime.ticks_ms()
+    if utime.ticks_diff(now, _uart_last_recovery_ms) < UART_RECOVERY_COOLDOWN_MS:
+        return False
+
+    _uart_last_recovery_ms = now
+    _uart_error_count += 1
+
+    try:
+        try:
+            uart.deinit()
+        except Exception:
+            pass
+
+        time.sleep_ms(50)
+        uart = UART(0, baudrate=UART_BAUD, tx=Pin(0), rx=Pin(1), rxbuf=8192, txbuf=UART_TXBUF)
+        _uart_rx_clear()
+        _tx_inflight = 0
+        _uart_recovery_count += 1
+        send_uart_health("recovered:" + str(reason))
+        return True
+    except Exception as e:
+        try:
+            print("UART rebuild failed:", e)
+        except Exception:
+            pass
+        return False
+
+
+def _uart_rx_clear():
+    global _uart_rx_start, _uart_rx_end, _uart_partial_since_ms
+    _uart_rx_start = 0
+    _uart_rx_end = 0
+    _uart_partial_since_ms = None
+
+
+def _uart_rx_compact():
+    """Move the unread tail to the front of the buffer."""
+    global _uart_rx_start, _uart_rx_end, _uart_rx_compactions
+    n = _uart_rx_end - _uart_rx_start
+    if n:
+        _uart_rx_mv[0:n] = _uart_rx_mv[_uart_rx_start:_uart_rx_end]
+        _uart_rx_compactions += 1
+    _uart_rx_start = 0
+    _uart_rx_end = n
+
+
+@micropython.viper
+def _uart_find_nl(buf, start: int, end: int) -> int:
+    """Index of the first newline in buf[start:end], or -1."""
+    p = ptr8(buf)
+    i = start
+    while i < end:
+        if p[i] == 10:
+            return i
+        i += 1
+    return -1
+
+
+def service_uart_partial_timeout():
+    """Discard only a genuinely abandoned partial line; never during updates."""
+    global _uart_error_count
+
+    if UPDATE_MODE or _uart_rx_start == _uart_rx_end or _uart_partial_since_ms is None:
+        return
+
+    now = utime.ticks_ms()
+    if utime.ticks_diff(now, _uart_partial_since_ms) > UART_PARTIAL_LINE_TIMEOUT_MS:
+        dropped = _uart_rx_end - _uart_rx_start
+        _uart_rx_clear()
+        _uart_error_count += 1
+        send_uart_health("partial_timeout_dropped_" + str(dropped))
+
+
+def _service_uart_rx_buffer():
+    """
+    Consume complete messages from the receive buffer. Normal traffic is
+    newline-delimited JSON; in binary update mode, frames are taken first and
+    any interleaved JSON line (hb, net, update_cancel) is still processed.
+    A handler may clear the buffer (baud switch), so the bounds are re-read
+    after each message.
+    """
+    global _uart_rx_start, _uart_partial_since_ms, _uart_rx_lines, _uart_rx_frames
+
+    while _uart_rx_start < _uart_rx_end:
+        start = _uart_rx_start
+        end = _uart_rx_end
+        binary = update_binary_active()
+        if binary and (_uart_rx[start] != 0x7B or
+                       (end - start > UPDATE_MAX_LINE_IN_BINARY and
+                        _uart_find_nl(_uart_rx, start, start + UPDATE_MAX_LINE_IN_BINARY) < 0)):
+            consumed, frame = update_take_frame(_uart_rx_mv[start:end])
+            if consumed == 0:
+                break
+            _uart_rx_start = min(start + consumed, _uart_rx_end)
+            _uart_partial_since_ms = utime.ticks_ms() if _uart_rx_start < _uart_rx_end else None
+            if frame is not None:
+                _uart_rx_frames += 1
+                update_process_frame(frame)
+            continue
+
+        if _uart_rx[start] == LINK_MAGIC:
+            consumed, frame = link_take_frame(_uart_rx_mv[start:end])
+            if consumed == 0:
+                break
+            _uart_rx_start = min(start + consumed, _uart_rx_end)
+            _uart_partial_since_ms = utime.ticks_ms() if _uart_rx_start < _uart_rx_end else None
+            if frame is not None:
+                _uart_rx_frames += 1
+                link_process_frame(frame)
+            continue
+
+        nl = _uart_find_nl(_uart_rx, start, end)
+        if nl < 0:
+            break
+
+        _uart_rx_start = nl + 1
+        _uart_partial_since_ms = utime.ticks_ms() if _uart_rx_start < _uart_rx_end else None
+        _uart_rx_lines += 1
+        _process_uart_line(_uart_rx_mv[start:nl])
+
+
+def check_uart():
+    global _uart_rx_end, _uart_partial_since_ms, _uart_error_count
+    global _uart_rx_bytes, _uart_rx_alloc, _uart_rx_alloc_bytes
+    global _uart_poll_us, _uart_poll_prev_us, _uart_gap_max_us, _uart_gap_moving_max_us
+    global _uart_poll_n, _uart_poll_sum_us, _uart_poll_window_max_us
+
+    now_us = utime.ticks_us()
+    if _uart_poll_us is not None:
+        gap = utime.ticks_diff(now_us, _uart_poll_us)
+        _uart_poll_n += 1
+        _uart_poll_sum_us += gap
+        if gap > _uart_poll_window_max_us:
+            _uart_poll_window_max_us = gap
+        if active_motion_command is not None:
+            if gap > _uart_gap_moving_max_us:
+                _uart_gap_moving_max_us = gap
+        elif gap > _uart_gap_max_us:
+            _uart_gap_max_us = gap
+    _uart_poll_prev_us = _uart_poll_us
+    _uart_poll_us = now_us
+
+    # Process only complete newline-terminated messages. A partial line is kept
+    # for up to five seconds, which is long enough for normal commands and does
+    # not interfere with the UART firmware updater.
+    alloc0 = gc.mem_alloc()
+    received = 0
+    try:
+        while uart.any():
+            if _uart_rx_end == MAX_UART_BUFFER:
+                _uart_rx_compact()
+            if _uart_rx_end == MAX_UART_BUFFER:
+                dropped = _uart_rx_end - _uart_rx_start
+                _uart_rx_clear()
+                _uart_error_count += 1
+
+                if UPDATE_MODE:
+                    update_rx_overflow()
+                else:
+                    send_uart_health("overflow_dropped_" + str(dropped))
+                    rebuild_uart("rx_buffer_overflow")
+                break
+
+            n = uart.readinto(_uart_rx_mv[_uart_rx_end:])
+            if not n:
+                break
+
+            if _uart_rx_start == _uart_rx_end:
+                _uart_partial_since_ms = utime.ticks_ms()
+            _uart_rx_end += n
+            received += n
+
+            _service_uart_rx_buffer()
+            if _uart_rx_start == _uart_rx_end:
+                _uart_rx_clear()
+
+        service_uart_partial_timeout()
+
+    except Exception as e:
+        if not UPDATE_MODE:
+            rebuild_uart("check_exception:" + str(e))
+
+    # Replies to what was just received go out in the same call.
+    uart_tx_service()
+
+    if received:
+        _uart_rx_bytes += received
+        grew = gc.mem_alloc() - alloc0
+        if grew >= 0:
+            _uart_rx_alloc += grew
+            _uart_rx_alloc_bytes += received
+
+
+if DEBUG_STATS:
+    def send_uart_stats(reset=False):
+        """Reply to {"cmd":"uart_stats"}; "reset":1 starts a new measurement."""
+        global _uart_rx_bytes, _uart_rx_lines, _uart_rx_frames, _uart_rx_compactions
+        global _uart_rx_alloc, _uart_rx_alloc_bytes
+        try:
+            uart_send(ujson.dumps({
+                "uart_stats": 1,
+                "rx_bytes": _uart_rx_bytes,
+                "lines": _uart_rx_lines,
+                "frames": _uart_rx_frames,
+                "compactions": _uart_rx_compactions,
+                "alloc_per_kb": (_uart_rx_alloc * 1024) // (_uart_rx_alloc_bytes or 1),
+                "rx_errors": _uart_error_count,
+                "buffer": MAX_UART_BUFFER,
+            }), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+        if reset:
+            _uart_rx_bytes = 0
+            _uart_rx_lines = 0
+            _uart_rx_frames = 0
+            _uart_rx_compactions = 0
+            _uart_rx_alloc = 0
+            _uart_rx_alloc_bytes = 0
+
+
+# ----------------------------
+# Movement control (robust comparisons)
+# ----------------------------
+# A command runs as a state machine that the main loop advances one step per
+# tick, so nothing waits inside it and the rest of the loop keeps its cadence
+# while the door travels:
+#   idle -> pulsing -> verifying -> done            open, close
+#                      verifying -> pulsing -> done (wrong way: stop, restart)
+#   idle -> pulsing -> tracking -> stopping -> done vent
+# and aborted from any state when STOP or an update sets abort_motion. Every
+# transition is sent as a motion_<action>_<state>[_<reason>] event, with ms.
+MOTION_IDLE = "idle"
+MOTION_PULSING = "pulsing"
+MOTION_VERIFYING = "verifying"
+MOTION_TRACKING = "tracking"
+MOTION_STOPPING = "stopping"
+MOTION_DONE = "done"
+MOTION_ABORTED = "aborted"
+MOTION_DEADBAND_IN = 1.0
+MOTION_SETTLE_MS = 250
+MOTION_TRACK_MS = 20
+MOTION_TICK_MS = 20
+# With scheduled sampling a read returns None until a new reading is
+# published; how long a read the controller needs may wait for one.
+MOTION_READ_WAIT_MS = 500
+
+
+class MotionController:
+    """
+    One motion at a time. start() begins a command, step() advances it and
+    returns True while it is still running. In pulsing and stopping the
+    controller presses the button `pulses` times, waiting for each relay
+    pulse to finish and MOTION_SETTLE_MS between them, then waits `settle`
+    ms more before entering `after`.
+    """
+    def __init__(self):
+        self.state = MOTION_IDLE
+        self.action = None
+        self.start_in = None
+        self.started_ms = 0
+        self.state_ms = 0
+        self.pulses = 0
+        self.settle = 0
+        self.after = MOTION_DONE
+        self._pulse_started = False
+        self._wait_until_ms = None
+        self._next_read_ms = 0
+
+    def active(self):
+        return self.state not in (MOTION_IDLE, MOTION_DONE, MOTION_ABORTED)
+
+    def reads_position(self):
+        """While tracking the controller samples the LIDAR itself."""
+        return self.state == MOTION_TRACKING
+
+    def _enter(self, state, reason=None):
+        self.state = state
+        self.state_ms = utime.ticks_ms()
+        event = "motion_" + self.action + "_" + state
+        if reason:
+            event += "_" + reason
+        send_event(event)
+
+    def _pulse(self, state, pulses, settle, after, reason=None):
+        self.pulses = pulses
+        self.settle = settle
+        self.after = after
+        self._pulse_started = False
+        self._wait_until_ms = None
+        self._enter(state, reason)
+
+    def start(self, action):
+        global vent_status, abort_motion
+        self.action = action
+        self.started_ms = utime.ticks_ms()
+        send_event("motion_" + action)
+        abort_motion = False
+
+        self.start_in = get_position(sample_count=2, delay=0.001, settle_ms=8)
+        if self.start_in is None:
+            self.start_in = self._recent()
+        if self.start_in is None:
+            self._enter(MOTION_DONE, "no_position")
+            return
+
+        if action == 'open' or action == 'close':
+            vent_status = 0
+            send_vent_status(vent_status)
+            if (action == 'open' and mapped <= 0) or (action == 'close' and mapped >= 100):
+                self._enter(MOTION_DONE, "at_target")
+                return
+            self._pulse(MOTION_PULSING, 1, MOTION_SETTLE_MS, MOTION_VERIFYING)
+
+        elif action == 'vent':
+            # Do not latch VENTED before the door reaches the target. The
+            # position reader clears stale vent state while the door is away
+            # from the configured vent distance, so setting this early caused
+            # the final HTML status to remain a percentage such as 82%.
+            vent_status = 0
+            if abs(self.start_in - DOOR_VENT_IN) <= MOTION_DEADBAND_IN:
+                vent_status = 1
+                send_vent_status(vent_status)
+                self._enter(MOTION_DONE, "at_target")
+                return
+            p = self._read()
+            if p is None:
+                p = self._recent()
+            if p is None:
+                self._enter(MOTION_DONE, "no_position")
+            elif p == DOOR_VENT_IN:
+                self._enter(MOTION_DONE, "at_target")
+            else:
+                self.start_in = p
+                self._pulse(MOTION_PULSING, 1, MOTION_SETTLE_MS, MOTION_TRACKING)
+
+        else:
+            self._enter(MOTION_DONE, "unknown")
+
+    def _read(self):
+        # Fast single sample for motion tracking; None if nothing new.
+        return get_position(sample_count=1, delay=0.001, settle_ms=5)
+
+    def _recent(self):
+        # The door is parked at start(), so a reading accepted within
+        # MOTION_READ_WAIT_MS still tells where it is.
+        if _last_good_distance_in is None:
+            return None
+        if utime.ticks_diff(utime.ticks_ms(), _last_lidar_good_ms) > MOTION_READ_WAIT_MS:
+            return None
+        return _last_good_distance_in
+
+    def step(self):
+        global vent_status
+        if not self.active():
+            return False
+        if abort_motion:
+            self._enter(MOTION_ABORTED)
+            return False
+
+        now = utime.ticks_ms()
+        if self.state == MOTION_PULSING or self.state == MOTION_STOPPING:
+            if self._wait_until_ms is not None:
+                if utime.ticks_diff(now, self._wait_until_ms) < 0:
+                    return True
+                self._wait_until_ms = None
+            if not self._pulse_started and self.pulses > 0:
+                motor_pulse(force=False)
+                self._pulse_started = True
+                self.pulses -= 1
+                return True
+            if _motor_pulse_active:
+                return True
+            if self._pulse_started:
+                self._pulse_started = False
+                wait = MOTION_SETTLE_MS if self.pulses > 0 else self.settle
+                if wait:
+                    self._wait_until_ms = utime.ticks_add(now, wait)
+                    return True
+            if self.pulses > 0:
+                return True
+            if self.state == MOTION_STOPPING:
+                vent_status = 1
+                send_vent_status(vent_status)
+            if self.after == MOTION_TRACKING:
+                self._next_read_ms = now
+            self._enter(self.after)
+            return self.active()
+
+        if self.state == MOTION_VERIFYING:
+            p = self._read()
+            if p is None:
+                if utime.ticks_diff(now, self.state_ms) < MOTION_READ_WAIT_MS:
+                    return True
+                self._enter(MOTION_DONE, "no_position")
+                return False
+            # If distance went the wrong way, pulse again to reverse/stop/restart
+            # depending on opener state.
+            if (self.action == 'open' and p >= self.start_in) or \
+               (self.action == 'close' and p <= self.start_in):
+                self._pulse(MOTION_PULSING, 2, 0, MOTION_DONE, "reverse")
+                return True
+            self._enter(MOTION_DONE)
+            return False
+
+        if self.state == MOTION_TRACKING:
+            if utime.ticks_diff(now, self._next_read_ms) < 0:
+                return True
+            self._next_read_ms = utime.ticks_add(now, MOTION_TRACK_MS)
+            if utime.ticks_diff(now, self.started_ms) > MAX_TIMEOUT * 1000:
+                # As before, a timeout still stops the door and latches VENTED.
+                self._pulse(MOTION_STOPPING, 1, 0, MOTION_DONE, "timeout")
+                return True
+            p = self._read()
+            if p is None:
+                return True
+            if (self.start_in < DOOR_VENT_IN and p >= DOOR_VENT_IN - MOTION_DEADBAND_IN) or \
+               (self.start_in > DOOR_VENT_IN and p <= DOOR_VENT_IN + MOTION_DEADBAND_IN):
+                self._pulse(MOTION_STOPPING, 1, 0, MOTION_DONE)
+            return True
+
+        return self.active()
+
+
+motion = MotionController()
+
+
+# ----------------------------
+# Interrupt bindings
+# ----------------------------
+# IRQ handlers must not sleep, allocate JSON, write UART, touch dictionaries,
+# or start timers. Each handler records a falling-edge time and accepts the
+# command only on a rising edge after the input remained LOW for at least
+# INPUT_MIN_LOW_MS. Brief electrical spikes are discarded.
+BUTTON_OPEN_MASK = 0x01
+BUTTON_CLOSE_MASK = 0x02
+BUTTON_VENT_MASK = 0x04
+BUTTON_LIGHT_MASK = 0x08
+INPUT_MIN_LOW_MS = 40
+
+_irq_pending_mask = 0
+_open_low_since_ms = 0
+_close_low_since_ms = 0
+_vent_low_since_ms = 0
+_light_low_since_ms = 0
+_button_last_accept_ms = {
+    "open": 0,
+    "close": 0,
+    "vent": 0,
+    "light": 0,
+}
+
+
+def _irq_open(pin):
+    global _irq_pending_mask, _open_low_since_ms
+    now = utime.ticks_ms()
+    if pin.value() == 0:
+        if _open_low_since_ms == 0:
+            _open_low_since_ms = now
+    else:
+        started = _open_low_since_ms
+        _open_low_since_ms = 0
+        if started and utime.ticks_diff(now, started) >= INPUT_MIN_LOW_MS:
+            _irq_pending_mask |= BUTTON_OPEN_MASK
+
+
+def _irq_close(pin):
+    global _irq_pending_mask, _close_low_since_ms
+    now = utime.ticks_ms()
+    if pin.value() == 0:
+        if _close_low_since_ms == 0:
+            _close_low_since_ms = now
+    else:
+        started = _close_low_since_ms
+        _close_low_since_ms = 0
+        if started and utime.ticks_diff(now, started) >= INPUT_MIN_LOW_MS:
+            _irq_pending_mask |= BUTTON_CLOSE_MASK
+
+
+def _irq_vent(pin):
+    global _irq_pending_mask, _vent_low_since_ms
+    now = utime.ticks_ms()
+    if pin.value() == 0:
+        if _vent_low_since_ms == 0:
+            _vent_low_since_ms = now
+    else:
+        started = _vent_low_since_ms
+        _vent_low_since_ms = 0
+        if started and utime.ticks_diff(now, started) >= INPUT_MIN_LOW_MS:
+            _irq_pending_mask |= BUTTON_VENT_MASK
+
+
+def _irq_light(pin):
+    global _irq_pending_mask, _light_low_since_ms
+    now = utime.ticks_ms()
+    if pin.value() == 0:
+        if _light_low_since_ms == 0:
+            _light_low_since_ms = now
+    else:
+        started = _light_low_since_ms
+        _light_low_since_ms = 0
+        if started and utime.ticks_diff(now, started) >= INPUT_MIN_LOW_MS:
+            _irq_pending_mask |= BUTTON_LIGHT_MASK
+
+
+def _button_ready(name, now):
+    last = _button_last_accept_ms[name]
+    if last and utime.ticks_diff(now, last) < DEBOUNCE_MS:
+        return False
+    _button_last_accept_ms[name] = now
+    return True
+
+
+def service_button_events():
+    """Consume captured edges safely outside hardware interrupt context."""
+    global _irq_pending_mask
+
+    irq_state = machine.disable_irq()
+    mask = _irq_pending_mask
+    _irq_pending_mask = 0
+    machine.enable_irq(irq_state)
+
+    if not mask:
+        return
+
+    now = utime.ticks_ms()
+    if utime.ticks_diff(now, _boot_ms) < BOOT_IGNORE_MS:
+        return
+
+    if (mask & BUTTON_OPEN_MASK) and active_motion_command != "open" and _button_ready("open", now):
+        enqueue_command("open")
+    if (mask & BUTTON_CLOSE_MASK) and active_motion_command != "close" and _button_ready("close", now):
+        enqueue_command("close")
+    if (mask & BUTTON_VENT_MASK) and active_motion_command != "vent" and _button_ready("vent", now):
+        enqueue_command("vent")
+    if (mask & BUTTON_LIGHT_MASK) and _button_ready("light", now):
+        light_turn_on_off()
+
+
+# Retain the Pin objects for the life of the program.
+stop_input = Pin(STOP_PIN, Pin.IN, Pin.PULL_UP)
+open_input = Pin(OPEN_PIN, Pin.IN, Pin.PULL_UP)
+close_input = Pin(CLOSE_PIN, Pin.IN, Pin.PULL_UP)
+vent_input = Pin(VENT_PIN, Pin.IN, Pin.PULL_UP)
+light_input = Pin(LIGHT_PIN, Pin.IN, Pin.PULL_UP)
+
+# STOP intentionally has no IRQ handler. It cannot trigger an opener pulse.
+qualified_edges = Pin.IRQ_FALLING | Pin.IRQ_RISING
+open_input.irq(trigger=qualified_edges, handler=_irq_open)
+close_input.irq(trigger=qualified_edges, handler=_irq_close)
+vent_input.irq(trigger=qualified_edges, handler=_irq_vent)
+light_input.irq(trigger=qualified_edges, handler=_irq_light)
+
+
+# ----------------------------
+# Pi power-cycle helpers
+# ----------------------------
+def power_cycle_pi(reason="no_hb"):
+    global _last_pi_reset_ms, _last_pi_power_on_ms, _last_hb_ms, _last_net_ms
+    global _link_binary
+
+    dbg("PI RESET: " + reason)
+    _link_binary = False
+
+    _last_pi_reset_ms = utime.ticks_ms()
+
+    # OFF
+    pi_pwr.value(0)
+    time.sleep_ms(PI_POWER_OFF_MS)
+
+    # ON
+    pi_pwr.value(1)
+    _last_pi_power_on_ms = utime.ticks_ms()
+
+    # reset timers so we don't immediately reset again
+    _last_hb_ms = utime.ticks_ms()
+    _last_net_ms = utime.ticks_ms()
+
+
+def pi_heartbeat_watchdog():
+    """
+    Heartbeat-only watchdog. NET is tracked for info but NEVER triggers reset.
+    """
+    global hb_miss_count
+    now = utime.ticks_ms()
+
+    if UPDATE_MODE:
+        hb_miss_count = 0
+        return
+
+    # boot grace
+    if utime.ticks_diff(now, _last_pi_power_on_ms) < PI_BOOT_GRACE_MS:
+        hb_miss_count = 0
+        return
+
+    # cooldown
+    if utime.ticks_diff(now, _last_pi_reset_ms) < PI_RESET_COOLDOWN_MS:
+        hb_miss_count = 0
+        return
+
+    # never reset during motion / commands
+    if pending_command is not None or stop_command:
+        hb_miss_count = 0
+        return
+
+    hb_age = utime.ticks_diff(now, _last_hb_ms)
+
+    # Heartbeat miss counting
+    if hb_age > HB_TIMEOUT_MS:
+        hb_miss_count += 1
+    else:
+        hb_miss_count = 0
+
+    if hb_miss_count >= HB_MISSES_TO_RESET:
+        dbg("WATCHDOG HB TRIP hb_age_ms=" + str(hb_age) +
+            " hb_miss=" + str(hb_miss_count))
+        power_cycle_pi("HB misses=" + str(hb_miss_count) + " age_ms=" + str(hb_age))
+        hb_miss_count = 0
+        return
+
+
+# ----------------------------
+# Scheduler
+# ----------------------------
+# With uasyncio the main loop is a set of tasks, each on its own period:
+# UART receive and transmit, relay pulses and buttons, watchdogs, position,
+# environment, and motion (one MotionController step per tick). Without
+# uasyncio the superloop runs the same work in sequence.
+SCHED_RX_MS = 5
+SCHED_RX_UPDATE_MS = 2
+SCHED_TX_MS = 5
+SCHED_PULSE_MS = 10
+SCHED_MOTION_MS = 10
+SCHED_ENV_MS = 1000
+SCHED_SAMPLE_POLL_MS = 5
+_sched_running = False
+
+# Per task: [runs, longest step in us]. A long step is time no other task ran.
+_sched_task_stats = {}
+
+
+def service_environment():
+    """60s environmental updates (temp/humidity only)."""
+    global _last_env_ts_ms
+    if UPDATE_MODE:
+        return
+    now_ms = utime.ticks_ms()
+    if utime.ticks_diff(now_ms, _last_env_ts_ms) >= int(ENV_PERIOD_S * 1000):
+        _last_env_ts_ms = now_ms
+        send_environmental_data()
+
+
+def service_motion():
+    """
+    One motion tick: advance the running command, or start pending_command.
+    Returns True while a command is running.
+    """
+    global pending_command, active_motion_command
+    if active_motion_command is None:
+        cmd = pending_command
+        if not cmd or UPDATE_MODE:
+            return False
+        pending_command = None
+        active_motion_command = cmd
+        cmd_ack_dispatch(cmd)
+        try:
+            motion.start(cmd)
+            # Press the button in this tick rather than the next.
+            motion.step()
+        except Exception as e:
+            dbg("motion start error: " + str(e))
+            motion.state = MOTION_ABORTED
+    else:
+        try:
+            motion.step()
+        except Exception as e:
+            dbg("motion step error: " + str(e))
+            motion.state = MOTION_ABORTED
+    if motion.active():
+        return True
+    active_motion_command = None
+    cmd_ack_done()
+    return False
+
+
+def _sched_rx_period():
+    # At a raised update rate a full window arrives in a few ms; poll sooner.
+    return SCHED_RX_UPDATE_MS if _update_baud is not None else SCHED_RX_MS
+
+
+def _sched_pulses():
+    service_pulses()
+    service_button_events()
+
+
+def _sched_watchdogs():
+    feed_watchdog()
+    pi_heartbeat_watchdog()
+    service_update()
+    if DEBUG_STATS:
+        service_lidar_bench()
+        service_lidar_profile_bench()
+
+
+def service_position():
+    """Position updates for HTML simulation and status."""
+    service_sampling(motion.active())
+    # While tracking, the controller takes the readings itself.
+    if motion.reads_position():
+        return
+    if not lidar_ring_active():
+        get_position(sample_count=2, delay=0.001, settle_ms=8)
+    elif _lidar_ring_seq != _lidar_ring_taken:
+        get_position(sample_count=2)
+
+
+def _sched_position_period():
+    # Timed samples are picked up within SCHED_SAMPLE_POLL_MS of their tick.
+    if sample_timer_active() or _lidar_continuous:
+        return SCHED_SAMPLE_POLL_MS
+    return int(LOOP_SLEEP_S * 1000)
+
+
+def _sched_position():
+    if UPDATE_MODE:
+        service_sampling(False)
+        return
+    service_position()
+
+
+def _sched_health():
+    if not UPDATE_MODE:
+        lidar_health_check()
+
+
+async def _sched_every(name, period_ms, fn):
+    """Task body: call fn every period_ms (an int or a function)."""
+    entry = [0, 0]
+    _sched_task_stats[name] = entry
+    while True:
+        t0 = utime.ticks_us()
+        try:
+            fn()
+        except Exception as e:
+            dbg("task " + name + " error: " + str(e))
+        us = utime.ticks_diff(utime.ticks_us(), t0)
+        entry[0] += 1
+        if us > entry[1]:
+            entry[1] = us
+        await asyncio.sleep_ms(period_ms() if callable(period_ms) else period_ms)
+
+
+async def _sched_main():
+    global _sched_running
+    _sched_running = True
+    loop_ms = int(LOOP_SLEEP_S * 1000)
+    asyncio.create_task(_sched_every("uart_rx", _sched_rx_period, check_uart))
+    asyncio.create_task(_sched_every("uart_tx", SCHED_TX_MS, uart_tx_service))
+    asyncio.create_task(_sched_every("pulses", SCHED_PULSE_MS, _sched_pulses))
+    asyncio.create_task(_sched_every("watchdogs", loop_ms, _sched_watchdogs))
+    asyncio.create_task(_sched_every("position", _sched_position_period, _sched_position))
+    asyncio.create_task(_sched_every("lidar_health", loop_ms, _sched_health))
+    asyncio.create_task(_sched_every("environment", SCHED_ENV_MS, service_environment))
+    await _sched_every("motion", SCHED_MOTION_MS, service_motion)
+
+
+if DEBUG_STATS:
+    # {"cmd":"lidar_bench","s":10} runs s seconds in each LIDAR mode and then
+    # restores the previous one:
+    #   blocking  control core, read_cm per reading (the CPU waits out each
+    #             conversion)
+    #   split     control core, trigger()/poll() per reading
+    #   dual      core 1 sampler
+    #   continuous  control core, LidarLiteV4 continuous mode
+    # For each it reports the sample rate, the UART poll interval (the control
+    # loop's cadence), lidar_busy_us_per_s, the control-core time spent in
+    # LIDAR calls (blocking minus split is the loop time the split API frees),
+    # and the LIDAR's I2C bus time and transactions per second.
+    _lidar_bench = None
+    LIDAR_BENCH_PHASES = ("blocking", "split", "dual", "continuous")
+
+
+    def _lidar_bench_mark():
+        global _uart_poll_n, _uart_poll_sum_us, _uart_poll_window_max_us
+        _uart_poll_n = 0
+        _uart_poll_sum_us = 0
+        _uart_poll_window_max_us = 0
+        return [utime.ticks_ms(), _lidar_inline_reads, _lidar_ring_seq, _lidar_sampler_errors, _lidar_busy_us,
+                lidar, lidar.bus_us, lidar.bus_ops]
+
+
+    def _lidar_bench_result(mark):
+        ms = utime.ticks_diff(utime.ticks_ms(), mark[0]) or 1
+        mean = _uart_poll_sum_us // (_uart_poll_n or 1)
+        return {
+            "samples_per_s": ((_lidar_inline_reads - mark[1]) + (_lidar_ring_seq - mark[2])) * 1000 // ms,
+            "errors": _lidar_sampler_errors - mark[3],
+            "lidar_busy_us_per_s": (_lidar_busy_us - mark[4]) * 1000 // ms,
+            # A bus rebuild starts new counters.
+            "bus_us_per_s": ((lidar.bus_us - (mark[6] if lidar is mark[5] else 0)) & LIDAR_COUNTER_MASK) * 1000 // ms,
+            "bus_ops_per_s": ((lidar.bus_ops - (mark[7] if lidar is mark[5] else 0)) & LIDAR_COUNTER_MASK) * 1000 // ms,
+            "poll_n": _uart_poll_n,
+            "poll_mean_us": mean,
+            "poll_max_us": _uart_poll_window_max_us,
+            "jitter_us": _uart_poll_window_max_us - mean,
+        }
+
+
+    def _lidar_bench_apply(phase):
+        """Switch to a bench phase; False if it cannot run on this build."""
+        global _lidar_split, _lidar_continuous
+        _lidar_split = phase != "blocking"
+        _lidar_continuous = phase == "continuous"
+        if phase == "dual":
+            return lidar_sampler_start()
+        lidar_sampler_stop()
+        return True
+
+
+    def start_lidar_bench(msg):
+        global _lidar_bench
+        if _lidar_bench is not None or UPDATE_MODE:
+            return
+        try:
+            seconds = max(1, min(60, int(msg.get('s', 10))))
+        except Exception:
+            seconds = 10
+        _lidar_bench = {"ms": seconds * 1000, "phase": 0, "dual_was": lidar_sampler_active(),
+                        "split_was": _lidar_split, "continuous_was": _lidar_continuous, "out": {}}
+        _lidar_bench_apply(LIDAR_BENCH_PHASES[0])
+        _lidar_bench["mark"] = _lidar_bench_mark()
+
+
+    def service_lidar_bench():
+        global _lidar_bench, _lidar_split, _lidar_continuous
+        bench = _lidar_bench
+        if bench is None:
+            return
+        if UPDATE_MODE:
+            _lidar_bench = None
+            _lidar_split = bench["split_was"]
+            _lidar_continuous = bench["continuous_was"]
+            return
+        if utime.ticks_diff(utime.ticks_ms(), bench["mark"][0]) < bench["ms"]:
+            return
+        out = bench["out"]
+        out[LIDAR_BENCH_PHASES[bench["phase"]]] = _lidar_bench_result(bench["mark"])
+        bench["phase"] += 1
+        if bench["phase"] < len(LIDAR_BENCH_PHASES) and _lidar_bench_apply(LIDAR_BENCH_PHASES[bench["phase"]]):
+            bench["mark"] = _lidar_bench_mark()
+            return
+
+        _lidar_bench = None
+        _lidar_split = bench["split_was"]
+        _lidar_continuous = bench["continuous_was"]
+        if bench["dual_was"]:
+            lidar_sampler_start()
+        else:
+            lidar_sampler_stop()
+        if "blocking" in out and "split" in out:
+            out["freed_us_per_s"] = out["blocking"]["lidar_busy_us_per_s"] - out["split"]["lidar_busy_us_per_s"]
+        out["lidar_bench"] = "asyncio" if _sched_running else "superloop"
+        try:
+            uart_send(ujson.dumps(out), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+
+
+    # {"cmd":"lidar_alloc_bench","n":20} takes n blocking readings with the
+    # collector off and reports the heap bytes allocated per sample, then replays
+    # the same I2C transactions with the allocating calls the driver used before
+    # (bytes() per write, readfrom_mem per read) for comparison.
+    def lidar_alloc_bench(n=20):
+        if _lidar_bench is not None or UPDATE_MODE or not hasattr(gc, "mem_alloc"):
+            return
+        n = max(1, min(200, int(n)))
+        out = {"lidar_alloc_bench": n, "samples": 0, "alloc_per_sample": 0,
+               "ops_per_sample": 0, "legacy_alloc_per_sample": 0}
+        addr = lidar.addr
+        i2c_bus = lidar.i2c
+        got = 0
+        with _i2c_lock:
+            ops0 = lidar.bus_ops
+            gc.collect()
+            gc.disable()
+            try:
+                a0 = gc.mem_alloc()
+                for _ in range(n):
+                    if lidar.read_cm() is not None:
+                        got += 1
+                a1 = gc.mem_alloc()
+                ops = ((lidar.bus_ops - ops0) & LIDAR_COUNTER_MASK) // n
+                reads = max(1, ops - 1)
+                b0 = gc.mem_alloc()
+                for _ in range(n):
+                    i2c_bus.writeto_mem(addr, 0x00, bytes([0x04]))
+                    for _ in range(reads - 1):
+                        i2c_bus.readfrom_mem(addr, 0x01, 1)[0]
+                    i2c_bus.readfrom_mem(addr, 0x10, 2)
+                b1 = gc.mem_alloc()
+            except Exception as e:
+                out["error"] = str(e)
+                a0 = a1 = b0 = b1 = 0
+                ops = 0
+            finally:
+                gc.enable()
+        out["samples"] = got
+        out["alloc_per_sample"] = (a1 - a0) // n
+        out["ops_per_sample"] = ops
+        out["legacy_alloc_per_sample"] = (b1 - b0) // n
+        try:
+            uart_send(ujson.dumps(out), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+
+
+    # {"cmd":"lidar_profile_bench","n":30} takes n readings in each acquisition
+    # profile, one per bench step, with the door parked. Per profile it reports
+    # its register values, the trigger-to-ready time (mean and max, polled every
+    # millisecond), the failed readings (where sensitivity shows) and the spread
+    # of the readings (variance in cm^2 x100, against a still door), then
+    # hands the profile back to motion control. Abandoned if the door moves.
+    _profile_bench = None
+    LIDAR_PROFILE_BENCH_ORDER = ("fast", "balanced", "precise")
+
+
+    def start_lidar_profile_bench(msg):
+        global _profile_bench
+        if _profile_bench is not None or UPDATE_MODE:
+            return
+        try:
+            n = max(2, min(100, int(msg.get('n', 30))))
+        except Exception:
+            n = 30
+        _profile_bench = {"n": n, "phase": 0, "fixed_was": _lidar_profile_fixed, "out": {}}
+        _profile_bench_phase(_profile_bench)
+
+
+    def _profile_bench_phase(bench):
+        global _lidar_profile_fixed
+        # [readings, failed, conv_sum_us, conv_max_us, cm_sum, cm_sq_sum]
+        bench["acc"] = [0, 0, 0, 0, 0, 0]
+        _lidar_profile_fixed = LIDAR_PROFILE_BENCH_ORDER[bench["phase"]]
+        lidar.set_profile(_lidar_profile_fixed)
+
+
+    def _profile_bench_finish(bench, error=None):
+        global _profile_bench, _lidar_profile_fixed
+        _profile_bench = None
+        _lidar_profile_fixed = bench["fixed_was"]
+        out = bench["out"]
+        out["lidar_profile_bench"] = bench["n"]
+        if error:
+            out["error"] = error
+        try:
+            uart_send(ujson.dumps(out), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+
+
+    def service_lidar_profile_bench():
+        bench = _profile_bench
+        if bench is None:
+            return
+        if UPDATE_MODE or motion.active():
+            _profile_bench_finish(bench, "moving" if motion.active() else "update")
+            return
+
+        acc = bench["acc"]
+        try:
+            with _i2c_lock:
+                cm = lidar.read_cm(budget_ms=LIDAR_READ_BUDGET_MS, settle_ms=0)
+                conv = lidar.conv_us
+        except Exception:
+            cm = None
+        if cm is None:
+            acc[1] += 1
+        else:
+            acc[0] += 1
+            acc[2] += conv
+            if conv > acc[3]:
+                acc[3] = conv
+            acc[4] += cm
+            acc[5] += cm * cm
+        if acc[0] + acc[1] < bench["n"]:
+            return
+
+        n = acc[0] or 1
+        bench["out"][LIDAR_PROFILE_BENCH_ORDER[bench["phase"]]] = {
+            "acq_count": LIDAR_PROFILES[LIDAR_PROFILE_BENCH_ORDER[bench["phase"]]][0],
+            "sensitivity": LIDAR_PROFILES[LIDAR_PROFILE_BENCH_ORDER[bench["phase"]]][1],
+            "readings": acc[0],
+            "failed": acc[1],
+            "conv_mean_us": acc[2] // n,
+            "conv_max_us": acc[3],
+            "mean_cm": acc[4] // n,
+            "var_cm2_x100": (n * acc[5] - acc[4] * acc[4]) * 100 // (n * n),
+        }
+        bench["phase"] += 1
+        if bench["phase"] < len(LIDAR_PROFILE_BENCH_ORDER):
+            _profile_bench_phase(bench)
+        else:
+            _profile_bench_finish(bench)
+
+
+    def send_sched_stats(reset=False):
+        """
+        Reply to {"cmd":"sched_stats"}: the longest gap between UART polls and
+        the longest UART-to-dispatch bound, idle and while a command runs, and
+        per task its runs and longest step.
+        """
+        global _uart_gap_max_us, _uart_gap_moving_max_us
+        global _uart_dispatch_max_us, _uart_dispatch_moving_max_us
+        try:
+            uart_send(ujson.dumps({
+                "sched_stats": "asyncio" if _sched_running else "superloop",
+                "rx_gap_max_us": _uart_gap_max_us,
+                "rx_gap_moving_max_us": _uart_gap_moving_max_us,
+                "rx_dispatch_max_us": _uart_dispatch_max_us,
+                "rx_dispatch_moving_max_us": _uart_dispatch_moving_max_us,
+                "tasks": _sched_task_stats,
+            }), TX_PRIO_CONTROL)
+        except Exception:
+            pass
+        if reset:
+            _uart_gap_max_us = 0
+            _uart_gap_moving_max_us = 0
+            _uart_dispatch_max_us = 0
+            _uart_dispatch_moving_max_us = 0
+            for entry in _sched_task_stats.values():
+                entry[0] = 0
+                entry[1] = 0
+
+
+# ----------------------------
+# Main loop
+# ----------------------------
+# Motor and light relay pulses are non-blocking.
+# service_pulses() must run every loop.
+try:
+    # RP2040 supports a maximum timeout of approximately 8.3 seconds.
+    wdt = machine.WDT(timeout=8000)
+    send_event("control_watchdog_enabled")
+except Exception as e:
+    wdt = None
+    dbg("control watchdog unavailable: " + str(e))
+
+try:
+    send_event("pico_reset_cause_" + str(machine.reset_cause()))
+except Exception:
+    pass
+
+
+def send_boot_profile():
+    """
+    Follow the reset cause with the boot cost of this build:
+      pico_boot_<py|mpy>_load_ms_<n>   main.py import -> first statement here
+      pico_boot_<py|mpy>_ready_ms_<n>  main.py import -> main loop
+      pico_boot_<py|mpy>_mem_free_<n>  heap free after a collect
+    Comparing py and mpy boots shows the on-device compile cost.
+    """
+    try:
+        fmt = "mpy" if __file__.endswith(".mpy") else "py"
+    except Exception:
+        fmt = "py"
+
+    try:
+        import __main__
+        t0 = getattr(__main__, "_boot_t0_ms", None)
+    except Exception:
+        t0 = None
+
+    if t0 is not None:
+        send_event("pico_boot_" + fmt + "_load_ms_" + str(time.ticks_diff(_boot_module_start_ms, t0)))
+        send_event("pico_boot_" + fmt + "_ready_ms_" + str(time.ticks_diff(time.ticks_ms(), t0)))
+
+    gc.collect()
+    send_event("pico_boot_" + fmt + "_mem_free_" + str(gc.mem_free()))
+
+
+send_boot_profile()
+
+if asyncio is not None:
+    try:
+        asyncio.run(_sched_main())
+    except Exception as e:
+        _sched_running = False
+        dbg("scheduler stopped, running superloop: " + str(e))
+
+# Superloop: used without uasyncio, and if the scheduler ever stops.
+while True:
+    feed_watchdog()
+    check_uart()
+    service_pulses()
+    service_button_events()
+    pi_heartbeat_watchdog()
+    service_update()
+    if DEBUG_STATS:
+        service_lidar_bench()
+        service_lidar_profile_bench()
+
+    if UPDATE_MODE:
+        service_sampling(False)
+        # At a raised rate a full window arrives in a few ms; poll sooner.
+        time.sleep_ms(20 if _update_baud is None else 2)
+        continue
+
+    moving = service_motion()
+
+    # Position updates for HTML simulation and status.
+    service_position()
+
+    # Recovery-only LIDAR watchdog (no Pico reset)
+    lidar_health_check()
+
+    # 60s environmental updates (temp/humidity only)
+    service_environment()
+
+    # A running command is stepped every MOTION_TICK_MS.
+    time.sleep_ms(MOTION_TICK_MS if moving else int(LOOP_SLEEP_S * 1000))
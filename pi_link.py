@@ -0,0 +1,996 @@
+"""
+Host-side (Raspberry Pi, CPython) helpers for the Pico UART link.
+
+This file is not copied to the Pico. It mirrors the framing used by garage.py
+so the Pi can push firmware updates, and it carries the loopback benchmark
+used to compare the JSON/base64 and binary update paths.
+
+    python3 pi_link.py bench garage.py
+    python3 pi_link.py send /dev/serial0 garage.py --mode bin --window 4 [--zlib]
+        [--base garage.py.deployed] [--resume] [--mpy] [--baud 921600]
+    python3 pi_link.py bundle /dev/serial0 garage.py BME280.py version.json
+        [--mode bin] [--window 4] [--zlib] [--mpy] [--baud 921600]
+    python3 pi_link.py tlmbench
+    python3 pi_link.py cmd /dev/serial0 light [--timeout 20]
+
+--mpy compiles the file with mpy-cross for the RP2040 and installs X.mpy;
+the Pico moves the source X.py aside so the bytecode is imported.
+`bundle` sends several files in one session and the Pico swaps them in
+together, so the controller, its drivers and version.json never disagree.
+`tlmbench` compares JSON and binary link records (see LinkDecoder).
+`cmd` sends one command with an id and prints the Pico's acks and latency.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+UART_BAUD = 115200
+# Must match UPDATE_BAUDS / UPDATE_BAUD_* in garage.py.
+UPDATE_BAUDS = (460800, 921600)
+UPDATE_BAUD_HANDSHAKE_MS = 1000
+UPDATE_BAUD_IDLE_MS = 1500
+
+# Must match the UPDATE_FRAME_* constants in garage.py.
+UPDATE_FRAME_MAGIC = 0xA5
+UPDATE_FRAME_DATA = 0x01
+UPDATE_FRAME_END = 0x02
+UPDATE_FRAME_CANCEL = 0x03
+UPDATE_FRAME_HEADER_LEN = 6
+UPDATE_FRAME_CRC_LEN = 4
+UPDATE_FRAME_MAX_PAYLOAD = 1024
+
+# "failed" reasons for one damaged frame; the Pico keeps the session open and
+# the frame is sent again. Any other failure ends the transfer.
+UPDATE_RETRY_REASONS = ("bad_crc", "bad_frame_len", "empty_chunk")
+
+JSON_CHUNK_SIZE = 256
+
+# Must not exceed UPDATE_INFLATE_MAX_WBITS in garage.py.
+UPDATE_INFLATE_WBITS = 10
+
+
+def update_checksum(data, digest="crc32"):
+    """Checksum expected by update_start for the given digest."""
+    if digest == "sha256":
+        return hashlib.sha256(data).hexdigest()
+    return "%08x" % (zlib.crc32(data) & 0xFFFFFFFF)
+
+
+def compress_payload(data, compression="zlib", wbits=UPDATE_INFLATE_WBITS):
+    """Compress for the Pico's bounded-window inflater."""
+    co = zlib.compressobj(9, zlib.DEFLATED, wbits if compression == "zlib" else -wbits)
+    return co.compress(data) + co.flush()
+
+
+# ----------------------------
+# Delta encoding (copy/insert ops, see UPDATE_DELTA_* in garage.py)
+# ----------------------------
+UPDATE_DELTA_COPY = 0x01
+UPDATE_DELTA_INSERT = 0x02
+DELTA_MIN_MATCH = 24
+
+
+def make_delta(old, new, min_match=DELTA_MIN_MATCH):
+    """Greedy copy/insert delta that rebuilds `new` from `old`."""
+    index = {}
+    for i in range(len(old) - min_match + 1):
+        index.setdefault(old[i:i + min_match], i)
+
+    ops = []
+    literal = bytearray()
+
+    def flush_literal():
+        if literal:
+            ops.append(bytes((UPDATE_DELTA_INSERT,)) + len(literal).to_bytes(4, "little") + bytes(literal))
+            del literal[:]
+
+    i = 0
+    while i < len(new):
+        src = index.get(new[i:i + min_match])
+        if src is None:
+            literal.append(new[i])
+            i += 1
+            continue
+        length = min_match
+        while i + length < len(new) and src + length < len(old) and new[i + length] == old[src + length]:
+            length += 1
+        flush_literal()
+        ops.append(bytes((UPDATE_DELTA_COPY,)) + src.to_bytes(4, "little") + length.to_bytes(4, "little"))
+        i += length
+    flush_literal()
+    return b"".join(ops)
+
+
+def apply_delta(old, delta):
+    """Host mirror of UpdateDelta, used to check a delta before sending it."""
+    out = bytearray()
+    i = 0
+    while i < len(delta):
+        op = delta[i]
+        if op == UPDATE_DELTA_COPY:
+            off = int.from_bytes(delta[i + 1:i + 5], "little")
+            length = int.from_bytes(delta[i + 5:i + 9], "little")
+            out += old[off:off + length]
+            i += 9
+        elif op == UPDATE_DELTA_INSERT:
+            length = int.from_bytes(delta[i + 1:i + 5], "little")
+            out += delta[i + 5:i + 5 + length]
+            i += 5 + length
+        else:
+            raise ValueError("bad delta op %d" % op)
+    return bytes(out)
+
+
+# ----------------------------
+# Encoders
+# ----------------------------
+def encode_update_frame(ftype, seq, payload=b""):
+    header = bytes((
+        UPDATE_FRAME_MAGIC,
+        ftype,
+        seq & 0xFF, (seq >> 8) & 0xFF,
+        len(payload) & 0xFF, (len(payload) >> 8) & 0xFF,
+    ))
+    body = header + bytes(payload)
+    return body + (zlib.crc32(body) & 0xFFFFFFFF).to_bytes(4, "little")
+
+
+def encode_json_chunk(seq, payload):
+    return (json.dumps({
+        "cmd": "update_chunk",
+        "seq": seq,
+        "data": base64.b64encode(payload).decode(),
+    }) + "\n").encode()
+
+
+def iter_chunks(data, size):
+    for seq, off in enumerate(range(0, len(data), size)):
+        yield seq, data[off:off + size]
+
+
+def encode_stream(data, mode, chunk_size=None):
+    """Return every byte the sender puts on the wire after update_start."""
+    if mode == "bin":
+        size = chunk_size or UPDATE_FRAME_MAX_PAYLOAD
+        out = [encode_update_frame(UPDATE_FRAME_DATA, seq, c) for seq, c in iter_chunks(data, size)]
+        out.append(encode_update_frame(UPDATE_FRAME_END, 0))
+    else:
+        size = chunk_size or JSON_CHUNK_SIZE
+        out = [encode_json_chunk(seq, c) for seq, c in iter_chunks(data, size)]
+        out.append(b'{"cmd": "update_end"}\n')
+    return b"".join(out)
+
+
+# ----------------------------
+# Decoders (host mirror of the Pico receive path)
+# ----------------------------
+class FrameDecoder:
+    """Incremental decoder with the same resync rules as update_take_frame."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self.buf += data
+        frames = []
+        while self.buf:
+            if self.buf[0] != UPDATE_FRAME_MAGIC:
+                i = self.buf.find(bytes((UPDATE_FRAME_MAGIC,)))
+                del self.buf[:i if i > 0 else len(self.buf)]
+                continue
+            if len(self.buf) < UPDATE_FRAME_HEADER_LEN:
+                break
+            length = self.buf[4] | (self.buf[5] << 8)
+            if length > UPDATE_FRAME_MAX_PAYLOAD:
+                del self.buf[:1]  # stray magic byte
+                continue
+            total = UPDATE_FRAME_HEADER_LEN + length + UPDATE_FRAME_CRC_LEN
+            if len(self.buf) < total:
+                break
+            body = bytes(self.buf[:total - UPDATE_FRAME_CRC_LEN])
+            crc = int.from_bytes(self.buf[total - UPDATE_FRAME_CRC_LEN:total], "little")
+            del self.buf[:total]
+            if zlib.crc32(body) & 0xFFFFFFFF != crc:
+                self.crc_errors += 1
+                continue
+            seq = body[2] | (body[3] << 8)
+            frames.append((body[1], seq, body[UPDATE_FRAME_HEADER_LEN:]))
+        return frames
+
+
+class JsonChunkDecoder:
+    def __init__(self):
+        self.buf = b""
+
+    def feed(self, data):
+        self.buf += data
+        frames = []
+        while b"\n" in self.buf:
+            line, self.buf = self.buf.split(b"\n", 1)
+            msg = json.loads(line)
+            if msg.get("cmd") == "update_chunk":
+                frames.append((UPDATE_FRAME_DATA, msg["seq"], base64.b64decode(msg["data"])))
+            elif msg.get("cmd") == "update_end":
+                frames.append((UPDATE_FRAME_END, 0, b""))
+        return frames
+
+
+# ----------------------------
+# Binary link records (mirrors the block in garage.py)
+# ----------------------------
+LINK_MAGIC = 0xB5
+LINK_POSITION = 0x01
+LINK_VENT = 0x02
+LINK_ENV = 0x03
+LINK_EVENT = 0x04
+LINK_COMMAND = 0x10
+LINK_HB = 0x11
+LINK_NET = 0x12
+LINK_COMMANDS = ("open", "close", "vent", "light", "stop")
+LINK_HEADER_LEN = 3
+LINK_CRC_LEN = 2
+LINK_MAX_PAYLOAD = 64
+
+
+def encode_link_frame(rtype, payload=b""):
+    """0xB5, type, length, payload, CRC-16/CCITT-FALSE (little-endian)."""
+    if len(payload) > LINK_MAX_PAYLOAD:
+        raise ValueError("link payload too long")
+    body = bytes((rtype, len(payload))) + bytes(payload)
+    return bytes((LINK_MAGIC,)) + body + binascii.crc_hqx(body, 0xFFFF).to_bytes(2, "little")
+
+
+def _clamp_u16(v):
+    return max(0, min(0xFFFF, int(round(v))))
+
+
+def encode_link_position(percent, inches, light_on, light_value):
+    return encode_link_frame(LINK_POSITION, b"".join((
+        _clamp_u16(percent * 10).to_bytes(2, "little"),
+        _clamp_u16(inches * 10).to_bytes(2, "little"),
+        bytes((1 if light_on else 0,)),
+        _clamp_u16(light_value).to_bytes(2, "little"),
+    )))
+
+
+def encode_link_vent(status):
+    return encode_link_frame(LINK_VENT, bytes((1 if status else 0,)))
+
+
+def encode_link_env(temp_f, humidity):
+    t = max(-32768, min(32767, int(round(temp_f * 10))))
+    return encode_link_frame(LINK_ENV, t.to_bytes(2, "little", signed=True) +
+                             bytes((max(0, min(255, int(humidity))),)))
+
+
+def encode_link_event(event, ms):
+    text = str(event).encode()[:LINK_MAX_PAYLOAD - 4]
+    return encode_link_frame(LINK_EVENT, (ms & 0xFFFFFFFF).to_bytes(4, "little") + text)
+
+
+def encode_link_command(cmd):
+    return encode_link_frame(LINK_COMMAND, bytes((LINK_COMMANDS.index(cmd),)))
+
+
+def decode_link_record(rtype, payload):
+    """Return a record as the dict its JSON form would parse to."""
+    if rtype == LINK_POSITION and len(payload) == 7:
+        return {
+            "position_percent": int.from_bytes(payload[0:2], "little") / 10.0,
+            "position_in": int.from_bytes(payload[2:4], "little") / 10.0,
+            "light": "on" if payload[4] else "off",
+            "light_value": int.from_bytes(payload[5:7], "little"),
+        }
+    if rtype == LINK_VENT and len(payload) == 1:
+        return {"vent_status": payload[0]}
+    if rtype == LINK_ENV and len(payload) == 3:
+        return {
+            "temperature_f": int.from_bytes(payload[0:2], "little", signed=True) / 10.0,
+            "humidity": payload[2],
+        }
+    if rtype == LINK_EVENT and len(payload) >= 4:
+        return {
+            "event": payload[4:].decode("utf-8", "replace"),
+            "ms": int.from_bytes(payload[0:4], "little"),
+        }
+    if rtype == LINK_COMMAND and len(payload) == 1 and payload[0] < len(LINK_COMMANDS):
+        return {"cmd": LINK_COMMANDS[payload[0]]}
+    if rtype == LINK_HB:
+        return {"hb": 1}
+    if rtype == LINK_NET:
+        return {"net": 1}
+    return None
+
+
+class LinkDecoder:
+    """
+    Splits the Pico's output into messages once {"cmd":"caps","use":"bin1"}
+    is in effect: binary records and JSON lines (replies, updates) arrive
+    interleaved. Same resync rule as the Pico: a bad record costs one byte.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.records = 0
+        self.lines = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self.buf += data
+        out = []
+        while self.buf:
+            if self.buf[0] == LINK_MAGIC:
+                if len(self.buf) < LINK_HEADER_LEN:
+                    break
+                n = self.buf[2]
+                total = LINK_HEADER_LEN + n + LINK_CRC_LEN
+                if n > LINK_MAX_PAYLOAD:
+                    self.crc_errors += 1
+                    del self.buf[:1]
+                    continue
+                if len(self.buf) < total:
+                    break
+                body = bytes(self.buf[1:LINK_HEADER_LEN + n])
+                crc = int.from_bytes(self.buf[total - LINK_CRC_LEN:total], "little")
+                if binascii.crc_hqx(body, 0xFFFF) != crc:
+                    self.crc_errors += 1
+                    del self.buf[:1]
+                    continue
+                del self.buf[:total]
+                msg = decode_link_record(body[0], body[2:])
+                if msg is not None:
+                    self.records += 1
+                    out.append(msg)
+                continue
+            nl = self.buf.find(b"\n")
+            magic = self.buf.find(bytes((LINK_MAGIC,)))
+            if nl < 0 or 0 <= magic < nl:
+                if magic > 0:
+                    # Noise ahead of a record: drop it and resync.
+                    del self.buf[:magic]
+                    continue
+                break
+            line = bytes(self.buf[:nl]).strip()
+            del self.buf[:nl + 1]
+            if line:
+                try:
+                    out.append(json.loads(line))
+                    self.lines += 1
+                except ValueError:
+                    pass
+        return out
+
+
+def telemetry_benchmark(baud=UART_BAUD, n=20000):
+    """
+    Bytes per record and link-limited records/s at `baud` for the JSON and
+    binary forms of the Pico's telemetry, plus host decode throughput.
+    """
+    samples = (
+        ("position",
+         (json.dumps({"position_percent": 42.5, "position_in": 31.2,
+                      "light": "on", "light_value": 1234}) + "\n").encode(),
+         encode_link_position(42.5, 31.2, True, 1234)),
+        ("vent", b'{"vent_status": 1}\n', encode_link_vent(1)),
+        ("environment",
+         (json.dumps({"temperature_f": 71.3, "humidity": 48}) + "\n").encode(),
+         encode_link_env(71.3, 48)),
+        ("event",
+         (json.dumps({"event": "door_open", "ms": 123456789}) + "\n").encode(),
+         encode_link_event("door_open", 123456789)),
+    )
+    results = []
+    for name, line, frame in samples:
+        row = {"record": name}
+        for fmt, wire in (("json", line), ("bin1", frame)):
+            decoder = LinkDecoder()
+            stream = wire * n
+            t0 = time.perf_counter()
+            for off in range(0, len(stream), 64):
+                decoder.feed(stream[off:off + 64])
+            elapsed = time.perf_counter() - t0
+            if decoder.records + decoder.lines != n:
+                raise RuntimeError("telemetry decode mismatch for " + name)
+            row[fmt + "_bytes"] = len(wire)
+            row[fmt + "_per_s"] = int(baud / 10.0 / len(wire))
+            row[fmt + "_decode_per_s"] = int(n / elapsed)
+        row["saved_pct"] = round(100.0 * (len(line) - len(frame)) / len(line), 1)
+        results.append(row)
+    return results
+
+
+# ----------------------------
+# Command acknowledgements
+# ----------------------------
+CMD_ACK_STAGES = ("rx", "dispatch", "relay")
+CMD_ACK_FINAL = ("relay", "rejected", "superseded", "noop")
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+
+class CommandTracker:
+    """
+    Correlates commands with the Pico's acks (see send_cmd_ack in garage.py).
+
+    command() returns the line to write and starts the clock, at the app
+    click if `clicked_at` (a `clock` reading) is given. observe() takes every
+    decoded message from the Pico. For each stage the host latency (click to
+    ack received, so it includes the ack's own trip back) and the Pico's
+    time since receipt are kept; summary() reports p50/p99 of both.
+    """
+
+    def __init__(self, clock=time.monotonic, max_samples=2000):
+        self.clock = clock
+        self.max_samples = max_samples
+        self.next_id = 1
+        self.inflight = {}
+        self.host_ms = {stage: [] for stage in CMD_ACK_STAGES}
+        self.device_us = {stage: [] for stage in CMD_ACK_STAGES}
+        self.outcomes = {}
+
+    def command(self, cmd, clicked_at=None):
+        cid = self.next_id
+        self.next_id = cid % 0xFFFF + 1
+        self.inflight[cid] = (cmd, self.clock() if clicked_at is None else clicked_at)
+        return (json.dumps({"cmd": cmd, "id": cid}) + "\n").encode()
+
+    def observe(self, msg, now=None):
+        """Record an ack; returns True if msg was one of ours."""
+        if not isinstance(msg, dict) or "ack" not in msg:
+            return False
+        entry = self.inflight.get(msg["ack"])
+        if entry is None:
+            return False
+        now = self.clock() if now is None else now
+        stage = msg.get("stage")
+        if stage in CMD_ACK_STAGES:
+            self._add(self.host_ms[stage], (now - entry[1]) * 1000.0)
+            self._add(self.device_us[stage], int(msg.get("us", 0)))
+        if stage in CMD_ACK_FINAL:
+            del self.inflight[msg["ack"]]
+            key = stage if stage != "rejected" else "rejected_" + str(msg.get("reason"))
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+        return True
+
+    def expire(self, timeout_s=30.0, now=None):
+        """Count commands with no final ack after timeout_s as lost."""
+        now = self.clock() if now is None else now
+        lost = [cid for cid, (_cmd, t0) in self.inflight.items() if now - t0 > timeout_s]
+        for cid in lost:
+            del self.inflight[cid]
+        if lost:
+            self.outcomes["lost"] = self.outcomes.get("lost", 0) + len(lost)
+        return lost
+
+    def _add(self, samples, value):
+        samples.append(value)
+        if len(samples) > self.max_samples:
+            del samples[0]
+
+    def summary(self):
+        out = {"outcomes": dict(self.outcomes), "inflight": len(self.inflight)}
+        for stage in CMD_ACK_STAGES:
+            host = self.host_ms[stage]
+            if not host:
+                continue
+            dev = self.device_us[stage]
+            out[stage] = {
+                "n": len(host),
+                "p50_ms": round(_percentile(host, 50), 1),
+                "p99_ms": round(_percentile(host, 99), 1),
+                "pico_p50_us": _percentile(dev, 50),
+                "pico_p99_us": _percentile(dev, 99),
+            }
+        return out
+
+
+# ----------------------------
+# Loopback benchmark
+# ----------------------------
+def loopback_benchmark(data, mode, baud=UART_BAUD, read_size=64):
+    """
+    Push one encoded update through a local socket pair and decode it on the
+    other side in small reads, like the Pico draining its UART FIFO.
+    Returns a dict with wire bytes, link-limited transfer time at `baud`,
+    and the measured host decode throughput.
+    """
+    wire = encode_stream(data, mode)
+    decoder = FrameDecoder() if mode == "bin" else JsonChunkDecoder()
+    tx, rx = socket.socketpair()
+
+    def writer():
+        tx.sendall(wire)
+        tx.close()
+
+    t = threading.Thread(target=writer)
+    received = bytearray()
+    t0 = time.perf_counter()
+    t.start()
+    while True:
+        piece = rx.recv(read_size)
+        if not piece:
+            break
+        for ftype, _seq, payload in decoder.feed(piece):
+            if ftype == UPDATE_FRAME_DATA:
+                received += payload
+    elapsed = time.perf_counter() - t0
+    t.join()
+    rx.close()
+
+    if bytes(received) != bytes(data):
+        raise RuntimeError("loopback payload mismatch in mode " + mode)
+
+    link_s = len(wire) * 10.0 / baud  # 8N1: ten bit times per byte
+    return {
+        "mode": mode,
+        "payload_bytes": len(data),
+        "wire_bytes": len(wire),
+        "overhead_pct": round(100.0 * (len(wire) - len(data)) / len(data), 1),
+        "link_s_at_baud": round(link_s, 2),
+        "link_payload_Bps": int(len(data) / link_s),
+        "decode_MBps": round(len(data) / elapsed / 1e6, 2),
+    }
+
+
+# ----------------------------
+# Sender
+# ----------------------------
+class UpdateSender:
+    """
+    Firmware sender. `port` is any object with write() and readline(), for
+    example serial.Serial(..., timeout=0.05).
+
+    window=1 is the original stop-and-wait exchange. With window > 1 up to
+    `window` chunks are kept in flight; the Pico's cumulative/selective acks
+    advance the window and only chunks still missing after `rto_s` are resent.
+
+    baud (one of UPDATE_BAUDS) asks the Pico to take the transfer at a higher
+    rate; `port` then needs a settable `baudrate`, as serial.Serial has. The
+    sender follows the Pico back to UART_BAUD on "baud_fallback" or when the
+    window stalls, and always leaves the port at UART_BAUD.
+    """
+
+    def __init__(self, port, mode="bin", timeout_s=5.0, window=1, rto_s=0.5, digest="crc32",
+                 compression=None, wbits=UPDATE_INFLATE_WBITS, baud=None):
+        self.port = port
+        self.baud = baud
+        self.link_baud = UART_BAUD
+        self.baud_fallbacks = 0
+        self.mode = mode
+        self.digest = digest
+        self.compression = compression
+        self.wbits = wbits
+        self.timeout_s = timeout_s
+        self.window = window
+        self.rto_s = rto_s
+        self.retransmits = 0
+
+    def _send_json(self, msg):
+        self.port.write((json.dumps(msg) + "\n").encode())
+
+    def _set_baud(self, baud):
+        if baud != self.link_baud:
+            self.port.baudrate = baud
+            self.link_baud = baud
+
+    def _fall_back(self):
+        if self.link_baud != UART_BAUD:
+            self._set_baud(UART_BAUD)
+            self.baud_fallbacks += 1
+            # Ends any noise line the Pico collected while the rates differed.
+            self.port.write(b"\n")
+
+    def _raise_baud(self, baud):
+        """Switch after "ready" and repeat the handshake until the Pico answers."""
+        self._set_baud(baud)
+        # The Pico's deadline started before ours, so by the time this one
+        # passes it has already gone back to UART_BAUD.
+        deadline = time.monotonic() + UPDATE_BAUD_HANDSHAKE_MS / 1000.0 + 0.2
+        next_send = time.monotonic() + 0.01
+        while time.monotonic() < deadline:
+            if time.monotonic() >= next_send:
+                self._send_json({"cmd": "update_baud", "baud": baud})
+                next_send = time.monotonic() + 0.2
+            line = self.port.readline()
+            try:
+                msg = json.loads(line) if line else None
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            if msg.get("update") == "baud_ok":
+                return True
+            if msg.get("update") == "baud_fallback":
+                break
+        self._fall_back()
+        return False
+
+    def _wait_update(self, wanted):
+        deadline = time.monotonic() + self.timeout_s
+        while time.monotonic() < deadline:
+            line = self.port.readline()
+            if not line:
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            status = msg.get("update") if isinstance(msg, dict) else None
+            if status in wanted:
+                return msg
+            if status == "baud_fallback":
+                self._fall_back()
+                continue
+            if status in ("failed", "cancelled"):
+                raise RuntimeError("update " + status + ": " + json.dumps(msg))
+        raise TimeoutError("no " + "/".join(wanted) + " from Pico")
+
+    def _write_chunk(self, seq, chunk):
+        if self.mode == "bin":
+            self.port.write(encode_update_frame(UPDATE_FRAME_DATA, seq, chunk))
+        else:
+            self.port.write(encode_json_chunk(seq, chunk))
+
+    def _write_end(self):
+        if self.mode == "bin":
+            self.port.write(encode_update_frame(UPDATE_FRAME_END, 0))
+        else:
+            self._send_json({"cmd": "update_end"})
+
+    def _send_end(self):
+        # A lost or corrupt END leaves the Pico's session intact, so END is
+        # resent every rto_s (at once after bad_crc) until success.
+        deadline = time.monotonic() + self.timeout_s
+        sent_at = None
+        while time.monotonic() < deadline:
+            now = time.monotonic()
+            if sent_at is None or now - sent_at > self.rto_s:
+                if sent_at is not None:
+                    self.retransmits += 1
+                self._write_end()
+                sent_at = now
+            line = self.port.readline()
+            if not line:
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            status = msg.get("update") if isinstance(msg, dict) else None
+            if status == "success":
+                return msg
+            if status == "baud_fallback":
+                self._fall_back()
+                continue
+            if status == "failed" and msg.get("reason") in UPDATE_RETRY_REASONS:
+                sent_at = None
+                continue
+            if status in ("failed", "cancelled"):
+                raise RuntimeError("update " + status + ": " + json.dumps(msg))
+        raise TimeoutError("no success from Pico")
+
+    def _send_stop_and_wait(self, chunks, seq0=0):
+        # window=1. A per-frame failure leaves the Pico's session open, so
+        # the chunk is resent; a bad_seq expecting the next chunk means the
+        # chunk_ok was lost and the chunk already landed.
+        i = 0
+        last_progress = time.monotonic()
+        while i < len(chunks):
+            seq = seq0 + i
+            self._write_chunk(seq, chunks[i])
+            sent_at = time.monotonic()
+            while True:
+                now = time.monotonic()
+                if now - sent_at > self.rto_s:
+                    self._write_chunk(seq, chunks[i])
+                    sent_at = now
+                    self.retransmits += 1
+                line = self.port.readline()
+                if not line:
+                    stalled = time.monotonic() - last_progress
+                    if self.link_baud != UART_BAUD and stalled > UPDATE_BAUD_IDLE_MS / 1000.0:
+                        self._fall_back()
+                        last_progress = time.monotonic()
+                    elif stalled > self.timeout_s:
+                        raise TimeoutError("no chunk_ok for seq %d" % seq)
+                    continue
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                status = msg.get("update") if isinstance(msg, dict) else None
+                if status == "chunk_ok" and msg.get("seq") == seq:
+                    break
+                if status == "baud_fallback":
+                    self._fall_back()
+                    continue
+                reason = msg.get("reason") if status == "failed" else None
+                if reason == "bad_seq":
+                    if msg.get("got") != seq:
+                        continue  # answer to an earlier resend
+                    if msg.get("expected") == seq + 1:
+                        break
+                    if msg.get("expected") != seq:
+                        raise RuntimeError("update failed: " + json.dumps(msg))
+                    reason = "bad_crc"
+                if reason in UPDATE_RETRY_REASONS:
+                    self._write_chunk(seq, chunks[i])
+                    sent_at = time.monotonic()
+                    self.retransmits += 1
+                    continue
+                if status in ("failed", "cancelled"):
+                    raise RuntimeError("update " + status + ": " + json.dumps(msg))
+            i += 1
+            last_progress = time.monotonic()
+
+    def _send_windowed(self, chunks, window, seq0=0):
+        # Indexes into chunks; the wire seq of chunks[i] is seq0 + i.
+        base = 0
+        acked = set()
+        sent_at = {}
+        last_progress = time.monotonic()
+
+        while base < len(chunks):
+            now = time.monotonic()
+            for seq in range(base, min(base + window, len(chunks))):
+                if seq in acked:
+                    continue
+                if seq not in sent_at:
+                    self._write_chunk(seq0 + seq, chunks[seq])
+                    sent_at[seq] = now
+                elif now - sent_at[seq] > self.rto_s:
+                    self._write_chunk(seq0 + seq, chunks[seq])
+                    sent_at[seq] = now
+                    self.retransmits += 1
+
+            line = self.port.readline()
+            if not line:
+                stalled = time.monotonic() - last_progress
+                if self.link_baud != UART_BAUD and stalled > UPDATE_BAUD_IDLE_MS / 1000.0:
+                    # The Pico drops back on its own after the same idle time.
+                    self._fall_back()
+                    last_progress = time.monotonic()
+                elif stalled > self.timeout_s:
+                    raise TimeoutError("update window stalled at seq %d" % base)
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            if msg.get("update") == "baud_fallback":
+                self._fall_back()
+                continue
+            if msg.get("update") == "failed" and msg.get("reason") in UPDATE_RETRY_REASONS:
+                continue  # corrupt frame; the retransmit timer recovers it
+            if msg.get("update") in ("failed", "cancelled"):
+                raise RuntimeError("update failed: " + json.dumps(msg))
+            if msg.get("update") != "ack":
+                continue
+
+            nxt = int(msg.get("next", seq0 + base)) - seq0
+            if nxt > base:
+                base = nxt
+                last_progress = time.monotonic()
+            acked.update(s - seq0 for s in msg.get("sack", ()) if s - seq0 >= base)
+            for seq in [s for s in sent_at if s < base]:
+                del sent_at[seq]
+            acked = set(s for s in acked if s >= base)
+
+    def send(self, data, filename="garage.py", base=None, base_name=None):
+        """
+        Send `data` as `filename`. When `base` (the bytes of the Pico's
+        current `base_name`) is given, only a delta against it is sent.
+        """
+        start = {
+            "cmd": "update_start",
+            "filename": filename,
+            "size": len(data),
+            "checksum": update_checksum(data, self.digest),
+            "digest": self.digest,
+            "mode": self.mode,
+            "window": self.window,
+        }
+        payload = data
+        if base is not None:
+            payload = make_delta(base, data)
+            if apply_delta(base, payload) != data:
+                raise RuntimeError("delta self-check failed")
+            start["delta_base"] = base_name or filename
+            start["base_checksum"] = update_checksum(base, self.digest)
+        if self.compression:
+            payload = compress_payload(payload, self.compression, self.wbits)
+            start["compression"] = self.compression
+            start["csize"] = len(payload)
+            start["wbits"] = self.wbits
+        return self._transfer(start, payload)
+
+    def send_bundle(self, files):
+        """
+        Send several (filename, data) files in one session; the Pico installs
+        all of them together or none. Compression, if set, covers the whole
+        concatenated stream.
+        """
+        check_bundle_versions(files)
+        start = {
+            "cmd": "update_start",
+            "bundle": [{"filename": name, "size": len(data),
+                        "checksum": update_checksum(data, self.digest)} for name, data in files],
+            "digest": self.digest,
+            "mode": self.mode,
+            "window": self.window,
+        }
+        payload = b"".join(data for _name, data in files)
+        if self.compression:
+            payload = compress_payload(payload, self.compression, self.wbits)
+            start["compression"] = self.compression
+            start["csize"] = len(payload)
+            start["wbits"] = self.wbits
+        return self._transfer(start, payload)
+
+    def resume(self, data):
+        """
+        Continue an interrupted plain transfer of `data` from the Pico's last
+        checkpoint (see update_resume in garage.py).
+        """
+        return self._transfer({
+            "cmd": "update_resume",
+            "size": len(data),
+            "checksum": update_checksum(data, self.digest),
+            "mode": self.mode,
+            "window": self.window,
+        }, data)
+
+    def _transfer(self, start, payload):
+        if self.baud:
+            start["baud"] = self.baud
+        self._send_json(start)
+        ready = self._wait_update(("ready",))
+        chunk_size = int(ready.get("max_payload", JSON_CHUNK_SIZE))
+        window = int(ready.get("window", 1))
+        offset = int(ready.get("offset", 0))
+        seq0 = int(ready.get("seq", 0))
+        payload = payload[offset:]
+
+        try:
+            if "baud" in ready:
+                self._raise_baud(int(ready["baud"]))
+
+            if window > 1:
+                self._send_windowed([c for _seq, c in iter_chunks(payload, chunk_size)], window, seq0)
+            else:
+                self._send_stop_and_wait([c for _seq, c in iter_chunks(payload, chunk_size)], seq0)
+
+            result = self._send_end()
+            result["baud"] = self.link_baud
+            result["baud_fallbacks"] = self.baud_fallbacks
+            return result
+        finally:
+            self._set_baud(UART_BAUD)
+
+
+def check_bundle_versions(files):
+    """
+    Refuse a bundle whose version.json does not match the FW_VERSION that
+    the bundled garage.py reports.
+    """
+    files = dict(files)
+    if "version.json" not in files or "garage.py" not in files:
+        return
+    declared = json.loads(files["version.json"].decode())["version"]
+    found = re.search(rb'^FW_VERSION = "([^"]*)"', files["garage.py"], re.M)
+    if found is None or found.group(1).decode() != declared:
+        raise ValueError("version.json says %s but garage.py has FW_VERSION %s"
+                         % (declared, found.group(1).decode() if found else "?"))
+
+
+def build_mpy(path, march="armv6m"):
+    """Compile a module with mpy-cross for the Pico; returns (name, bytes)."""
+    out = os.path.splitext(path)[0] + ".mpy"
+    subprocess.check_call(["mpy-cross", "-march=" + march, "-o", out, path])
+    with open(out, "rb") as f:
+        return os.path.basename(out), f.read()
+
+
+def _main(argv):
+    if len(argv) >= 2 and argv[0] == "bench":
+        with open(argv[1], "rb") as f:
+            data = f.read()
+        for mode in ("json", "bin"):
+            print(json.dumps(loopback_benchmark(data, mode)))
+        packed = compress_payload(data)
+        result = loopback_benchmark(packed, "bin")
+        result["mode"] = "bin+zlib(wbits=%d)" % UPDATE_INFLATE_WBITS
+        print(json.dumps(result))
+        return 0
+
+    if len(argv) >= 3 and argv[0] == "send":
+        import serial  # pyserial, installed on the Pi
+
+        mode = argv[argv.index("--mode") + 1] if "--mode" in argv else "bin"
+        window = int(argv[argv.index("--window") + 1]) if "--window" in argv else 4
+        compression = "zlib" if "--zlib" in argv else None
+        baud = int(argv[argv.index("--baud") + 1]) if "--baud" in argv else None
+        base = None
+        if "--base" in argv:
+            with open(argv[argv.index("--base") + 1], "rb") as f:
+                base = f.read()
+        if "--mpy" in argv:
+            filename, data = build_mpy(argv[2])
+        else:
+            filename = os.path.basename(argv[2])
+            with open(argv[2], "rb") as f:
+                data = f.read()
+        with serial.Serial(argv[1], UART_BAUD, timeout=0.05) as port:
+            sender = UpdateSender(port, mode=mode, window=window, compression=compression, baud=baud)
+            if "--resume" in argv:
+                print(json.dumps(sender.resume(data)))
+            else:
+                print(json.dumps(sender.send(data, filename=filename, base=base)))
+        return 0
+
+    if len(argv) >= 3 and argv[0] == "bundle":
+        import serial
+
+        mode = argv[argv.index("--mode") + 1] if "--mode" in argv else "bin"
+        window = int(argv[argv.index("--window") + 1]) if "--window" in argv else 4
+        compression = "zlib" if "--zlib" in argv else None
+        baud = int(argv[argv.index("--baud") + 1]) if "--baud" in argv else None
+        files = []
+        for i, path in enumerate(argv[2:], 2):
+            if path.startswith("--") or argv[i - 1] in ("--mode", "--window", "--baud"):
+                continue
+            if "--mpy" in argv and path.endswith(".py") and os.path.basename(path) != "main.py":
+                files.append(build_mpy(path))
+            else:
+                with open(path, "rb") as f:
+                    files.append((os.path.basename(path), f.read()))
+        with serial.Serial(argv[1], UART_BAUD, timeout=0.05) as port:
+            sender = UpdateSender(port, mode=mode, window=window, compression=compression, baud=baud)
+            print(json.dumps(sender.send_bundle(files)))
+        return 0
+
+    if len(argv) >= 3 and argv[0] == "cmd":
+        import serial
+
+        timeout_s = float(argv[argv.index("--timeout") + 1]) if "--timeout" in argv else 20.0
+        tracker = CommandTracker()
+        decoder = LinkDecoder()
+        with serial.Serial(argv[1], UART_BAUD, timeout=0.05) as port:
+            port.write(tracker.command(argv[2]))
+            deadline = time.monotonic() + timeout_s
+            while tracker.inflight and time.monotonic() < deadline:
+                for msg in decoder.feed(port.read(256)):
+                    if tracker.observe(msg):
+                        print(json.dumps(msg))
+            tracker.expire(0)
+        print(json.dumps(tracker.summary()))
+        return 0
+
+    if argv and argv[0] == "tlmbench":
+        for row in telemetry_benchmark():
+            print(json.dumps(row))
+        return 0
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,406 @@
+"""
+Host checks for pi_link.py: update frames and their decoders, the delta
+encoder, link records, the bundle version check and the UpdateSender ack
+handling against a scripted Pico.
+"""
+import base64
+import binascii
+import json
+import os
+import random
+import sys
+import zlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pi_link  # noqa: E402
+
+
+def payload_of(n, seed=0):
+    rnd = random.Random(seed)
+    return bytes(rnd.randrange(256) for _ in range(n))
+
+
+# ----------------------------
+# Update frames
+# ----------------------------
+def test_frame_layout():
+    frame = pi_link.encode_update_frame(pi_link.UPDATE_FRAME_DATA, 0x1234, b"abc")
+    assert frame[:6] == bytes((0xA5, 0x01, 0x34, 0x12, 3, 0))
+    assert frame[6:9] == b"abc"
+    assert int.from_bytes(frame[9:], "little") == zlib.crc32(frame[:9]) & 0xFFFFFFFF
+    assert len(pi_link.encode_update_frame(pi_link.UPDATE_FRAME_END, 0)) == 10
+
+
+def test_frame_decoder_round_trip_in_small_reads():
+    data = payload_of(5000, 1)
+    wire = pi_link.encode_stream(data, "bin", chunk_size=700)
+    dec = pi_link.FrameDecoder()
+    frames = []
+    for i in range(0, len(wire), 13):
+        frames += dec.feed(wire[i:i + 13])
+    assert [f[1] for f in frames[:-1]] == list(range(8))
+    assert b"".join(f[2] for f in frames if f[0] == pi_link.UPDATE_FRAME_DATA) == data
+    assert frames[-1] == (pi_link.UPDATE_FRAME_END, 0, b"")
+    assert dec.crc_errors == 0
+
+
+def test_frame_decoder_skips_noise_and_corrupt_frames():
+    good = pi_link.encode_update_frame(pi_link.UPDATE_FRAME_DATA, 1, b"good")
+    bad = bytearray(pi_link.encode_update_frame(pi_link.UPDATE_FRAME_DATA, 2, b"bad!"))
+    bad[7] ^= 0x01
+    dec = pi_link.FrameDecoder()
+    frames = dec.feed(b"\x00noise" + bytes(bad) + good)
+    assert frames == [(pi_link.UPDATE_FRAME_DATA, 1, b"good")]
+    assert dec.crc_errors == 1
+
+
+def test_frame_decoder_treats_oversize_length_as_noise():
+    # A stray magic byte whose "length" is beyond any real frame must not
+    # stall the decoder waiting for ~64 KB.
+    good = pi_link.encode_update_frame(pi_link.UPDATE_FRAME_DATA, 3, b"x")
+    dec = pi_link.FrameDecoder()
+    assert dec.feed(bytes((0xA5, 0x01, 0, 0, 0xFF, 0xFF)) + good) == [
+        (pi_link.UPDATE_FRAME_DATA, 3, b"x")]
+
+
+def test_json_chunks_round_trip():
+    data = payload_of(1000, 2)
+    wire = pi_link.encode_stream(data, "json")
+    first = json.loads(wire.split(b"\n", 1)[0])
+    assert first["cmd"] == "update_chunk" and first["seq"] == 0
+    assert base64.b64decode(first["data"]) == data[:pi_link.JSON_CHUNK_SIZE]
+    frames = pi_link.JsonChunkDecoder().feed(wire)
+    assert b"".join(f[2] for f in frames if f[0] == pi_link.UPDATE_FRAME_DATA) == data
+    assert frames[-1][0] == pi_link.UPDATE_FRAME_END
+
+
+@pytest.mark.parametrize("mode", ["bin", "json"])
+def test_loopback_benchmark(mode):
+    result = pi_link.loopback_benchmark(payload_of(4096, 3), mode)
+    assert result["payload_bytes"] == 4096
+    assert result["wire_bytes"] > 4096
+
+
+def test_update_checksum():
+    assert pi_link.update_checksum(b"123456789") == "cbf43926"
+    assert pi_link.update_checksum(b"", "sha256").startswith("e3b0c442")
+
+
+@pytest.mark.parametrize("compression,wbits", [("zlib", 10), ("raw", -10)])
+def test_compress_payload_fits_the_window(compression, wbits):
+    data = read("garage.py")[:20000]
+    packed = pi_link.compress_payload(data, compression)
+    assert len(packed) < len(data)
+    assert zlib.decompressobj(wbits).decompress(packed) == data
+
+
+# ----------------------------
+# Delta encoding
+# ----------------------------
+def delta_ops(delta):
+    ops = []
+    i = 0
+    while i < len(delta):
+        if delta[i] == pi_link.UPDATE_DELTA_COPY:
+            ops.append("copy")
+            i += 9
+        else:
+            ops.append("insert")
+            i += 5 + int.from_bytes(delta[i + 1:i + 5], "little")
+    return ops
+
+
+@pytest.mark.parametrize("size", [1, 7, 300, 1024])
+def test_delta_rebuilds_edited_file(size):
+    old = payload_of(8000, 5)
+    piece = payload_of(size, 6)
+    new = old[:2000] + piece + old[2000:5000] + old[5000 + size:] + piece
+    delta = pi_link.make_delta(old, new)
+    assert pi_link.apply_delta(old, delta) == new
+    assert len(delta) < len(new) // 2
+
+
+def test_delta_of_identical_file_is_one_copy():
+    old = payload_of(4000, 7)
+    delta = pi_link.make_delta(old, old)
+    assert delta_ops(delta) == ["copy"]
+    assert pi_link.apply_delta(old, delta) == old
+
+
+@pytest.mark.parametrize("old,new", [(b"", b"all new"), (b"short", b"short"), (b"abc" * 100, b"")])
+def test_delta_edge_cases(old, new):
+    assert pi_link.apply_delta(old, pi_link.make_delta(old, new)) == new
+
+
+def test_apply_delta_rejects_unknown_op():
+    with pytest.raises(ValueError):
+        pi_link.apply_delta(b"", b"\x07")
+
+
+# ----------------------------
+# Link records
+# ----------------------------
+def test_link_crc_is_ccitt_false():
+    assert binascii.crc_hqx(b"123456789", 0xFFFF) == 0x29B1
+    frame = pi_link.encode_link_frame(pi_link.LINK_HB)
+    assert frame[:3] == bytes((0xB5, pi_link.LINK_HB, 0))
+    assert int.from_bytes(frame[3:], "little") == binascii.crc_hqx(frame[1:3], 0xFFFF)
+
+
+def test_link_frame_rejects_long_payload():
+    with pytest.raises(ValueError):
+        pi_link.encode_link_frame(pi_link.LINK_EVENT, bytes(pi_link.LINK_MAX_PAYLOAD + 1))
+
+
+RECORDS = [
+    (pi_link.encode_link_position(42.37, 57.8, True, 812),
+     {"position_percent": 42.4, "position_in": 57.8, "light": "on", "light_value": 812}),
+    (pi_link.encode_link_position(-3, 1e9, False, 70000),
+     {"position_percent": 0.0, "position_in": 6553.5, "light": "off", "light_value": 65535}),
+    (pi_link.encode_link_vent(1), {"vent_status": 1}),
+    (pi_link.encode_link_env(-12.34, 300), {"temperature_f": -12.3, "humidity": 255}),
+    (pi_link.encode_link_event("door_open", 0x1_0000_0005), {"event": "door_open", "ms": 5}),
+    (pi_link.encode_link_command("stop"), {"cmd": "stop"}),
+    (pi_link.encode_link_frame(pi_link.LINK_HB), {"hb": 1}),
+    (pi_link.encode_link_frame(pi_link.LINK_NET), {"net": 1}),
+]
+
+
+@pytest.mark.parametrize("frame,msg", RECORDS)
+def test_link_record_round_trip(frame, msg):
+    dec = pi_link.LinkDecoder()
+    assert dec.feed(frame) == [msg]
+    assert dec.records == 1
+
+
+def test_link_decoder_mixed_stream_in_small_reads():
+    wire = b"".join((
+        RECORDS[0][0],
+        b'{"update": "chunk_ok", "seq": 1}\n',
+        RECORDS[2][0],
+        b"\x00\x13junk",
+        RECORDS[4][0],
+        b'{"ack": 7, "stage": "rx"}\n',
+    ))
+    dec = pi_link.LinkDecoder()
+    out = []
+    for i in range(0, len(wire), 5):
+        out += dec.feed(wire[i:i + 5])
+    assert out == [RECORDS[0][1], {"update": "chunk_ok", "seq": 1}, RECORDS[2][1], RECORDS[4][1],
+                   {"ack": 7, "stage": "rx"}]
+    assert (dec.records, dec.lines, dec.crc_errors) == (3, 2, 0)
+
+
+def test_link_decoder_resyncs_after_corrupt_record():
+    bad = bytearray(RECORDS[0][0])
+    bad[4] ^= 0x40
+    dec = pi_link.LinkDecoder()
+    assert dec.feed(bytes(bad) + RECORDS[5][0]) == [RECORDS[5][1]]
+    assert dec.crc_errors >= 1
+
+
+def test_link_decoder_oversize_length_costs_one_byte():
+    dec = pi_link.LinkDecoder()
+    assert dec.feed(bytes((0xB5, 0x01, 0xFF)) + RECORDS[2][0]) == [RECORDS[2][1]]
+    assert dec.crc_errors == 1
+
+
+# ----------------------------
+# Bundle manifest
+# ----------------------------
+def read(name):
+    with open(os.path.join(ROOT, name), "rb") as f:
+        return f.read()
+
+
+def test_repo_bundle_versions_agree():
+    pi_link.check_bundle_versions([("garage.py", read("garage.py")),
+                                   ("version.json", read("version.json"))])
+
+
+def test_bundle_version_mismatch_is_refused():
+    with pytest.raises(ValueError):
+        pi_link.check_bundle_versions([("garage.py", b'FW_VERSION = "1.0.1"\n'),
+                                       ("version.json", b'{"version": "1.0.2"}')])
+    with pytest.raises(ValueError):
+        pi_link.check_bundle_versions([("garage.py", b"x = 1\n"),
+                                       ("version.json", b'{"version": "1.0.2"}')])
+
+
+def test_bundle_without_manifest_is_not_checked():
+    pi_link.check_bundle_versions([("garage.py", b"x = 1\n"), ("BME280.py", b"")])
+
+
+# ----------------------------
+# UpdateSender against a scripted Pico
+# ----------------------------
+class FakePico:
+    """
+    Answers the sender like update_accept_chunk/update_end in garage.py.
+    `corrupt` and `drop_frame` name data-frame writes (0-based, counting
+    resends) that arrive with a flipped bit or not at all; `drop_reply`
+    names replies (0-based) that never reach the Pi.
+    """
+
+    def __init__(self, window=1, max_payload=256, corrupt=(), drop_frame=(), drop_reply=(),
+                 drop_end=0):
+        self.window = window
+        self.max_payload = max_payload
+        self.corrupt = set(corrupt)
+        self.drop_frame = set(drop_frame)
+        self.drop_reply = set(drop_reply)
+        self.drop_end = drop_end
+        self.decoder = pi_link.FrameDecoder()
+        self.frames = 0
+        self.replies = 0
+        self.ends = 0
+        self.expected = 0
+        self.pending = {}
+        self.data = bytearray()
+        self.out = []
+        self.line = b""
+        self.start = None
+
+    def reply(self, **msg):
+        n = self.replies
+        self.replies += 1
+        if n not in self.drop_reply:
+            self.out.append((json.dumps(msg) + "\n").encode())
+
+    def write(self, data):
+        data = bytes(data)
+        if data[:1] == b"{":
+            self.start = json.loads(data)
+            self.reply(update="ready", max_payload=self.max_payload, window=self.window)
+            return len(data)
+        if data[1] == pi_link.UPDATE_FRAME_DATA:
+            n = self.frames
+            self.frames += 1
+            if n in self.drop_frame:
+                return len(data)
+            if n in self.corrupt:
+                data = data[:-1] + bytes((data[-1] ^ 0x01,))
+        errors = self.decoder.crc_errors
+        for ftype, seq, chunk in self.decoder.feed(data):
+            if ftype == pi_link.UPDATE_FRAME_END:
+                self.ends += 1
+                if self.ends > self.drop_end:
+                    self.reply(update="success", size=len(self.data))
+            else:
+                self.accept(seq, chunk)
+        if self.decoder.crc_errors != errors:
+            self.reply(update="failed", reason="bad_crc", seq=data[2] | (data[3] << 8))
+        return len(data)
+
+    def accept(self, seq, chunk):
+        if self.window <= 1:
+            if seq != self.expected:
+                self.reply(update="failed", reason="bad_seq", expected=self.expected, got=seq)
+                return
+            self.data += chunk
+            self.expected += 1
+            self.reply(update="chunk_ok", seq=seq, received=len(self.data))
+            return
+        if seq == self.expected:
+            self.data += chunk
+            self.expected += 1
+            while self.expected in self.pending:
+                self.data += self.pending.pop(self.expected)
+                self.expected += 1
+        elif self.expected < seq < self.expected + self.window:
+            self.pending.setdefault(seq, chunk)
+        self.reply(update="ack", seq=seq, next=self.expected, received=len(self.data),
+                   sack=sorted(self.pending))
+
+    def readline(self):
+        return self.out.pop(0) if self.out else b""
+
+
+def sender(pico, window=1):
+    return pi_link.UpdateSender(pico, mode="bin", timeout_s=2.0, window=window, rto_s=0.02)
+
+
+DATA = payload_of(2560, 8)  # ten 256-byte chunks
+
+
+def test_stop_and_wait_clean():
+    pico = FakePico()
+    s = sender(pico)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+    assert pico.start["checksum"] == pi_link.update_checksum(DATA)
+    assert s.retransmits == 0
+
+
+def test_stop_and_wait_resends_corrupt_and_lost_chunks():
+    pico = FakePico(corrupt=[2], drop_frame=[5])
+    s = sender(pico)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+    assert s.retransmits == 2
+
+
+def test_stop_and_wait_lost_chunk_ok_does_not_duplicate():
+    # Replies: 0 ready, 1.. chunk_ok. Losing chunk_ok for seq 3 makes the
+    # resend come back as bad_seq expecting seq 4.
+    pico = FakePico(drop_reply=[4])
+    s = sender(pico)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+    assert s.retransmits == 1
+
+
+def test_stop_and_wait_gives_up_on_fatal_bad_seq():
+    pico = FakePico()
+    pico.expected = 5
+    with pytest.raises(RuntimeError):
+        sender(pico).send(DATA)
+
+
+def test_end_is_resent_until_success():
+    pico = FakePico(drop_end=2)
+    s = sender(pico)
+    assert s.send(DATA)["update"] == "success"
+    assert pico.ends == 3
+    assert s.retransmits == 2
+
+
+@pytest.mark.parametrize("window", [2, 4, 8])
+def test_windowed_clean(window):
+    pico = FakePico(window=window)
+    s = sender(pico, window)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+    assert s.retransmits == 0
+
+
+def test_windowed_resends_only_missing_chunks():
+    # Frame 1 (seq 1) is lost; seq 2 and 3 are held and sacked, so only
+    # seq 1 goes out again. Frame 6 (seq 6) arrives corrupt.
+    pico = FakePico(window=4, drop_frame=[1], corrupt=[6])
+    s = sender(pico, 4)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+    assert s.retransmits == 2
+    assert pico.frames == 12
+
+
+def test_windowed_survives_lost_acks():
+    pico = FakePico(window=4, drop_reply=[1, 2, 3, 7])
+    s = sender(pico, 4)
+    assert s.send(DATA)["update"] == "success"
+    assert bytes(pico.data) == DATA
+
+
+def test_sender_stops_on_failed():
+    class Refusing(FakePico):
+        def write(self, data):
+            self.out.append(b'{"update": "failed", "reason": "bad_filename"}\n')
+            return len(data)
+
+    with pytest.raises(RuntimeError):
+        sender(Refusing()).send(DATA)
@@ -0,0 +1,100 @@
+"""
+Host checks for the preformatted position telemetry in garage.py, against
+json.dumps of the dict send_position used to build. The formatter section
+is exec'd on its own, with the viper helpers run as plain Python.
+"""
+import json
+import math
+import os
+import random
+import types
+
+import pytest
+
+GARAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "garage.py")
+
+
+@pytest.fixture(scope="module")
+def fmt():
+    with open(GARAGE) as f:
+        src = f.read()
+    a = src.index("# Preformatted telemetry.")
+    b = src.index("def send_position(")
+    ns = {
+        "micropython": types.SimpleNamespace(viper=lambda f: f),
+        "ptr8": lambda b: b,
+        "ujson": json,
+        "math": math,
+    }
+    exec(src[a:b], ns)
+    return ns
+
+
+def device_round(x):
+    # MicroPython's round(x, 1): nearbyint(x*10)/10 in floats, so the sign
+    # of a zero result is kept. CPython's round(x, 1) is correctly rounded
+    # and differs at exact halves.
+    if not math.isfinite(x):
+        return x
+    return math.copysign(round(x * 10) / 10, x)
+
+
+def expected(pos, dist, light_on, light_value):
+    return (json.dumps({
+        "position_percent": device_round(pos),
+        "position_in": device_round(dist),
+        "light": "on" if light_on else "off",
+        "light_value": int(light_value),
+    }) + "\n").encode()
+
+
+def line(fmt, pos, dist, light_on=True, light_value=0):
+    return bytes(fmt["format_position_line"](pos, dist, light_on, light_value))
+
+
+@pytest.mark.parametrize("x", [
+    0.0, -0.0, 0.04, -0.04, 0.05, -0.05, 0.06, 0.1, -0.1, 0.15, 0.25, 0.95, 9.96,
+    42.37, 57.84, 99.95, 100.0, 108.0, -3.2, 99999.94, -99999.94,
+])
+def test_tenths_match_json(fmt, x):
+    assert line(fmt, x, x) == expected(x, x, True, 0)
+
+
+def test_negative_zero_keeps_sign(fmt):
+    assert b'"position_percent": -0.0' in line(fmt, -0.0, 1.0)
+    assert b'"position_percent": -0.0' in line(fmt, -0.04, 1.0)
+
+
+@pytest.mark.parametrize("x", [1e5, -1e5, 123456.78, 1e20, -1e20, float("inf"), float("-inf")])
+def test_out_of_range_left_to_json(fmt, x):
+    assert line(fmt, x, 1.0) == expected(x, 1.0, True, 0)
+
+
+def test_nan_left_to_json(fmt):
+    assert b'"position_percent": NaN' in line(fmt, float("nan"), 1.0)
+
+
+def test_light_fields(fmt):
+    assert line(fmt, 1.0, 2.0, False, 65535) == expected(1.0, 2.0, False, 65535)
+    assert line(fmt, 1.0, 2.0, True, 7.9) == expected(1.0, 2.0, True, 7.9)
+
+
+def test_random_inputs(fmt):
+    rnd = random.Random(15)
+    for _ in range(20000):
+        pos = rnd.uniform(-5, 105)
+        dist = rnd.uniform(0, 400)
+        value = rnd.randrange(65536)
+        assert line(fmt, pos, dist, value & 1, value) == expected(pos, dist, value & 1, value)
+
+
+def test_matches_cpython_round_away_from_halves(fmt):
+    # Off the exact halves the device rule and round(x, 1) agree.
+    for k in range(-500, 5000):
+        x = k / 10 + 0.03
+        assert line(fmt, x, x) == (json.dumps({
+            "position_percent": round(x, 1),
+            "position_in": round(x, 1),
+            "light": "on",
+            "light_value": 0,
+        }) + "\n").encode()